@@ -28,9 +28,13 @@ See http://habitat.habhub.org for more information.
 .. autosummary::
     :toctree: habitat
 
+    habitat.benchmarks
     habitat.parser
     habitat.parser_daemon
+    habitat.parser_replay
+    habitat.parser_backfill
     habitat.parser_modules
+    habitat.config_index
     habitat.loadable_manager
     habitat.sensors
     habitat.filters
@@ -45,10 +49,14 @@ __authors__ = "Adam Greig, Daniel Richman"
 __short_copyright__ = "2010-2012 " + __authors__
 __copyright__ = "Copyright " + __short_copyright__
 
+from . import benchmarks
 from . import filters
 from . import parser
 from . import parser_daemon
+from . import parser_replay
+from . import parser_backfill
 from . import parser_modules
+from . import config_index
 from . import loadable_manager
 from . import sensors
 from . import uploader
@@ -0,0 +1,37 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of the parser, sensors, filters and uploader.
+
+:mod:`corpus <habitat.benchmarks.corpus>` generates synthetic UKHAS
+telemetry, :mod:`runner <habitat.benchmarks.runner>` times functions over
+it and :mod:`suites <habitat.benchmarks.suites>` holds the benchmarks
+themselves. Run ``python -m habitat.benchmarks.suites`` to get ops/sec and
+latency percentiles for each, as JSON.
+
+.. autosummary::
+    :toctree: habitat
+
+    habitat.benchmarks.corpus
+    habitat.benchmarks.runner
+    habitat.benchmarks.suites
+"""
+
+from . import corpus
+from . import runner
+from . import suites
@@ -0,0 +1,182 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic UKHAS telemetry for benchmarking.
+
+:func:`make_config` builds a payload_configuration document with a single
+sentence of the requested number of fields, checksum and filters, and
+:func:`make_corpus` produces valid strings for it. Everything is generated
+from a seeded random number generator, so a given set of options always
+gives the same corpus.
+"""
+
+import random
+import base64
+
+from ..parser_modules import ukhas_parser
+
+__all__ = ["filter_chains", "make_config", "make_sentence", "make_corpus",
+           "make_telemetry_doc"]
+
+# Field types that are cycled through, after the standard fields.
+_extra_fields = [
+    ({"sensor": "base.ascii_int"}, lambda r: str(r.randint(-100, 30000))),
+    ({"sensor": "base.ascii_float"}, lambda r: "{0:.2f}".format(
+        r.uniform(-50, 50))),
+    ({"sensor": "base.string"}, lambda r: "".join(
+        r.choice("abcdefghijklmnopqrstuvwxyz") for i in xrange(6))),
+    ({"sensor": "stdtelem.coordinate", "format": "ddmm.mm"},
+        lambda r: "{0:02d}{1:05.2f}".format(r.randint(0, 80),
+                                            r.uniform(0, 59.99))),
+]
+
+# The standard leading fields, in order.
+_standard_fields = [
+    ({"name": "sentence_id", "sensor": "base.ascii_int"},
+        lambda r, i: str(i)),
+    ({"name": "time", "sensor": "stdtelem.time"},
+        lambda r, i: "{0:02d}:{1:02d}:{2:02d}".format(
+            r.randint(0, 23), r.randint(0, 59), r.randint(0, 59))),
+    ({"name": "latitude", "sensor": "stdtelem.coordinate",
+      "format": "dd.dddd"},
+        lambda r, i: "{0:.4f}".format(r.uniform(-90, 90))),
+    ({"name": "longitude", "sensor": "stdtelem.coordinate",
+      "format": "dd.dddd"},
+        lambda r, i: "{0:.4f}".format(r.uniform(-180, 180))),
+    ({"name": "altitude", "sensor": "base.ascii_int"},
+        lambda r, i: str(r.randint(0, 40000))),
+]
+
+#: Named chains of filters that may be given to :func:`make_config`.
+filter_chains = {
+    "none": {},
+    "light": {
+        "post": [
+            {"type": "normal", "filter": "common.invalid_location_zero"},
+        ]
+    },
+    "heavy": {
+        "intermediate": [
+            {"type": "normal", "filter": "common.semicolons_to_commas",
+             "checksum": "crc16-ccitt"},
+        ],
+        "post": [
+            {"type": "normal", "filter": "common.invalid_location_zero"},
+            {"type": "normal", "filter": "common.numeric_scale",
+             "source": "altitude", "destination": "altitude_km",
+             "factor": 0.001, "round": 3},
+            {"type": "normal", "filter": "common.zero_pad_coordinates",
+             "width": 4},
+        ]
+    }
+}
+
+
+def _fields(field_count):
+    """The first *field_count* field templates."""
+    fields = list(_standard_fields[:field_count])
+    for i in xrange(field_count - len(fields)):
+        template, value = _extra_fields[i % len(_extra_fields)]
+        template = dict(template, name="field_{0}".format(i))
+        fields.append((template, lambda r, i, value=value: value(r)))
+    return fields
+
+
+def make_config(callsign="BENCH", field_count=8, checksum="crc16-ccitt",
+                filters="none"):
+    """
+    Returns a payload_configuration document with one UKHAS sentence for
+    *callsign*, with *field_count* fields, the *checksum* algorithm, and the
+    filters in :data:`filter_chains` [*filters*].
+
+    The first five fields are the usual sentence id, time, latitude,
+    longitude and altitude; the rest cycle through integers, floats,
+    strings and degrees-and-minutes coordinates.
+    """
+    sentence = {
+        "protocol": "UKHAS",
+        "callsign": callsign,
+        "checksum": checksum,
+        "fields": [dict(template)
+                   for template, value in _fields(field_count)],
+        "filters": filter_chains[filters]
+    }
+    if filters == "heavy":
+        # semicolons_to_commas must fix the right checksum.
+        sentence["filters"] = dict(sentence["filters"], intermediate=[
+            dict(f, checksum=checksum)
+            for f in sentence["filters"]["intermediate"]])
+
+    return {
+        "_id": "benchmark_" + callsign,
+        "type": "payload_configuration",
+        "name": "Benchmark " + callsign,
+        "time_created": "2012-07-14T22:00:00Z",
+        "sentences": [sentence]
+    }
+
+
+def make_sentence(config, index=0, rng=None, separator=","):
+    """
+    Returns a valid string for the first sentence in *config* (which must
+    have been created by :func:`make_config`), with random field values
+    separated by *separator*.
+    """
+    if rng is None:
+        rng = random.Random(index)
+
+    sentence = config["sentences"][0]
+    values = [value(rng, index) for template, value in
+              _fields(len(sentence["fields"]))]
+    body = sentence["callsign"] + "," + separator.join(values)
+
+    checksum = sentence["checksum"]
+    if checksum == "none":
+        return "$$" + body + "\n"
+    else:
+        name, function = ukhas_parser.checksum_functions[checksum]
+        # Checksums are over the sentence as transmitted.
+        return "$$" + body + "*" + function(body) + "\n"
+
+
+def make_corpus(count=1000, seed=0, **options):
+    """
+    Returns *config*, [*count* strings] where *config* is from
+    :func:`make_config` with *options*.
+
+    If the ``heavy`` filter chain is used, the fields after the callsign are
+    separated by semicolons, for the intermediate filter to fix.
+    """
+    config = make_config(**options)
+    separator = ";" if options.get("filters") == "heavy" else ","
+    rng = random.Random(seed)
+    strings = [make_sentence(config, i, rng, separator)
+               for i in xrange(count)]
+    return config, strings
+
+
+def make_telemetry_doc(string, index=0):
+    """Wrap *string* in a payload_telemetry document, as the parser wants."""
+    return {
+        "_id": "telemetry_{0}".format(index),
+        "type": "payload_telemetry",
+        "data": {"_raw": base64.b64encode(string)},
+        "receivers": {"BENCH_RX": {
+            "time_created": "2012-07-14T22:00:00Z",
+            "time_uploaded": "2012-07-14T22:00:00Z"}}
+    }
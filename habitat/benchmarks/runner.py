@@ -0,0 +1,105 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Timing of benchmark functions.
+
+:func:`measure` calls a function repeatedly over a list of inputs, timing
+each call, and returns a dictionary of results that is straightforward to
+serialise as JSON and compare between runs.
+"""
+
+import math
+import time
+import itertools
+
+__all__ = ["measure", "percentile"]
+
+
+def percentile(samples, p):
+    """
+    Returns the *p*-th percentile of *samples*, which must be sorted,
+    using the nearest-rank method; None if *samples* is empty.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    """
+    if not samples:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(samples)))
+    return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def measure(name, func, inputs, min_time=1.0, max_calls=None, warmup=10):
+    """
+    Call *func* with each item of *inputs* in turn, over and over, until
+    *min_time* seconds have passed or, if *max_calls* is given, until that
+    many calls have been made.
+
+    The first *warmup* calls are made but not timed. Returns a dict::
+
+        {"name": name, "calls": number of timed calls,
+         "ops_per_sec": calls per second,
+         "elapsed": seconds taken, including timing overhead,
+         "latency": {"mean", "p50", "p95", "p99", "max"}}
+
+    where latencies are in microseconds.
+    """
+    if not inputs:
+        raise ValueError("no inputs to benchmark with")
+
+    cycle = itertools.cycle(inputs)
+    for i in xrange(warmup):
+        func(next(cycle))
+
+    samples = []
+    clock = time.time
+    started = clock()
+    finish = started + min_time
+
+    while True:
+        item = next(cycle)
+        start = clock()
+        func(item)
+        end = clock()
+        samples.append(end - start)
+
+        if max_calls is not None and len(samples) >= max_calls:
+            break
+        if end >= finish and max_calls is None:
+            break
+
+    elapsed = clock() - started
+    total = sum(samples)
+    samples.sort()
+
+    def us(seconds):
+        return round(seconds * 1e6, 3)
+
+    return {
+        "name": name,
+        "calls": len(samples),
+        "ops_per_sec": round(len(samples) / total, 1) if total else None,
+        "elapsed": round(elapsed, 3),
+        "latency": {
+            "mean": us(total / len(samples)),
+            "p50": us(percentile(samples, 50)),
+            "p95": us(percentile(samples, 95)),
+            "p99": us(percentile(samples, 99)),
+            "max": us(samples[-1])
+        }
+    }
@@ -0,0 +1,349 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of habitat's hot paths.
+
+Each benchmark in :data:`benchmarks` is a function that takes a dictionary
+of options and returns a list of results from
+:func:`habitat.benchmarks.runner.measure`. The options are:
+
+* ``count``: the number of strings in the corpus (default 200)
+* ``field_count``: the number of fields per sentence (default 8)
+* ``checksum``: the checksum algorithm (default ``crc16-ccitt``)
+* ``filters``: a chain from :data:`habitat.benchmarks.corpus.filter_chains`
+  (default ``light``)
+* ``min_time``: how long to run each measurement for (default 1 second)
+* ``max_calls``: stop each measurement after this many calls instead
+
+Run them from the command line with::
+
+    python -m habitat.benchmarks.suites [--option value ...] [benchmark ...]
+
+which prints the results as JSON, one object per line.
+"""
+
+import os
+import sys
+import json
+
+from .. import parser
+from .. import parser_daemon
+from .. import sensors
+from .. import filters
+from .. import uploader
+from ..utils import metrics
+from ..utils import memory_couch
+from ..parser_modules import ukhas_parser
+from . import corpus
+from .runner import measure
+
+__all__ = ["bench_ukhas_parser", "bench_parser", "bench_daemon",
+           "bench_checksums", "bench_sensors", "bench_filters",
+           "bench_extractor", "benchmarks", "run_all", "main"]
+
+default_options = {
+    "count": 200,
+    "field_count": 8,
+    "checksum": "crc16-ccitt",
+    "filters": "light",
+    "min_time": 1.0,
+    "max_calls": None
+}
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+#: Enough configuration to run a :class:`habitat.parser.Parser`.
+parser_config = {
+    "parser": {
+        "certs_dir": os.path.join(_root, "certs"),
+        "modules": [
+            {"name": "UKHAS",
+             "class": "habitat.parser_modules.ukhas_parser.UKHASParser"}
+        ]
+    },
+    "loadables": [
+        {"name": "sensors.base", "class": "habitat.sensors.base"},
+        {"name": "sensors.stdtelem", "class": "habitat.sensors.stdtelem"},
+        {"name": "filters.common", "class": "habitat.filters"}
+    ]
+}
+
+
+class _NullSink(object):
+    def send(self, counters, timings):
+        pass
+
+
+class _NullUploader(object):
+    def payload_telemetry(self, string, metadata=None, time_created=None):
+        pass
+
+
+class _QuietManager(uploader.ExtractorManager):
+    def status(self, msg):
+        pass
+
+    def data(self, d):
+        pass
+
+
+def _measure(name, func, inputs, options):
+    return measure(name, func, inputs, min_time=options["min_time"],
+                   max_calls=options["max_calls"])
+
+
+def _corpus(options):
+    return corpus.make_corpus(options["count"],
+                              field_count=options["field_count"],
+                              checksum=options["checksum"],
+                              filters=options["filters"])
+
+
+def bench_ukhas_parser(options):
+    """
+    :meth:`UKHASParser.parse`, compiled and not, ``parse_many`` of batches of
+    100 strings, and ``pre_parse``.
+    """
+    p = parser.Parser(parser_config, db=memory_couch.Database())
+    module = ukhas_parser.UKHASParser(p)
+    options = dict(options, filters="none")
+    config, strings = _corpus(options)
+    sentence = config["sentences"][0]
+    plan = module.compile(sentence)
+
+    batches = [strings[i:i + 100] for i in xrange(0, len(strings), 100)]
+
+    return [
+        _measure("ukhas_parser.pre_parse", module.pre_parse, strings,
+                 options),
+        _measure("ukhas_parser.parse",
+                 lambda s: module.parse(s, sentence), strings, options),
+        _measure("ukhas_parser.parse_compiled",
+                 lambda s: module.parse(s, plan), strings, options),
+        _measure("ukhas_parser.parse_many_100",
+                 lambda b: module.parse_many(b, plan), batches, options)
+    ]
+
+
+def bench_parser(options):
+    """
+    :meth:`Parser.parse` of whole telemetry documents, including filters and
+    configuration lookup, against an in-memory database.
+    """
+    config, strings = _corpus(options)
+    db = memory_couch.Database()
+    db.save_doc(config)
+    p = parser.Parser(parser_config, db=db)
+    docs = [corpus.make_telemetry_doc(s, i) for i, s in enumerate(strings)]
+
+    def parse(doc):
+        p.parse(dict(doc, data=dict(doc["data"])))
+
+    def parse_many(docs):
+        p.parse_many([dict(d, data=dict(d["data"])) for d in docs])
+
+    batches = [docs[i:i + 50] for i in xrange(0, len(docs), 50)]
+
+    return [
+        _measure("parser.parse", parse, docs, options),
+        _measure("parser.parse_many_50", parse_many, batches, options)
+    ]
+
+
+def bench_daemon(options):
+    """
+    Uploading telemetry with :class:`habitat.uploader.Uploader`, and
+    parsing and saving it with
+    :class:`ParserDaemon <habitat.parser_daemon.ParserDaemon>`, against an
+    in-memory database.
+    """
+    config, strings = _corpus(options)
+    db = memory_couch.Database()
+    db.save_doc(config)
+    listener = uploader.Uploader("BENCH_RX", db=db)
+    upload = _measure("uploader.payload_telemetry", listener.payload_telemetry,
+                      strings, options)
+
+    daemon = parser_daemon.ParserDaemon(parser_config, db=db)
+    changes = db.changes(filter="parser/unparsed", include_docs=True)
+    parse = _measure("parser_daemon.change", daemon._couch_callback,
+                     changes["results"], options)
+    return [upload, parse]
+
+
+def bench_checksums(options):
+    """Each checksum algorithm over the sentences in the corpus."""
+    config, strings = _corpus(options)
+    bodies = [s[2:s.index("*")] if "*" in s else s[2:-1] for s in strings]
+
+    return [_measure("checksums." + name, function, bodies, options)
+            for name, (label, function)
+            in sorted(ukhas_parser.checksum_functions.items())]
+
+
+def bench_sensors(options):
+    """The :mod:`stdtelem <habitat.sensors.stdtelem>` sensors."""
+    config, strings = _corpus(dict(options, field_count=5, filters="none"))
+    fields = [s[2:s.index("*")].split(",") for s in strings]
+    times = [f[2] for f in fields]
+    coordinates = [f[3] for f in fields]
+    ddmm = ["{0:02d}{1:05.2f}".format(i % 90, i * 0.37 % 60)
+            for i in xrange(len(strings))]
+
+    return [
+        _measure("sensors.stdtelem.time", sensors.stdtelem.time, times,
+                 options),
+        _measure("sensors.stdtelem.coordinate.dd.dddd",
+                 lambda c: sensors.stdtelem.coordinate(
+                     {"format": "dd.dddd"}, c),
+                 coordinates, options),
+        _measure("sensors.stdtelem.coordinate.ddmm.mm",
+                 lambda c: sensors.stdtelem.coordinate(
+                     {"format": "ddmm.mm"}, c),
+                 ddmm, options),
+        _measure("sensors.base.ascii_float",
+                 lambda c: sensors.base.ascii_float({}, c),
+                 coordinates, options)
+    ]
+
+
+def bench_filters(options):
+    """The common filters, on strings and on parsed data."""
+    config, strings = _corpus(dict(options, filters="none"))
+    semicolons = [s.replace(",", ";") for s in strings]
+    data = [{"latitude": 51.2, "longitude": -0.12, "altitude": i * 10}
+            for i in xrange(len(strings))]
+    scale = {"source": "altitude", "destination": "altitude_km",
+             "factor": 0.001, "round": 3}
+    pad = {"width": 4}
+
+    return [
+        _measure("filters.semicolons_to_commas",
+                 lambda s: filters.semicolons_to_commas(
+                     {"checksum": options["checksum"]}, s),
+                 semicolons, options),
+        _measure("filters.numeric_scale",
+                 lambda d: filters.numeric_scale(scale, d), data, options),
+        _measure("filters.zero_pad_coordinates",
+                 lambda d: filters.zero_pad_coordinates(pad, dict(d)),
+                 data, options),
+        _measure("filters.invalid_location_zero",
+                 filters.invalid_location_zero, data, options)
+    ]
+
+
+def bench_extractor(options):
+    """
+    :meth:`UKHASExtractor.push`, byte by byte, for whole strings, and with
+    the corpus' payload_configuration, so checking checksums as it goes;
+    and :meth:`UKHASExtractor.push_bytes` of the whole corpus, in 4k chunks.
+    """
+    config, strings = _corpus(options)
+    stream = "".join(strings)
+    chunks = [stream[i:i + 4096] for i in xrange(0, len(stream), 4096)]
+
+    def manager(extractor):
+        manager = _QuietManager(_NullUploader())
+        manager.add(extractor)
+        return manager
+
+    def pusher(extractor):
+        push = manager(extractor).push
+
+        def push_string(string):
+            for b in string:
+                push(b)
+        return push_string
+
+    return [
+        _measure("uploader.extractor.push_string",
+                 pusher(uploader.UKHASExtractor()), strings, options),
+        _measure("uploader.extractor.push_string_checked",
+                 pusher(uploader.UKHASExtractor([config])), strings, options),
+        _measure("uploader.extractor.push_bytes_4k",
+                 manager(uploader.UKHASExtractor()).push_bytes, chunks,
+                 options)
+    ]
+
+
+#: All benchmarks, by name.
+benchmarks = {
+    "ukhas_parser": bench_ukhas_parser,
+    "parser": bench_parser,
+    "daemon": bench_daemon,
+    "checksums": bench_checksums,
+    "sensors": bench_sensors,
+    "filters": bench_filters,
+    "extractor": bench_extractor
+}
+
+
+def run_all(names=None, **options):
+    """
+    Run the benchmarks named in *names* (or all of them) with *options*,
+    returning a list of results.
+    """
+    if names is None:
+        names = sorted(benchmarks)
+    options = dict(default_options, **options)
+
+    results = []
+    for name in names:
+        for result in benchmarks[name](options):
+            result["options"] = dict(
+                (k, options[k]) for k in
+                ("count", "field_count", "checksum", "filters"))
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point: parse ``--option value`` pairs and benchmark
+    names from *argv* and print the results as JSON lines.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    options = {}
+    names = []
+    args = iter(argv)
+    for arg in args:
+        if arg.startswith("--"):
+            key = arg[2:].replace("-", "_")
+            if key not in default_options:
+                raise ValueError("Unknown option: " + arg)
+            value = next(args)
+            if key in ("count", "field_count", "max_calls"):
+                value = int(value)
+            elif key == "min_time":
+                value = float(value)
+            options[key] = value
+        elif arg in benchmarks:
+            names.append(arg)
+        else:
+            raise ValueError("Unknown benchmark: " + arg)
+
+    metrics.configure(sink=_NullSink())
+
+    for result in run_all(names or None, **options):
+        print json.dumps(result, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
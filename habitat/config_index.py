@@ -0,0 +1,403 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An in-memory index of flight and payload_configuration documents.
+
+The parser needs to find a payload_configuration document for every
+telemetry string it receives. Rather than asking CouchDB's views for every
+string, :class:`ConfigIndex` loads the relevant documents once at startup and
+then follows the ``_changes`` feed (through the ``parser/config`` filter) to
+keep itself up to date. Looking up a configuration is then a dictionary hit.
+
+The results of :meth:`ConfigIndex.lookup` are identical to those of
+:meth:`habitat.parser.Parser._find_config_doc`, which it replaces when
+``config_index`` is set in the parser's configuration.
+
+When the index isn't used, a :class:`MissingConfigCache` may instead
+remember (for a while) the callsigns that have no configuration at all,
+following the same feed to forget them as soon as a configuration appears.
+
+Both need the ``parser/config`` filter from the design documents: their
+``start`` methods raise :exc:`FilterMissing` if it hasn't been uploaded,
+rather than following a feed that will never work.
+"""
+
+import time
+import logging
+import threading
+import couchdbkit.exceptions
+
+from .utils import immortal_changes, rfc3339
+from .utils.frozen import freeze
+
+logger = logging.getLogger("habitat.config_index")
+
+__all__ = ['ConfigIndex', 'MissingConfigCache', 'FilterMissing']
+
+_FILTER = "parser/config"
+
+
+class FilterMissing(Exception):
+    """
+    Raised when the database doesn't have the ``parser/config`` filter,
+    so the changes feed can't be followed.
+    """
+    pass
+
+
+class ConfigIndex(object):
+    """
+    Keeps track of approved flights and all payload_configuration documents.
+
+    Call :meth:`start` to build the index and then follow the changes feed
+    in a background thread. :meth:`build`, :meth:`follow` and
+    :meth:`handle_change` are available separately should you wish to
+    drive the index yourself.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.last_seq = None
+
+        self._lock = threading.RLock()
+        self._thread = None
+
+        # flight id -> (end, start, [payload_configuration ids])
+        self._flights = {}
+        # payload_configuration id -> (time_created, frozen doc)
+        self._configs = {}
+        # payload_configuration id -> set of flight ids referencing it
+        self._config_flights = {}
+        # callsign -> set of payload_configuration ids mentioning it
+        self._callsign_configs = {}
+
+    def start(self):
+        """
+        Build the index, then follow the changes feed in a daemon thread.
+
+        Raises :exc:`FilterMissing` if the database doesn't have the
+        ``parser/config`` filter.
+        """
+        _check_filter(self.db)
+        self.build()
+        self._thread = threading.Thread(target=self.follow,
+                                        name="habitat ConfigIndex")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def build(self):
+        """
+        Load approved, unfinished flights and all payload_configuration
+        documents from the database.
+
+        The database's ``update_seq`` is read before the views are queried,
+        so that no change is missed when :meth:`follow` is later called.
+        """
+        seq = self.db.info()["update_seq"]
+        now = int(time.time())
+
+        flights = self.db.view("flight/end_start_including_payloads",
+                               include_docs=True, startkey=[now])
+        configs = self.db.view(
+            "payload_configuration/callsign_time_created_index",
+            include_docs=True)
+
+        with self._lock:
+            # Rows are either the flight itself or a linked configuration,
+            # which may be None if the linked document doesn't exist.
+            for row in flights:
+                if row["doc"] is not None:
+                    self._add(row["doc"])
+
+            for row in configs:
+                if row["id"] not in self._configs:
+                    self._add(row["doc"])
+
+            self.last_seq = seq
+
+        logger.info("Config index built: {0} flights, {1} configurations"
+                    .format(len(self._flights), len(self._configs)))
+
+    def follow(self):
+        """
+        Follow the changes feed from :attr:`last_seq` forever, updating the
+        index with each change.
+        """
+        consumer = immortal_changes.Consumer(self.db)
+        consumer.wait(self.handle_change, filter=_FILTER,
+                      since=self.last_seq, include_docs=True,
+                      heartbeat=1000)
+
+    def handle_change(self, result):
+        """
+        Update the index given a row from the ``_changes`` feed (which must
+        have been requested with ``include_docs``).
+        """
+        with self._lock:
+            self._remove(result["id"])
+            if not result.get("deleted", False) and result.get("doc"):
+                self._add(result["doc"])
+            self.last_seq = result["seq"]
+
+    def lookup(self, callsign, now=None):
+        """
+        Find the payload_configuration document that should be used to parse
+        telemetry from *callsign* at time *now* (defaults to the present).
+
+        Returns a dict in the same format as
+        :meth:`habitat.parser.Parser._find_config_doc`, or ``None``.
+        """
+        if now is None:
+            now = int(time.time())
+
+        with self._lock:
+            config_ids = self._callsign_configs.get(callsign)
+            if not config_ids:
+                return None
+
+            flight = self._find_active_flight(config_ids, now)
+            if flight is not None:
+                flight_id, config_id = flight
+                return {
+                    "id": config_id,
+                    "flight_id": flight_id,
+                    "payload_configuration": self._configs[config_id][1]
+                }
+
+            config_id = max(config_ids, key=lambda c: (self._configs[c][0], c))
+            return {
+                "id": config_id,
+                "payload_configuration": self._configs[config_id][1]
+            }
+
+    def _find_active_flight(self, config_ids, now):
+        """
+        Returns (flight_id, config_id) for the first active flight (sorted by
+        window end then start) that links to one of *config_ids*, or None.
+        """
+        flight_ids = set()
+        for config_id in config_ids:
+            flight_ids.update(self._config_flights.get(config_id, ()))
+
+        candidates = []
+        for flight_id in flight_ids:
+            end, start, payloads = self._flights[flight_id]
+            if end < now:
+                # The flight is over and may be forgotten.
+                self._remove_flight(flight_id)
+            elif start < now:
+                candidates.append((end, start, flight_id))
+
+        if not candidates:
+            return None
+
+        end, start, flight_id = min(candidates)
+        for config_id in self._flights[flight_id][2]:
+            if config_id in config_ids:
+                return flight_id, config_id
+
+    def _add(self, doc):
+        if doc.get("type") == "flight":
+            if doc.get("approved"):
+                self._add_flight(doc)
+        elif doc.get("type") == "payload_configuration":
+            self._add_config(doc)
+
+    def _remove(self, doc_id):
+        if doc_id in self._flights:
+            self._remove_flight(doc_id)
+        if doc_id in self._configs:
+            self._remove_config(doc_id)
+
+    def _add_flight(self, doc):
+        payloads = doc.get("payloads", [])
+        if not payloads:
+            return
+
+        end = rfc3339.rfc3339_to_timestamp(doc["end"])
+        start = rfc3339.rfc3339_to_timestamp(doc["start"])
+
+        self._flights[doc["_id"]] = (end, start, payloads)
+        for config_id in payloads:
+            self._config_flights.setdefault(config_id, set()).add(doc["_id"])
+
+    def _remove_flight(self, flight_id):
+        end, start, payloads = self._flights.pop(flight_id)
+        for config_id in payloads:
+            flights = self._config_flights[config_id]
+            flights.discard(flight_id)
+            if not flights:
+                del self._config_flights[config_id]
+
+    def _add_config(self, doc):
+        created = rfc3339.rfc3339_to_timestamp(doc["time_created"])
+        self._configs[doc["_id"]] = (created, freeze(doc))
+        for callsign in _callsigns(doc):
+            self._callsign_configs.setdefault(callsign, set()).add(doc["_id"])
+
+    def _remove_config(self, config_id):
+        created, doc = self._configs.pop(config_id)
+        for callsign in _callsigns(doc):
+            configs = self._callsign_configs[callsign]
+            configs.discard(config_id)
+            if not configs:
+                del self._callsign_configs[callsign]
+
+    _repr_format = "<habitat.ConfigIndex: {f} flights, {c} configurations>"
+
+    def __repr__(self):
+        return self._repr_format.format(f=len(self._flights),
+                                        c=len(self._configs))
+
+
+class MissingConfigCache(object):
+    """
+    Remembers callsigns for which no payload_configuration document exists,
+    for at most *ttl* seconds each.
+
+    Call :meth:`start` to follow the changes feed in a background thread:
+    a new or changed payload_configuration document removes the callsigns
+    it mentions from the cache, and a change to any flight document empties
+    it.
+
+    Since a configuration could be created while the views are being
+    queried, read :attr:`generation` before looking for a configuration and
+    give it to :meth:`add`; the callsign is only cached if nothing has
+    changed in the meantime.
+
+    Expired callsigns are forgotten when next looked up, and every
+    :attr:`sweep_every` calls to :meth:`add` all expired callsigns are
+    removed, so that garbage callsigns from corrupt strings (which are
+    rarely seen twice) do not accumulate.
+    """
+
+    sweep_every = 1000
+
+    def __init__(self, db, ttl):
+        self.db = db
+        self.ttl = ttl
+        self.last_seq = None
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # callsign -> time after which it should be looked up again
+        self._expires = {}
+        self._adds = 0
+
+    def start(self):
+        """
+        Follow the changes feed from now on, in a daemon thread.
+
+        Raises :exc:`FilterMissing` if the database doesn't have the
+        ``parser/config`` filter.
+        """
+        _check_filter(self.db)
+        self.last_seq = self.db.info()["update_seq"]
+        self._thread = threading.Thread(target=self.follow,
+                                        name="habitat MissingConfigCache")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def follow(self):
+        """
+        Follow the changes feed from :attr:`last_seq` forever, invalidating
+        the cache as configurations change.
+        """
+        consumer = immortal_changes.Consumer(self.db)
+        consumer.wait(self.handle_change, filter=_FILTER,
+                      since=self.last_seq, include_docs=True,
+                      heartbeat=1000)
+
+    def handle_change(self, result):
+        """
+        Invalidate callsigns given a row from the ``_changes`` feed (which
+        must have been requested with ``include_docs``).
+        """
+        doc = result.get("doc") or {}
+
+        with self._lock:
+            if doc.get("type") == "payload_configuration":
+                for callsign in _callsigns(doc):
+                    self._expires.pop(callsign, None)
+            elif doc.get("type") == "flight":
+                self._expires.clear()
+            self.generation += 1
+            self.last_seq = result["seq"]
+
+    def add(self, callsign, generation, now=None):
+        """
+        Remember that *callsign* has no configuration, unless the cache
+        has been invalidated since *generation* was read.
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if generation == self.generation:
+                self._expires[callsign] = now + self.ttl
+
+            self._adds += 1
+            if self._adds >= self.sweep_every:
+                self._adds = 0
+                self._sweep(now)
+
+    def _sweep(self, now):
+        expired = [callsign for callsign, expires in self._expires.iteritems()
+                   if expires <= now]
+        for callsign in expired:
+            del self._expires[callsign]
+
+    def is_missing(self, callsign, now=None):
+        """
+        Returns True if *callsign* is known to have no configuration.
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            expires = self._expires.get(callsign)
+            if expires is None:
+                return False
+            elif expires <= now:
+                del self._expires[callsign]
+                return False
+            else:
+                return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expires)
+
+
+def _callsigns(doc):
+    """The set of callsigns mentioned by a payload_configuration *doc*"""
+    return set(s["callsign"] for s in doc.get("sentences", []))
+
+
+def _check_filter(db):
+    """
+    Make sure *db* has the ``parser/config`` filter, raising
+    :exc:`FilterMissing` if not.
+    """
+    try:
+        db.res.get("_changes", filter=_FILTER, limit=0)
+    except couchdbkit.exceptions.ResourceNotFound:
+        raise FilterMissing("The {0} filter is missing: upload the design "
+                            "documents".format(_FILTER))
@@ -191,17 +191,15 @@ def zero_pad_coordinates(config, data):
     post-decimal-point width is `config["width"]`. By default fields is
     `["latitude", "longitude"]` and width is 5.
     """
-    if "fields" not in config:
-        config["fields"] = ["latitude", "longitude"]
-    if "width" not in config:
-        config["width"] = 5
-    for field in config["fields"]:
+    fields = config.get("fields", ["latitude", "longitude"])
+    width = config.get("width", 5)
+    for field in fields:
         if field not in data:
             raise ValueError(
                 "Field for filtering could not be found: {0}".format(field))
-    for field in config["fields"]:
+    for field in fields:
         parts = [int(x) for x in str(data[field]).split(".")]
-        fmtstr = "{{0}}.{{1:0{0}n}}".format(config["width"])
+        fmtstr = "{{0}}.{{1:0{0}n}}".format(width)
         data[field] = float(fmtstr.format(*parts))
     return data
 
@@ -216,10 +214,8 @@ def zero_pad_times(config, data):
     `config["checksum"]` and defaults to `crc16-ccitt`.
     """
     # set defaults
-    if "field" not in config:
-        config["field"] = 2
-    if "checksum" not in config:
-        config["checksum"] = "crc16-ccitt"
+    index = config.get("field", 2)
+    checksum_algorithm = config.get("checksum", "crc16-ccitt")
 
     # get at individual fields, removing newline and checksum
     fields = data.split(",")
@@ -230,11 +226,11 @@ def zero_pad_times(config, data):
         checksum = "*{0}".format(checksum)
 
     # check field exists
-    if len(fields) <= config["field"]:
+    if len(fields) <= index:
         raise ValueError("Configured field index is not in sentence.")
 
     # must use colons
-    timefield = fields[config["field"]]
+    timefield = fields[index]
     if ":" not in timefield:
         raise ValueError("Can only zero pad times that use a colon delimiter")
 
@@ -243,10 +239,10 @@ def zero_pad_times(config, data):
     timefield = "{0:02n}:{1:02n}".format(timeparts[0], timeparts[1])
     if len(timeparts) == 3:
         timefield = "{0}:{1:02n}".format(timefield, timeparts[2])
-    fields[config["field"]] = timefield
+    fields[index] = timefield
 
     # add checksum and newline back
     fields[-1] = "{0}{1}\n".format(fields[-1], checksum)
     new = ",".join(fields)
     # fix checksum
-    return filtertools.UKHASChecksumFixer.fix(config["checksum"], data, new)
+    return filtertools.UKHASChecksumFixer.fix(checksum_algorithm, data, new)
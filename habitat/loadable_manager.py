@@ -91,6 +91,15 @@ See :py:mod:`habitat.filters` for some filters included with habitat.
 Filters can take one or two arguments, *config*, *data* or just *data*. They
 should return a suitably modified form of data, optionally using anything from
 *config* which was specified by the user in the flight document.
+
+Resolving
+=========
+
+Every function is looked up and inspected once, when its module is loaded,
+and :meth:`LoadableManager.resolve` returns a callable that always takes
+*config* and *data*. Code that runs the same loadable many times (such as
+a parser module's compiled sentence) should resolve it once and then call
+the result, rather than using :meth:`LoadableManager.run` each time.
 """
 
 from .utils import dynamicloader
@@ -108,46 +117,66 @@ class LoadableManager:
         """
 
         self.libraries = {}
+        self.functions = {}
 
         for loadable in config["loadables"]:
             self.load(loadable["class"], loadable["name"])
 
     def load(self, module, shorthand):
-        """Loads *module* as a library and assigns it to *shorthand*."""
+        """
+        Loads *module* as a library and assigns it to *shorthand*, adding
+        each function in its ``__all__`` to :attr:`functions`.
+        """
 
         module = dynamicloader.load(module)
         self.libraries[shorthand] = module
 
-    def run(self, name, config, data):
+        for function_name in module.__all__:
+            func = getattr(module, function_name)
+            name = shorthand + "." + function_name
+            self.functions[name] = _adapt(func)
+
+    def resolve(self, name):
         """
-        Run the loadable specified by *name*, giving it *config* and *data*.
+        Find the loadable specified by *name*, returning a function that
+        takes *config* and *data* and runs it.
 
         If the loadable only takes one argument, it will only be given *data*.
         *config* is ignored in this case.
-
-        Returns the result of running the loadable.
         """
 
-        name_parts = name.split('.')
-        library_name = '.'.join(name_parts[0:-1])
-        function_name = name_parts[-1]
+        try:
+            return self.functions[name]
+        except KeyError:
+            library_name = name.rpartition('.')[0]
+            if library_name not in self.libraries:
+                raise ValueError("Invalid library name: " + library_name)
+            raise ValueError("Invalid function name: " + name)
 
-        if library_name not in self.libraries:
-            raise ValueError("Invalid library name: " + library_name)
-
-        library = self.libraries[library_name]
+    def run(self, name, config, data):
+        """
+        Run the loadable specified by *name*, giving it *config* and *data*.
 
-        if function_name not in library.__all__:
-            raise ValueError("Invalid function name: " + function_name)
+        If the loadable only takes one argument, it will only be given *data*.
+        *config* is ignored in this case.
 
-        func = getattr(library, function_name)
+        Returns the result of running the loadable.
+        """
 
-        if dynamicloader.hasnumargs(func, 1):
-            return func(data)
-        else:
-            return func(config, data)
+        return self.resolve(name)(config, data)
 
     _repr_format = "<habitat.LoadableManager: {l} libraries loaded>"
 
     def __repr__(self):
         return self._repr_format.format(l=len(self.libraries))
+
+
+def _adapt(func):
+    """Wrap *func*, if necessary, so that it takes *config* and *data*."""
+    if dynamicloader.hasnumargs(func, 1):
+        def adapter(config, data):
+            return func(data)
+        adapter.__name__ = func.__name__
+        return adapter
+    else:
+        return func
@@ -21,6 +21,7 @@ Interpret incoming telemetry strings into useful telemetry data.
 
 import base64
 import logging
+import collections
 import hashlib
 import M2Crypto
 import os
@@ -28,14 +29,14 @@ import couchdbkit
 import copy
 import re
 import json
-import statsd
 import time
 
 from . import loadable_manager
-from .utils import dynamicloader, rfc3339
+from . import config_index
+from .utils import dynamicloader, lru, metrics, rfc3339, tracing
+from .utils.frozen import freeze
 
 logger = logging.getLogger("habitat.parser")
-statsd.init_statsd({'STATSD_BUCKET_PREFIX': 'habitat'})
 
 __all__ = ['Parser', 'ParserModule']
 
@@ -51,7 +52,7 @@ class Parser(object):
 
     ascii_exp = re.compile("^[\\x20-\\x7E]+$")
 
-    def __init__(self, config):
+    def __init__(self, config, db=None):
         """
         On construction, it will:
 
@@ -59,10 +60,23 @@ class Parser(object):
           'parser').
         * Load modules from ``self.config["modules"]``.
         * Connects to CouchDB using ``self.config["couch_uri"]`` and
-          ``config["couch_db"]``.
+          ``config["couch_db"]``, unless a database object *db* is given to
+          use instead.
+        * If ``self.config["config_index"]`` is true, builds an in-memory
+          :class:`ConfigIndex <habitat.config_index.ConfigIndex>` of
+          configuration documents which is kept up to date from the
+          changes feed.
+        * Otherwise, if ``self.config["missing_config_ttl"]`` is set,
+          remembers callsigns without configuration documents for that many
+          seconds, using a :class:`~habitat.config_index.MissingConfigCache`.
+        * If the ``parser/config`` filter needed by either of those isn't in
+          the database, logs an error and queries the views for every
+          string instead.
+        * If ``self.config["trace_log_interval"]`` is set, logs a summary of
+          how long each stage of parsing takes (see
+          :mod:`habitat.utils.tracing`) every that many seconds.
         """
 
-        config = copy.deepcopy(config)
         parser_config = config["parser"]
 
         self.loadable_manager = loadable_manager.LoadableManager(config)
@@ -73,18 +87,51 @@ class Parser(object):
         self.modules = []
 
         for module in parser_config["modules"]:
+            # Copy the module's dict (so that the config isn't modified) and
+            # freeze its pre-filters, which are used as filter configs.
+            module = dict(freeze(module))
             m = dynamicloader.load(module["class"])
             dynamicloader.expecthasmethod(m, "pre_parse")
             dynamicloader.expecthasmethod(m, "parse")
             dynamicloader.expecthasnumargs(m.pre_parse, 1)
             dynamicloader.expecthasnumargs(m.parse, 2)
             module["module"] = m(self)
+            module["compiles"] = dynamicloader.hasmethod(m, "compile")
+            module["parses_many"] = module["compiles"] and \
+                    dynamicloader.hasmethod(m, "parse_many")
+            # Pre-filters may change the string, so the raw data can't be
+            # sniffed for modules that have them.
+            module["sniffs"] = dynamicloader.hasmethod(m, "sniff") and \
+                    not module.get("pre-filters")
             self.modules.append(module)
 
-        self.couch_server = couchdbkit.Server(config["couch_uri"])
-        self.db = self.couch_server[config["couch_db"]]
+        if db is None:
+            self.couch_server = couchdbkit.Server(config["couch_uri"])
+            self.db = self.couch_server[config["couch_db"]]
+        else:
+            self.couch_server = None
+            self.db = db
+
+        if parser_config.get("trace_log_interval"):
+            tracing.start_logging(parser_config["trace_log_interval"])
 
-    @statsd.StatsdTimer.wrap('parser.time')
+        self.config_index = None
+        self.missing_configs = None
+        try:
+            if parser_config.get("config_index", False):
+                self.config_index = config_index.ConfigIndex(self.db)
+                self.config_index.start()
+            elif parser_config.get("missing_config_ttl"):
+                self.missing_configs = config_index.MissingConfigCache(
+                    self.db, parser_config["missing_config_ttl"])
+                self.missing_configs.start()
+        except config_index.FilterMissing:
+            logger.exception("Can't follow configuration changes; "
+                             "querying views for every string instead")
+            self.config_index = None
+            self.missing_configs = None
+
+    @metrics.timed('parser.time')
     def parse(self, doc, initial_config=None):
         """
         Attempts to parse telemetry information out of a new telemetry
@@ -94,7 +141,8 @@ class Parser(object):
         modules should be used to parse the message, and which
         payload_configuration document it should be given to do so
         (if *config* is specified, no attempt will be made to find any
-        other configuration document).
+        other configuration document). Modules are tried in the order given
+        by :meth:`_dispatch_order`.
 
         The resulting parsed document is returned, or None is returned if no
         data could be parsed.
@@ -115,16 +163,17 @@ class Parser(object):
         leading underscores.
         """
         data = None
-        raw_data = base64.b64decode(doc['data']['_raw'])
-        debug_type, debug_data = self._get_debug(raw_data)
-        receiver_callsign = doc['receivers'].keys()[0]
+        raw_data = self._get_raw_data(doc)
+        initial_config = freeze(initial_config)
 
-        logger.info("Parsing [{type}] {data!r} ({id}) from {who}"
-                    .format(id=doc["_id"], data=debug_data, type=debug_type,
-                            who=receiver_callsign))
+        modules, skipped = self._dispatch_order(raw_data)
+        if skipped:
+            metrics.increment("parser.sniff.skipped", skipped)
+        if not modules:
+            metrics.increment("parser.sniff.rejected")
 
-        for module in self.modules:
-            config = copy.deepcopy(initial_config)
+        for module in modules:
+            config = initial_config
             try:
                 callsign = self._get_callsign(raw_data, module)
                 config = self._get_config(callsign, config)
@@ -134,39 +183,208 @@ class Parser(object):
             break
 
         if type(data) is dict:
-            doc['data'].update(data)
-            logger.info("{module} parsed data from {callsign} successfully"
-                        .format(module=module["name"], callsign=callsign))
-            logger.debug("Parsed data: " + json.dumps(data, indent=2))
-            statsd.increment("parser.parsed")
+            self._merge_data(doc, data, module, callsign)
+            metrics.increment("parser.parsed")
             if "_protocol" in data:
-                statsd.increment(
+                metrics.increment(
                     "parser.protocol.{0}".format(data['_protocol']))
             return doc
         else:
             logger.info("All attempts to parse failed")
-            statsd.increment("parser.failed")
+            metrics.increment("parser.failed")
             return None
 
+    @metrics.timed('parser.batch_time')
+    def parse_many(self, docs, initial_config=None):
+        """
+        Attempts to parse a list of telemetry documents, *docs*, in one go.
+
+        Returns a list with one entry per document, in the same order as
+        *docs*: the parsed document, or None if no data could be parsed from
+        it. Each document is parsed exactly as :meth:`parse` would parse it
+        (including the meaning of *initial_config*), however callsigns are
+        extracted from every document up front and the documents are grouped
+        by callsign, so that each configuration is only looked up once per
+        group, and statistics are only sent once per batch.
+        """
+        results = [None] * len(docs)
+        counts = collections.Counter()
+        initial_config = freeze(initial_config)
+
+        # (index, raw_data, modules yet to be tried)
+        pending = []
+        unparsed = 0
+        for i, doc in enumerate(docs):
+            raw_data = self._get_raw_data(doc)
+            modules, skipped = self._dispatch_order(raw_data)
+            if skipped:
+                counts["parser.sniff.skipped"] += skipped
+            if modules:
+                pending.append((i, raw_data, modules))
+            else:
+                counts["parser.sniff.rejected"] += 1
+                unparsed += 1
+
+        while pending:
+            # Each round, every document is given to the next module in its
+            # dispatch order; documents are grouped by module (in the order
+            # the modules are configured) and then by callsign.
+            batches = collections.OrderedDict(
+                    (id(module), []) for module in self.modules)
+            for item in pending:
+                batches[id(item[2][0])].append(item)
+
+            failed = []
+
+            for batch in batches.itervalues():
+                if batch:
+                    module = batch[0][2][0]
+                    self._parse_batch(docs, batch, module, initial_config,
+                                      results, failed, counts)
+
+            pending = []
+            for i, raw_data, modules in sorted(failed):
+                if len(modules) > 1:
+                    pending.append((i, raw_data, modules[1:]))
+                else:
+                    unparsed += 1
+
+        if unparsed:
+            logger.info("All attempts to parse failed for {0} of {1} docs"
+                        .format(unparsed, len(docs)))
+            counts["parser.failed"] += unparsed
+
+        for bucket, count in counts.iteritems():
+            metrics.increment(bucket, count)
+
+        return results
+
+    def _parse_batch(self, docs, batch, module, initial_config, results,
+                     failed, counts):
+        """
+        Attempt to parse each item of *batch* with *module*, for
+        :meth:`parse_many`.
+
+        Parsed documents are placed in *results*, and items that could not
+        be parsed are appended to *failed*.
+        """
+        groups = collections.OrderedDict()
+
+        for item in batch:
+            try:
+                callsign = self._get_callsign(item[1], module)
+            except CantGetCallsign:
+                failed.append(item)
+            else:
+                groups.setdefault(callsign, []).append(item)
+
+        for callsign, group in groups.iteritems():
+            config = initial_config
+            try:
+                config = self._get_config(callsign, config)
+            except CantGetConfig:
+                failed.extend(group)
+                continue
+
+            many = [None] * len(group)
+            if len(group) > 1 and module.get("parses_many", False):
+                many = self._get_data_many([item[1] for item in group],
+                                           callsign, config, module)
+
+            for item, data in zip(group, many):
+                i, raw_data = item[:2]
+                try:
+                    if data is None:
+                        data = self._get_data(raw_data, callsign, config,
+                                              module)
+                except CantGetData:
+                    failed.append(item)
+                    continue
+
+                if type(data) is not dict:
+                    failed.append(item)
+                    continue
+
+                self._merge_data(docs[i], data, module, callsign)
+                results[i] = docs[i]
+                counts["parser.parsed"] += 1
+                if "_protocol" in data:
+                    counts["parser.protocol.{0}"
+                           .format(data['_protocol'])] += 1
+
+    def _dispatch_order(self, raw_data):
+        """
+        Decide which modules should be tried to parse *raw_data*, and in
+        what order.
+
+        Modules that implement ``sniff`` (see :meth:`ParserModule.parse`)
+        are asked whether *raw_data* looks like their protocol. Modules that
+        are sure it is come first, followed by those that might be able to
+        parse it (including all modules that don't sniff), in the order they
+        were configured. Modules that rule themselves out are skipped.
+
+        Returns ``(modules, skipped)``, where *skipped* is the number of
+        modules that ruled themselves out.
+        """
+        yes = []
+        maybe = []
+
+        for module in self.modules:
+            verdict = None
+            if module.get("sniffs", False):
+                try:
+                    verdict = module["module"].sniff(raw_data)
+                except Exception as e:
+                    logger.debug("Exception in {module} sniff: {e}"
+                                 .format(module=module['name'], e=e))
+
+            if verdict is True:
+                yes.append(module)
+            elif verdict is None:
+                maybe.append(module)
+
+        modules = yes + maybe
+        return modules, len(self.modules) - len(modules)
+
+    def _get_raw_data(self, doc):
+        """Decode and log the raw telemetry in *doc*."""
+        raw_data = base64.b64decode(doc['data']['_raw'])
+        debug_type, debug_data = self._get_debug(raw_data)
+        receiver_callsign = doc['receivers'].keys()[0]
+
+        logger.info("Parsing [{type}] {data!r} ({id}) from {who}"
+                    .format(id=doc["_id"], data=debug_data, type=debug_type,
+                            who=receiver_callsign))
+        return raw_data
+
+    def _merge_data(self, doc, data, module, callsign):
+        """Merge successfully parsed *data* into *doc*."""
+        doc['data'].update(data)
+        logger.info("{module} parsed data from {callsign} successfully"
+                    .format(module=module["name"], callsign=callsign))
+        logger.debug("Parsed data: " + json.dumps(data, indent=2))
+
     def _get_debug(self, raw_data):
         if self.ascii_exp.search(raw_data):
-            statsd.increment("parser.ascii_doc")
+            metrics.increment("parser.ascii_doc")
             return 'ascii', raw_data
         else:
-            statsd.increment("parser.binary_doc")
+            metrics.increment("parser.binary_doc")
             return 'b64', base64.b64encode(raw_data)
 
     def _get_callsign(self, raw_data, module):
         """Attempt to find a callsign from the data."""
         try:
             where = "pre_filter"
-            raw_data = self.filtering.pre_filter(raw_data, module)
+            with tracing.stage("pre_filter"):
+                raw_data = self.filtering.pre_filter(raw_data, module)
             where = "pre_parse"
-            callsign = module["module"].pre_parse(raw_data)
+            with tracing.stage("pre_parse"):
+                callsign = module["module"].pre_parse(raw_data)
         except (ValueError, KeyError) as e:
             logger.debug("Exception in {module} {where}: {e}"
                          .format(e=e, module=module['name'], where=where))
-            statsd.increment("parser.parse_exception")
+            metrics.increment("parser.parse_exception")
             raise CantGetCallsign()
         return callsign
 
@@ -180,16 +398,15 @@ class Parser(object):
                          .format(c=callsign))
             raise CantGetConfig()
         elif config:
-            if "_id" not in config:
-                config["_id"] = None
-            return {"id": config["_id"], "payload_configuration": config}
+            return {"id": config.get("_id"), "payload_configuration": config}
 
-        config = self._find_config_doc(callsign)
+        with tracing.stage("config", callsign):
+            config = self._find_config_doc(callsign)
 
         if not config:
             logger.debug("No configuration doc for {callsign!r} found"
                          .format(callsign=callsign))
-            statsd.increment("parser.no_config_doc")
+            metrics.increment("parser.no_config_doc")
             raise CantGetConfig()
 
         return config
@@ -204,28 +421,101 @@ class Parser(object):
                 continue
             try:
                 where = "intermediate filter"
-                data = self.filtering.intermediate_filter(raw_data, sentence)
+                with tracing.stage("intermediate_filter", callsign):
+                    data = self.filtering.intermediate_filter(raw_data,
+                                                              sentence)
                 where = "main parse"
-                data = module["module"].parse(data, sentence)
+                with tracing.stage("parse", callsign):
+                    parse_config = sentence
+                    if module.get("compiles", False):
+                        key = self._plan_key(config, sentence_index)
+                        parse_config = module["module"].compile(sentence, key)
+                    data = module["module"].parse(data, parse_config)
                 where = "post filter"
-                data = self.filtering.post_filter(data, sentence)
+                with tracing.stage("post_filter", callsign):
+                    data = self.filtering.post_filter(data, sentence)
             except (ValueError, KeyError) as e:
                 logger.debug("Exception in {module} {where}: {e}"
                              .format(module=module['name'], e=e, where=where))
-                statsd.increment("parser.parse_exception")
+                metrics.increment("parser.parse_exception")
                 continue
 
-            data["_protocol"] = module["name"]
-            data["_parsed"] = {
-                "time_parsed": rfc3339.now_to_rfc3339_utcoffset(),
-                "payload_configuration": config["id"],
-                "configuration_sentence_index": sentence_index
-            }
-            if "flight_id" in config:
-                data["_parsed"]["flight"] = config["flight_id"]
-            return data
+            return self._add_parsed(data, config, module, sentence_index)
         raise CantGetData()
 
+    def _get_data_many(self, raw_datas, callsign, config, module):
+        """
+        Attempt to parse each of *raw_datas* with the first matching
+        sentence of *config* in one go, using the module's ``parse_many``.
+
+        Returns a list with the data for each, or None where it could not
+        be parsed this way; :meth:`_get_data` should be used for those, to
+        try any other sentences (and log why).
+        """
+        results = [None] * len(raw_datas)
+        sentences = config["payload_configuration"]["sentences"]
+        for sentence_index, sentence in enumerate(sentences):
+            if sentence["callsign"] == callsign and \
+                    sentence["protocol"] == module["name"]:
+                break
+        else:
+            return results
+
+        with tracing.stage("parse_many", callsign):
+            indexes = []
+            strings = []
+            for i, raw_data in enumerate(raw_datas):
+                try:
+                    strings.append(self.filtering.intermediate_filter(
+                        raw_data, sentence))
+                except (ValueError, KeyError):
+                    continue
+                indexes.append(i)
+
+            try:
+                key = self._plan_key(config, sentence_index)
+                plan = module["module"].compile(sentence, key)
+            except (ValueError, KeyError):
+                return results
+
+            parsed = module["module"].parse_many(strings, plan)
+            for i, data in zip(indexes, parsed):
+                if not isinstance(data, dict):
+                    continue
+                try:
+                    data = self.filtering.post_filter(data, sentence)
+                except (ValueError, KeyError):
+                    continue
+                if type(data) is not dict:
+                    continue
+                results[i] = self._add_parsed(data, config, module,
+                                              sentence_index)
+        return results
+
+    def _add_parsed(self, data, config, module, sentence_index):
+        """Add the ``_protocol`` and ``_parsed`` fields to parsed *data*."""
+        data["_protocol"] = module["name"]
+        data["_parsed"] = {
+            "time_parsed": rfc3339.now_to_rfc3339_utcoffset(),
+            "payload_configuration": config["id"],
+            "configuration_sentence_index": sentence_index
+        }
+        if "flight_id" in config:
+            data["_parsed"]["flight"] = config["flight_id"]
+        return data
+
+    def _plan_key(self, config, sentence_index):
+        """
+        Returns the key under which a parser module may cache its compiled
+        form of a sentence: ``(document _id, _rev, sentence index)``, or
+        None if the configuration document can't be uniquely identified.
+        """
+        doc_id = config["id"]
+        rev = config["payload_configuration"].get("_rev")
+        if doc_id is None or rev is None:
+            return None
+        return (doc_id, rev, sentence_index)
+
     def _find_config_doc(self, callsign):
         """
         Attempt to locate a payload_configuration document suitable for parsing
@@ -250,7 +540,21 @@ class Parser(object):
         The returned document may have more than one sentence object, and each
         should be attempted in order.
         If no configuration can be found, None is returned.
+
+        If the config index is enabled, it is consulted instead of the
+        database. Otherwise, callsigns recently found to have no
+        configuration are remembered (if enabled), so that the database
+        needn't be asked again.
         """
+        if self.config_index is not None:
+            return self.config_index.lookup(callsign)
+
+        if self.missing_configs is not None:
+            if self.missing_configs.is_missing(callsign):
+                metrics.increment("parser.missing_config_cached")
+                return None
+            generation = self.missing_configs.generation
+
         t = int(time.time())
         flights = self.db.view("flight/end_start_including_payloads",
                                include_docs=True, startkey=[t])
@@ -260,7 +564,7 @@ class Parser(object):
                     return {
                         "id": flight["doc"]["_id"],
                         "flight_id": flight["id"],
-                        "payload_configuration": flight["doc"]
+                        "payload_configuration": freeze(flight["doc"])
                     }
 
         config = self.db.view(
@@ -274,9 +578,12 @@ class Parser(object):
         if config and self._callsign_in_config(callsign, config["doc"]):
             return {
                 "id": config["id"],
-                "payload_configuration": config["doc"]
+                "payload_configuration": freeze(config["doc"])
             }
 
+        if self.missing_configs is not None:
+            self.missing_configs.add(callsign, generation)
+
         return None
 
     def _callsign_in_config(self, callsign, config):
@@ -287,15 +594,28 @@ class ParserFiltering(object):
     """
     Handle filtering of data during parsing.
     """
+
+    hotfix_cache_size = 64
+    certs_check_interval = 5
+
     def __init__(self, config, lmgr):
         """
         * Scans ``config["parser"]["certs_dir"]`` for CA and developer
           certificates.
         """
-        self.config = copy.deepcopy(config)
         self.loadable_manager = lmgr
+        self.cert_path = config["parser"]["certs_dir"]
+        self.hotfixes = lru.LRUCache(self.hotfix_cache_size)
+        self._load_certificate_authorities()
+
+    def _load_certificate_authorities(self):
+        """
+        (Re)load the CA certificates, and forget any loaded developer
+        certificates and verified hotfixes.
+        """
         self.certificate_authorities = []
-        self.cert_path = self.config["parser"]["certs_dir"]
+        self.certs_mtime = self._get_certs_mtime()
+        self.certs_checked = time.time()
         ca_path = os.path.join(self.cert_path, 'ca')
         for f in os.listdir(ca_path):
             ca = M2Crypto.X509.load_cert(os.path.join(ca_path, f))
@@ -306,6 +626,34 @@ class ParserFiltering(object):
                                  .format(os.path.join(ca_path, f)))
 
         self.loaded_certs = {}
+        self.hotfixes.clear()
+
+    def _get_certs_mtime(self):
+        """
+        The modification times of the certificate directories, which change
+        whenever a certificate is added, removed or replaced. A directory
+        that doesn't exist has a modification time of None.
+        """
+        mtimes = []
+        for d in ('ca', 'certs'):
+            try:
+                mtimes.append(os.stat(os.path.join(self.cert_path, d))
+                              .st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _certs_changed(self):
+        """
+        Whether the certificate directories have changed since they were
+        loaded. They are only looked at once every
+        :attr:`certs_check_interval` seconds; in between, returns False.
+        """
+        now = time.time()
+        if now - self.certs_checked < self.certs_check_interval:
+            return False
+        self.certs_checked = now
+        return self._get_certs_mtime() != self.certs_mtime
 
     def pre_filter(self, raw_data, module):
         """
@@ -335,7 +683,9 @@ class ParserFiltering(object):
             if filter_type in sentence["filters"]:
                 for f in sentence["filters"][filter_type]:
                     data = self._filter(data, f, result_type)
-                    statsd.increment("parser.filters.{0}".format(filter_type))
+                    metrics.increment("parser.filters.{0}".format(filter_type))
+        if isinstance(data, _JournalDict):
+            data = dict(data)
         return data
 
     def _filter(self, data, f, result_type):
@@ -344,9 +694,16 @@ class ParserFiltering(object):
         relevant filter/code and maybe a config.
         Returns the filtered data, or leaves the data untouched
         if the filter could not be run.
+
+        Strings are immutable, so need no protection from the filter. Dicts
+        are given to the filter as a :class:`_JournalDict`, so that any
+        changes the filter makes before failing can be undone.
         """
+        if isinstance(data, dict):
+            if not isinstance(data, _JournalDict):
+                data = _JournalDict(data)
+            data.begin()
         rollback = data
-        data = copy.deepcopy(data)
 
         try:
             if f["type"] == "normal":
@@ -362,6 +719,8 @@ class ParserFiltering(object):
                                  "output of wrong type")
         except:
             logger.exception("Error while applying filter " + repr(f))
+            if isinstance(rollback, _JournalDict):
+                rollback.rollback()
             return rollback
         else:
             return data
@@ -392,10 +751,10 @@ class ParserFiltering(object):
             sig = base64.b64decode(f["signature"])
             ok = cert.get_pubkey().get_rsa().verify(digest, sig, 'sha256')
         except (TypeError, M2Crypto.RSA.RSAError):
-            statsd.increment("parser.filters.hotfix.invalid_signature")
+            metrics.increment("parser.filters.hotfix.invalid_signature")
             raise ValueError("Hotfix signature is not valid")
         if not ok:
-            statsd.increment("parser.filters.hotfix.invalid_signature")
+            metrics.increment("parser.filters.hotfix.invalid_signature")
             raise ValueError("Hotfix signature is not valid")
 
     def _compile_hotfix(self, f):
@@ -408,22 +767,40 @@ class ParserFiltering(object):
             code = compile(body, "<filter>", "exec")
             exec code in env
         except (SyntaxError, AttributeError, TypeError):
-            statsd.increment("parser.filters.hotfix.compile_error")
+            metrics.increment("parser.filters.hotfix.compile_error")
             raise ValueError("Hotfix code didn't compile: " + repr(f))
         return env
 
     def _hotfix_filter(self, data, f):
         """Load a filter specified by some code in the database. Check its
-        authenticity by verifying its certificate, then run if OK."""
+        authenticity by verifying its certificate, then run if OK.
+
+        Verified, compiled hotfixes are cached (keyed by the code's hash, the
+        signature and the certificate name) so that they need only be
+        verified once. The cache is emptied if the certs directory changes,
+        which is checked at most every :attr:`certs_check_interval` seconds.
+        """
         self._sanity_check_hotfix(f)
-        cert = self._get_certificate(f["certificate"])
-        self._verify_certificate(f, cert)
-        env = self._compile_hotfix(f)
+
+        if self._certs_changed():
+            logger.info("Certificates changed; reloading")
+            self._load_certificate_authorities()
+
+        key = (hashlib.sha256(f["code"]).hexdigest(), f["signature"],
+               f["certificate"])
+        hotfix = self.hotfixes.get(key)
+        if hotfix is None:
+            cert = self._get_certificate(f["certificate"])
+            self._verify_certificate(f, cert)
+            hotfix = self._compile_hotfix(f)["f"]
+            self.hotfixes[key] = hotfix
+        else:
+            metrics.increment("parser.filters.hotfix.cache_hit")
 
         logger.debug("Executing a hotfix")
-        statsd.increment("parser.filters.hotfix.executed")
+        metrics.increment("parser.filters.hotfix.executed")
 
-        return env["f"](data)
+        return hotfix(data)
 
     def _get_certificate(self, certname):
         """Fetch the specified certificate, returning the X509 object.
@@ -442,6 +819,119 @@ class ParserFiltering(object):
             raise ValueError("Certificate could not be loaded.")
 
 
+class _JournalDict(dict):
+    """
+    A dict that records changes made to it after :meth:`begin`, so that they
+    can be undone with :meth:`rollback`.
+
+    Only the top level keys are journaled. Values that are themselves dicts
+    or lists are copied the first time they are read after :meth:`begin`
+    (through ``[]``, :meth:`get`, :meth:`values`, :meth:`items` and
+    friends), so that the originals are untouched should they be modified
+    in place; values the filter never reads are never copied.
+    ``dict(journal_dict)`` and ``**journal_dict`` bypass this, so filters
+    must not modify nested values obtained that way.
+    """
+
+    _missing = object()
+
+    def __init__(self, *args, **kwargs):
+        super(_JournalDict, self).__init__(*args, **kwargs)
+        self._undo = {}
+        self._nested = {}
+
+    def begin(self):
+        """Start recording changes, forgetting any previous record"""
+        self._undo = {}
+        self._nested = {}
+
+    def rollback(self):
+        """Undo all changes made since :meth:`begin`"""
+        for key, value in self._undo.iteritems():
+            if value is self._missing:
+                dict.pop(self, key, None)
+            else:
+                dict.__setitem__(self, key, value)
+        for key, value in self._nested.iteritems():
+            dict.__setitem__(self, key, value)
+        self.begin()
+
+    def _own(self, key):
+        """
+        Return the value of *key*, first replacing it with a copy if it is a
+        dict or list that the filter has not yet been given.
+        """
+        value = dict.__getitem__(self, key)
+        if isinstance(value, (dict, list)) and key not in self._nested \
+                and key not in self._undo:
+            self._nested[key] = value
+            value = copy.deepcopy(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._own(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        return default
+
+    def values(self):
+        return [self._own(key) for key in self.keys()]
+
+    def items(self):
+        return [(key, self._own(key)) for key in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        return dict(self.items())
+
+    def _record(self, key):
+        if key not in self._undo:
+            self._undo[key] = dict.get(self, key, self._missing)
+
+    def __setitem__(self, key, value):
+        self._record(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._record(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self._own(key)
+            self._record(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        if not self:
+            raise KeyError("popitem(): dictionary is empty")
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        self._record(key)
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        for key in self.keys():
+            self._record(key)
+        dict.clear(self)
+
+
 class ParserModule(object):
     """
     Base class for real ParserModules to inherit from.
@@ -469,6 +959,17 @@ class ParserModule(object):
         parser module should be able to parse, extracting the data as per
         the information in *config*, which is the ``sentence`` dictionary
         extracted from the payload's configuration document.
+
+        Parser modules may optionally implement ``compile(config, key)``,
+        which should verify and prepare the ``sentence`` dictionary *config*
+        and return an object that is then given to :meth:`parse` as *config*
+        instead. *key* uniquely identifies the sentence (or is None if it
+        can't), so the prepared form may be cached.
+
+        Parser modules may also implement ``sniff(string)``, which should
+        cheaply guess whether *string* is in this module's format, returning
+        ``True`` if it certainly is, ``False`` if it certainly isn't (in
+        which case the module won't be tried), or ``None`` if unsure.
         """
         raise ValueError()
 
@@ -0,0 +1,356 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Re-parse a flight's telemetry with a corrected payload_configuration.
+
+Telemetry that has already been parsed never appears in the
+``parser/unparsed`` filter again, so if a flight's payload_configuration
+turns out to be wrong, :class:`ParserBackfill` is used to fix the data that
+has already been received: it pages through the flight's telemetry in the
+``payload_telemetry/flight_payload_time`` view, parses each document's
+``_raw`` data afresh with the given payload_configuration (using a pool of
+:class:`Parser <habitat.parser.Parser>` processes), and replaces the parsed
+data in the database using a :class:`BulkSaver
+<habitat.parser_daemon.BulkSaver>`.
+
+Progress is recorded in a checkpoint file after every page, so an
+interrupted backfill carries on from where it stopped when run again with
+the same file. The file is removed once the backfill finishes.
+
+Use ``bin/parser_backfill`` to run it from the command line.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import logging
+import multiprocessing
+from optparse import OptionParser
+
+import couchdbkit
+
+from . import parser
+from .parser_daemon import BulkSaver
+from .utils import metrics, startup
+from .utils.rfc3339 import rfc3339_to_timestamp
+
+logger = logging.getLogger("habitat.parser_backfill")
+
+__all__ = ["ParserBackfill", "BackfillSaver", "main"]
+
+
+class ParserBackfill(object):
+    """
+    Re-parses the telemetry of the flight *flight_id* with the
+    payload_configuration document *payload_configuration_id*.
+
+    If *source* is given, only telemetry that was parsed with that
+    payload_configuration is re-parsed; otherwise all of the flight's
+    telemetry is.
+
+    The telemetry is read *page_size* documents at a time, parsed by
+    *workers* processes (or in this process, if *workers* is 0) and saved
+    in batches of *batch_size*. If *max_rate* is given, at most that many
+    documents are re-parsed per second, to spare the database.
+
+    *config* is the habitat configuration; the database is connected to
+    with ``config["couch_uri"]`` and ``config["couch_db"]`` unless a
+    database object *db* is given to use instead.
+    """
+
+    view = "payload_telemetry/flight_payload_time"
+
+    def __init__(self, config, flight_id, payload_configuration_id,
+                 source=None, checkpoint=None, db=None, workers=None,
+                 page_size=500, batch_size=100, max_rate=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        # Documents are always parsed with the given configuration, so the
+        # parsers needn't keep track of the others.
+        config = copy.deepcopy(config)
+        config["parser"]["config_index"] = False
+        config["parser"]["missing_config_ttl"] = None
+        self.config = config
+
+        if db is None:
+            self.couch_server = couchdbkit.Server(config["couch_uri"])
+            self.db = self.couch_server[config["couch_db"]]
+        else:
+            self.couch_server = None
+            self.db = db
+
+        self.flight_id = flight_id
+        self.source = source
+        self.workers = workers
+        self.page_size = page_size
+        self.max_rate = max_rate
+        self.saver = BackfillSaver(self.db, batch_size=batch_size)
+
+        self.payload_configuration = self.db[payload_configuration_id]
+        if self.payload_configuration.get("type") != "payload_configuration":
+            raise ValueError("{0} is not a payload_configuration"
+                             .format(payload_configuration_id))
+        flight = self.db[flight_id]
+        if flight.get("type") != "flight":
+            raise ValueError("{0} is not a flight".format(flight_id))
+
+        self.checkpoint = checkpoint
+        self.state = self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        """Load the state of an interrupted backfill, or start afresh."""
+        state = {
+            "flight": self.flight_id,
+            "payload_configuration": self.payload_configuration["_id"],
+            "source": self.source,
+            "started": int(time.time()),
+            "startkey": None,
+            "startkey_docid": None,
+            "stats": {"read": 0, "skipped": 0, "parsed": 0, "failed": 0}
+        }
+
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return state
+
+        with open(self.checkpoint) as f:
+            saved = json.load(f)
+        for key in ("flight", "payload_configuration", "source"):
+            if saved.get(key) != state[key]:
+                raise ValueError("Checkpoint {0} is for a different backfill "
+                                 "({1} {2!r})".format(self.checkpoint, key,
+                                                      saved.get(key)))
+
+        logger.info("Resuming backfill from {0} after {1} documents"
+                    .format(self.checkpoint, saved["stats"]["read"]))
+        return saved
+
+    def _save_checkpoint(self):
+        """Atomically replace the checkpoint file with :attr:`state`."""
+        if self.checkpoint is None:
+            return
+        temp = self.checkpoint + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.state, f)
+        os.rename(temp, self.checkpoint)
+
+    def run(self):
+        """
+        Re-parse and save every document, returning a dict of statistics:
+        the number of documents ``read``, ``skipped`` (because they have
+        already been re-parsed), ``parsed`` and ``failed`` (left as they
+        were, because they could not be parsed with the new configuration),
+        and the ``elapsed`` time in seconds.
+        """
+        start = time.time()
+        stats = self.state["stats"]
+        done_before = stats["read"]
+        pool = None
+
+        if self.workers:
+            logger.info("Starting {0} parser workers".format(self.workers))
+            pool = multiprocessing.Pool(self.workers,
+                                        initializer=_init_worker,
+                                        initargs=self._worker_args())
+        else:
+            _init_worker(*self._worker_args())
+
+        try:
+            while True:
+                rows = self._next_page()
+                if not rows:
+                    break
+
+                docs = [row["doc"] for row in rows if self._wants(row)]
+                stats["read"] += len(rows)
+                stats["skipped"] += len(rows) - len(docs)
+
+                parsed = self._parse(docs, pool)
+                stats["parsed"] += len(parsed)
+                stats["failed"] += len(docs) - len(parsed)
+                metrics.increment("parser_backfill.parsed", len(parsed))
+                metrics.increment("parser_backfill.failed",
+                                  len(docs) - len(parsed))
+
+                self.saver.save_many(parsed)
+
+                self.state["startkey"] = rows[-1]["key"]
+                self.state["startkey_docid"] = rows[-1]["id"]
+                self._save_checkpoint()
+
+                logger.info("Backfilled {0} documents".format(stats["read"]))
+                self._throttle(stats["read"] - done_before, start)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        result = dict(stats, elapsed=round(time.time() - start, 3))
+        logger.info("Backfill finished: {0}".format(json.dumps(result)))
+        return result
+
+    def _worker_args(self):
+        db = self.db if self.couch_server is None else None
+        return (self.config, db, self.payload_configuration, self.flight_id)
+
+    def _next_page(self):
+        """
+        Fetch the next page of rows (with docs) from :attr:`view`, after
+        the last one in the checkpoint.
+        """
+        prefix = [self.flight_id]
+        if self.source is not None:
+            prefix.append(self.source)
+        params = {"startkey": prefix, "endkey": prefix + [{}],
+                  "include_docs": True, "limit": self.page_size}
+
+        last_id = self.state["startkey_docid"]
+        if last_id is not None:
+            # The last row is included, unless it has since been re-parsed
+            # into a different part of the view.
+            params["startkey"] = self.state["startkey"]
+            params["startkey_docid"] = last_id
+            params["limit"] += 1
+
+        rows = list(self.db.view(self.view, **params))
+        if rows and rows[0]["id"] == last_id:
+            rows = rows[1:]
+        return rows
+
+    def _wants(self, row):
+        """
+        False if the document in *row* has already been re-parsed by this
+        backfill (having moved to a later part of the view).
+        """
+        if row["key"][1] != self.payload_configuration["_id"]:
+            return True
+        time_parsed = row["doc"]["data"]["_parsed"]["time_parsed"]
+        return rfc3339_to_timestamp(time_parsed) < self.state["started"]
+
+    def _parse(self, docs, pool):
+        """Returns the parsed docs ({_id, data}) of those in *docs*."""
+        chunk_size = max(1, len(docs) // max(1, self.workers * 4))
+        chunks = [docs[i:i + chunk_size]
+                  for i in xrange(0, len(docs), chunk_size)]
+        if pool is not None:
+            results = pool.map(_parse_chunk, chunks)
+        else:
+            results = [_parse_chunk(chunk) for chunk in chunks]
+        return [doc for result in results for doc in result]
+
+    def _throttle(self, count, start):
+        """Sleep until *count* documents are within :attr:`max_rate`."""
+        if not self.max_rate:
+            return
+        delay = start + float(count) / self.max_rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BackfillSaver(BulkSaver):
+    """
+    A :class:`BulkSaver <habitat.parser_daemon.BulkSaver>` that replaces
+    the data of each document, rather than adding to it, so that no fields
+    parsed with the old configuration are left behind.
+    """
+
+    def merge(self, latest, doc):
+        latest["data"] = doc["data"]
+
+
+_backfill = None
+
+
+def _init_worker(config, db, payload_configuration, flight_id):
+    """Set up the :class:`Parser` used by this worker process."""
+    global _backfill
+    _backfill = (parser.Parser(config, db=db), payload_configuration,
+                 flight_id)
+
+
+def _parse_chunk(docs):
+    """
+    Parse the raw data of each of *docs*, returning ``{_id, data}`` for
+    those that could be parsed.
+    """
+    the_parser, payload_configuration, flight_id = _backfill
+    fresh = [{"_id": doc["_id"], "type": doc["type"],
+              "receivers": doc["receivers"],
+              "data": {"_raw": doc["data"]["_raw"]}} for doc in docs]
+
+    results = []
+    for doc in the_parser.parse_many(fresh, payload_configuration):
+        if doc:
+            # Keep it in the flight's part of flight_payload_time.
+            doc["data"]["_parsed"]["flight"] = flight_id
+            results.append({"_id": doc["_id"], "data": doc["data"]})
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point, used by ``bin/parser_backfill``.
+
+    Usage: ``parser_backfill [options] FLIGHT PAYLOAD_CONFIGURATION``.
+    Statistics are written to stderr as JSON.
+    """
+    oparser = OptionParser("usage: %prog [options] FLIGHT "
+                           "PAYLOAD_CONFIGURATION")
+    oparser.add_option("-c", "--config", dest="config", metavar="FILE",
+                       help="habitat configuration file (./habitat.yml)",
+                       default="./habitat.yml")
+    oparser.add_option("-s", "--source", dest="source", metavar="ID",
+                       help="only re-parse telemetry parsed with this "
+                            "payload_configuration")
+    oparser.add_option("-k", "--checkpoint", dest="checkpoint",
+                       metavar="FILE", help="file to record progress in, "
+                       "and resume from")
+    oparser.add_option("-w", "--workers", dest="workers", type="int",
+                       help="number of parser processes (one per CPU)",
+                       metavar="N", default=None)
+    oparser.add_option("-p", "--page-size", dest="page_size", type="int",
+                       help="documents read per request (500)", metavar="N",
+                       default=500)
+    oparser.add_option("-b", "--batch-size", dest="batch_size", type="int",
+                       help="documents saved per request (100)", metavar="N",
+                       default=100)
+    oparser.add_option("-r", "--max-rate", dest="max_rate", type="float",
+                       help="most documents to re-parse per second",
+                       metavar="N", default=None)
+    (options, args) = oparser.parse_args(argv)
+
+    if len(args) != 2:
+        oparser.error("Expected two positional arguments")
+
+    config = startup.load_config(options.config)
+    startup.setup_logging(config, "parserbackfill")
+    startup.setup_metrics(config)
+
+    backfill = ParserBackfill(config, args[0], args[1],
+                              source=options.source,
+                              checkpoint=options.checkpoint,
+                              workers=options.workers,
+                              page_size=options.page_size,
+                              batch_size=options.batch_size,
+                              max_rate=options.max_rate)
+    stats = backfill.run()
+    sys.stderr.write(json.dumps(stats) + "\n")
@@ -19,18 +19,23 @@
 Run the Parser as a daemon connected to CouchDB's _changes feed.
 """
 
+import time
+import Queue
 import logging
 import couchdbkit
 import copy
-import statsd
+import collections
+import threading
+import multiprocessing
+from restkit.conn import Connection
+from socketpool import ConnectionPool
 
 from . import parser
-from .utils import immortal_changes
+from .utils import immortal_changes, metrics, tracing
 
 logger = logging.getLogger("habitat.parser_daemon")
-statsd.init_statsd({'STATSD_BUCKET_PREFIX': 'habitat'})
 
-__all__ = ['ParserDaemon']
+__all__ = ['ParserDaemon', 'SequenceTracker', 'BulkSaver']
 
 
 class ParserDaemon(object):
@@ -38,66 +43,617 @@ class ParserDaemon(object):
     :class:`ParserDaemon` runs persistently, watching CouchDB's _changes feed
     for new unparsed telemetry, parsing it with :class:`Parser` and storing the
     result back in the database.
+
+    By default telemetry is parsed in the daemon's own process, one document
+    at a time. If ``workers`` is set, documents are instead handed out to a
+    pool of that many worker processes, each with its own :class:`Parser`,
+    and saved as the results come back.
+
+    If ``bulk_save`` is set, parsed documents are saved in batches by a
+    :class:`BulkSaver` rather than one at a time.
+
+    If ``pipeline`` is set, reading changes, parsing and saving are done in
+    separate stages, connected by queues, so that waiting for the database
+    and parsing overlap. Each stage may have several threads, so that many
+    documents can be waiting for configuration lookups or saves at once;
+    CPU bound parsing is best left to ``workers``. The changes feed callback
+    queues each change for the parse thread, which queues parsed documents
+    for the save thread (or, with ``workers``, the pool queues them as
+    results come back). When a queue is full the stage before it blocks, so
+    a slow stage eventually stops the changes feed from being read. The
+    depth of each queue is recorded every so often in the
+    ``parser_daemon.queue.*`` timers.
     """
 
-    def __init__(self, config, daemon_name="parserdaemon"):
+    default_max_in_flight = 100
+    default_task_timeout = 60
+    in_flight_poll_interval = 0.05
+    default_queue_size = 100
+    default_queue_report_interval = 10
+
+    def __init__(self, config, daemon_name="parserdaemon", db=None):
         """
         On construction, it will:
 
         * Connect to CouchDB using ``self.config["couch_uri"]`` and
-          ``config["couch_db"]``.
+          ``config["couch_db"]``, unless a database object *db* is given to
+          use instead (such as a
+          :class:`habitat.utils.memory_couch.Database`). The parser, and any
+          worker processes, use *db* too.
+        * Read ``workers`` (default 0: parse in this process),
+          ``max_in_flight`` (the most documents that may be handed to
+          workers but not yet saved) and ``task_timeout`` (how long to wait
+          for a free slot before giving up on tasks that the pool has
+          lost) from ``config[daemon_name]``.
+        * If ``config[daemon_name]["bulk_save"]`` is set, create a
+          :class:`BulkSaver` with the options therein.
+        * If ``config[daemon_name]["pipeline"]`` is set, create the queues
+          between stages. It may be ``true``, or contain ``queue_size``
+          (the most changes that may wait for each stage),
+          ``parse_threads`` and ``save_threads`` (the number of threads
+          working on each stage, default 1), ``pool_size`` (the number of
+          connections to CouchDB to keep open, for the daemon and parser
+          to share) and ``report_interval`` (seconds between recording
+          queue depths).
         """
 
         config = copy.deepcopy(config)
-        self.couch_server = couchdbkit.Server(config["couch_uri"])
-        self.db = self.couch_server[config["couch_db"]]
+        self.config = config
+        daemon_config = config.get(daemon_name) or {}
+        self.workers = daemon_config.get("workers", 0)
+        self.max_in_flight = daemon_config.get("max_in_flight",
+                                               self.default_max_in_flight)
+        self.task_timeout = daemon_config.get("task_timeout",
+                                              self.default_task_timeout)
+        self.pool = None
+        self._in_flight = None
+
+        # seq -> AsyncResult, for each change handed to the pool whose
+        # result hasn't come back yet
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        self.parse_queue = None
+        self.save_queue = None
+        pipeline = daemon_config.get("pipeline")
+        if pipeline:
+            if not isinstance(pipeline, dict):
+                pipeline = {}
+            queue_size = pipeline.get("queue_size", self.default_queue_size)
+            self.queue_report_interval = pipeline.get(
+                "report_interval", self.default_queue_report_interval)
+            self.parse_threads = pipeline.get("parse_threads", 1)
+            self.save_threads = pipeline.get("save_threads", 1)
+            if not self.workers:
+                self.parse_queue = Queue.Queue(queue_size)
+            self.save_queue = Queue.Queue(queue_size)
+        else:
+            pipeline = {}
+
+        if db is None:
+            server_options = {}
+            if pipeline.get("pool_size"):
+                # A pool of our own, big enough for every stage's threads
+                # to keep their connections open, shared with the parser.
+                server_options["pool"] = ConnectionPool(
+                    factory=Connection, max_size=pipeline["pool_size"])
+            self.couch_server = couchdbkit.Server(config["couch_uri"],
+                                                  **server_options)
+            self.db = self.couch_server[config["couch_db"]]
+            if server_options:
+                db = self.db
+        else:
+            self.couch_server = None
+            self.db = db
         self.last_seq = self.db.info()["update_seq"]
 
-        self.parser = parser.Parser(config)
+        self.saver = None
+        if daemon_config.get("bulk_save"):
+            self.saver = BulkSaver(self.db, **daemon_config["bulk_save"])
+
+        if self.workers or self.save_queue is not None:
+            self.sequence = SequenceTracker(self.last_seq)
+        if self.workers:
+            self.parser = None
+            self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        elif db is None:
+            self.parser = parser.Parser(config)
+        else:
+            self.parser = parser.Parser(config, db=db)
 
     def run(self):
         """
         Start a continuous connection to CouchDB's _changes feed, watching for
         new unparsed telemetry.
         """
-        consumer = immortal_changes.Consumer(self.db)
-        consumer.wait(self._couch_callback, filter="parser/unparsed",
-                since=self.last_seq, include_docs=True, heartbeat=1000)
+        if self.workers:
+            self._start_pool()
+        if self.saver is not None:
+            self.saver.start()
+        if self.save_queue is not None:
+            self._start_stages()
+
+        try:
+            consumer = immortal_changes.Consumer(self.db)
+            consumer.wait(self._couch_callback, filter="parser/unparsed",
+                    since=self.last_seq, include_docs=True, heartbeat=1000)
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+
+    def _start_pool(self):
+        """Start :attr:`workers` worker processes."""
+        logger.info("Starting {0} parser workers".format(self.workers))
+        initargs = (self.config, )
+        if self.couch_server is None:
+            # The workers are forked, so get their own copy of a given db.
+            initargs += (self.db, )
+        self.pool = multiprocessing.Pool(self.workers,
+                                         initializer=_init_worker,
+                                         initargs=initargs)
+
+    def _start_stages(self):
+        """Start the threads of the pipeline's parse and save stages."""
+        stages = [("save", self._save_stage)] * self.save_threads
+        if self.parse_queue is not None:
+            stages += [("parse", self._parse_stage)] * self.parse_threads
+        stages.append(("queue report", self._report_queues))
+        for name, target in stages:
+            thread = threading.Thread(target=target,
+                                      name="habitat ParserDaemon " + name)
+            thread.daemon = True
+            thread.start()
 
     def _couch_callback(self, result):
         """
         Handle a new result from the CouchDB _changes feed. Passes the doc off
         to Parser.parse, then saves the result.
+
+        With a worker pool, the doc is instead queued for a worker, blocking
+        if :attr:`max_in_flight` documents are already outstanding. With a
+        pipeline and no workers, the change is queued for the parse stage,
+        blocking if the queue is full.
         """
+        if self.parse_queue is not None:
+            self.sequence.start(result['seq'])
+            self.parse_queue.put(result)
+            return
+
+        if self.pool is not None:
+            self._wait_for_slot()
+            self.sequence.start(result['seq'])
+            with self._pending_lock:
+                self._pending[result['seq']] = self.pool.apply_async(
+                    _parse_in_worker, (result['seq'], result['doc']),
+                    callback=self._worker_callback)
+            metrics.increment("parser_daemon.dispatched")
+            return
+
         self.last_seq = result['seq']
         doc = self.parser.parse(result['doc'])
         if doc:
+            self._save(doc)
+
+    def _wait_for_slot(self):
+        """
+        Take one of the :attr:`max_in_flight` slots, blocking until one is
+        free.
+
+        A :class:`multiprocessing.Pool` silently loses the task of a worker
+        that dies (killed, or crashed in an extension), and its slot would
+        never be released. So if no slot has come free for
+        :attr:`task_timeout` seconds, every task still waiting for a worker
+        is given up on and the pool is restarted (see
+        :meth:`_give_up_lost_tasks`). Python 2's semaphores can't time out,
+        so this polls while the slots are full.
+        """
+        waiting_since = time.time()
+        while not self._in_flight.acquire(False):
+            if time.time() - waiting_since >= self.task_timeout:
+                self._give_up_lost_tasks()
+                waiting_since = time.time()
+            time.sleep(self.in_flight_poll_interval)
+
+    def _give_up_lost_tasks(self):
+        """
+        Log and finish every change whose result hasn't come back from the
+        pool, then replace the pool with a new one.
+        """
+        with self._pending_lock:
+            lost = sorted(self._pending)
+            self._pending.clear()
+
+        if not lost:
+            return
+
+        logger.error("No results from workers for {0} seconds: giving up "
+                     "on changes {1} and restarting the pool"
+                     .format(self.task_timeout,
+                             ", ".join(str(seq) for seq in lost)))
+        metrics.increment("parser_daemon.lost", len(lost))
+
+        self.pool.terminate()
+        self._start_pool()
+        for seq in lost:
+            self._finish_change(seq)
+
+    def _worker_callback(self, result):
+        """
+        Save a document parsed by a worker, then advance :attr:`last_seq` as
+        far as every change has been dealt with.
+
+        This runs in the pool's result handling thread, so must not raise.
+        With a pipeline, the document is queued for the save stage instead.
+        Results for changes that have been given up on are ignored.
+        """
+        seq, doc = result
+        with self._pending_lock:
+            if self._pending.pop(seq, None) is None:
+                logger.warning("Ignoring late result for change {0}"
+                               .format(seq))
+                return
+        if doc and self.save_queue is not None:
+            self.save_queue.put(result)
+            return
+        if doc and self.saver is not None:
+            self._save(doc, lambda: self._finish_change(seq))
+            return
+
+        try:
+            if doc:
+                self._save(doc)
+        except:
+            logger.exception("Failed to save parsed doc from change {0}"
+                             .format(seq))
+        finally:
+            self._finish_change(seq)
+
+    def _finish_change(self, seq):
+        """Note that the change *seq* has been completely dealt with."""
+        self.last_seq = self.sequence.finish(seq)
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    def _parse_stage(self):
+        """Parse changes from :attr:`parse_queue` forever."""
+        while True:
+            self._parse_change(self.parse_queue.get())
+
+    def _parse_change(self, result):
+        """
+        Parse the doc from the change *result*, queuing it to be saved if
+        successful.
+        """
+        try:
+            doc = self.parser.parse(result['doc'])
+        except:
+            logger.exception("Exception while parsing change {0}"
+                             .format(result['seq']))
+            doc = None
+
+        if doc:
+            self.save_queue.put((result['seq'], doc))
+        else:
+            self._finish_change(result['seq'])
+
+    def _save_stage(self):
+        """Save parsed docs from :attr:`save_queue` forever."""
+        while True:
+            self._save_change(*self.save_queue.get())
+
+    def _save_change(self, seq, doc):
+        """Save *doc*, parsed from the change *seq*."""
+        if self.saver is not None:
+            self._save(doc, lambda: self._finish_change(seq))
+            return
+
+        try:
+            self._save(doc)
+        except:
+            logger.exception("Failed to save parsed doc from change {0}"
+                             .format(seq))
+        finally:
+            self._finish_change(seq)
+
+    def queue_depths(self):
+        """
+        Returns the number of items waiting in each stage's queue, and the
+        number of changes ``in_flight`` (read but not yet saved).
+        """
+        depths = {"in_flight": len(self.sequence)}
+        if self.parse_queue is not None:
+            depths["parse"] = self.parse_queue.qsize()
+        if self.save_queue is not None:
+            depths["save"] = self.save_queue.qsize()
+        if self.saver is not None:
+            depths["bulk_save"] = self.saver.queue.qsize()
+        return depths
+
+    def _report_queues(self):
+        """Record :meth:`queue_depths` every so often, forever."""
+        while True:
+            time.sleep(self.queue_report_interval)
+            depths = self.queue_depths()
+            for name, depth in depths.iteritems():
+                metrics.timing("parser_daemon.queue." + name, depth)
+            logger.debug("Queue depths: " + ", ".join(
+                "{0} {1}".format(k, v) for k, v in sorted(depths.items())))
+
+    def _save(self, doc, callback=None):
+        """
+        Save *doc*, either immediately or by queuing it with the
+        :class:`BulkSaver`, in which case *callback* is called once it has
+        been saved (or given up on).
+        """
+        if self.saver is not None:
+            self.saver.save(doc, callback)
+        else:
             self._save_updated_doc(doc)
+            if callback is not None:
+                callback()
 
-    @statsd.StatsdTimer.wrap('parser_daemon.save_time')
+    @metrics.timed('parser_daemon.save_time')
     def _save_updated_doc(self, doc, attempts=0):
         """
         Save doc to the database, retrying with a merge in the event of
         resource conflicts. This should definitely be a method of some Telem
         class thing.
         """
-        latest = self.db[doc['_id']]
-        latest['data'].update(doc['data'])
         try:
-            self.db.save_doc(latest)
+            with tracing.stage("save", doc['data'].get("payload")):
+                latest = self.db[doc['_id']]
+                latest['data'].update(doc['data'])
+                self.db.save_doc(latest)
             logger.debug("Saved doc {0} successfully".format(doc["_id"]))
-            statsd.increment("parser_daemon.saved")
+            metrics.increment("parser_daemon.saved")
         except couchdbkit.exceptions.ResourceConflict:
             attempts += 1
             if attempts >= 30:
                 err = "Could not save doc {0} after {1} conflicts." \
                         .format(doc["_id"], attempts)
                 logger.error(err)
-                statsd.increment("parser_daemon.save_error")
+                metrics.increment("parser_daemon.save_error")
                 raise RuntimeError(err)
             else:
                 logger.debug("Save conflict, trying again (#{0})" \
                     .format(attempts))
-                statsd.increment("parser_daemon.save_conflict")
+                metrics.increment("parser_daemon.save_conflict")
                 self._save_updated_doc(doc, attempts)
 
+
+class BulkSaver(object):
+    """
+    Saves parsed telemetry documents in batches, behind the back of the
+    :class:`ParserDaemon`.
+
+    Documents given to :meth:`save` are queued. A background thread (see
+    :meth:`start`) collects them into batches of up to *batch_size*
+    documents, waiting at most *flush_interval* seconds after the first
+    document of a batch arrives for the rest. For each batch, the latest
+    revisions are fetched with a single ``_all_docs`` request, the parsed
+    ``data`` is merged into each, and the lot is written with a single
+    ``_bulk_docs`` request.
+
+    Documents that conflict (because a listener added itself as a receiver
+    in the mean time) are retried in the next batch, at most
+    *max_attempts* times.
+    """
+
+    # seconds to wait after failing to talk to the database
+    error_delay = 1
+
+    def __init__(self, db, batch_size=100, flush_interval=0.05,
+                 max_attempts=30):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+
+        self.queue = Queue.Queue()
+        self._retry = []
+        self._thread = None
+
+    def start(self):
+        """Start saving queued documents in a daemon thread."""
+        self._thread = threading.Thread(target=self.run,
+                                        name="habitat BulkSaver")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, doc, callback=None):
+        """
+        Queue the parsed *doc* to be saved. *callback*, if given, is called
+        with no arguments once it has been saved or given up on.
+        """
+        self.queue.put((doc, callback, 0))
+
+    def run(self):
+        """Save batches of documents forever."""
+        while True:
+            self.flush(self._next_batch())
+
+    def _next_batch(self):
+        """
+        Wait for and return the next batch of (doc, callback, attempts)
+        tuples, starting with those that must be retried.
+        """
+        batch, self._retry = self._retry, []
+        if not batch:
+            batch.append(self.queue.get())
+
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Queue.Empty:
+                break
+
+        return batch
+
+    @metrics.timed('parser_daemon.bulk_save_time')
+    def flush(self, batch):
+        """
+        Merge and save a *batch* of (doc, callback, attempts) tuples,
+        queuing conflicts to be retried by the next batch.
+        """
+        try:
+            with tracing.stage("bulk_fetch"):
+                keys = [d["_id"] for d, c, a in batch]
+                rows = list(self.db.all_docs(keys=keys, include_docs=True))
+        except:
+            self._batch_failed(batch)
+            return
+
+        items = []
+        latest_docs = []
+        for item, row in zip(batch, rows):
+            doc = item[0]
+            if not row.get("doc"):
+                logger.error("Could not find doc {0} to save it"
+                             .format(doc["_id"]))
+                metrics.increment("parser_daemon.save_error")
+                self._done(item)
+                continue
+            latest = row["doc"]
+            self.merge(latest, doc)
+            items.append(item)
+            latest_docs.append(latest)
+
+        if not latest_docs:
+            return
+
+        try:
+            with tracing.stage("bulk_save"):
+                results = self.db.save_docs(latest_docs)
+        except couchdbkit.exceptions.BulkSaveError as e:
+            results = e.results
+        except:
+            self._batch_failed(items)
+            return
+
+        for item, result in zip(items, results):
+            if "error" not in result:
+                metrics.increment("parser_daemon.saved")
+                self._done(item)
+            elif result["error"] == "conflict":
+                metrics.increment("parser_daemon.save_conflict")
+                self._failed(item)
+            else:
+                logger.error("Could not save doc {0}: {1}"
+                             .format(result.get("id"), result["error"]))
+                metrics.increment("parser_daemon.save_error")
+                self._done(item)
+
+        logger.debug("Bulk saved {0} docs ({1} to retry)"
+                     .format(len(batch), len(self._retry)))
+
+    def merge(self, latest, doc):
+        """
+        Merge the parsed *doc* into *latest*, the document as it is in the
+        database. By default, the parsed data is added to the latest data.
+        """
+        latest["data"].update(doc["data"])
+
+    def save_many(self, docs):
+        """
+        Save *docs* in batches in this thread (without :meth:`start`),
+        returning once every one has been saved or given up on.
+        """
+        items = [(doc, None, 0) for doc in docs]
+        while items:
+            for i in xrange(0, len(items), self.batch_size):
+                self.flush(items[i:i + self.batch_size])
+            items, self._retry = self._retry, []
+
+    def _batch_failed(self, items):
+        """Retry all of *items* after an error talking to the database."""
+        logger.exception("Error while bulk saving {0} docs"
+                         .format(len(items)))
+        for item in items:
+            self._failed(item)
+        time.sleep(self.error_delay)
+
+    def _failed(self, item):
+        """Queue *item* to be retried, unless it has had enough attempts."""
+        doc, callback, attempts = item
+        attempts += 1
+        if attempts >= self.max_attempts:
+            logger.error("Could not save doc {0} after {1} attempts."
+                         .format(doc["_id"], attempts))
+            metrics.increment("parser_daemon.save_error")
+            self._done(item)
+        else:
+            self._retry.append((doc, callback, attempts))
+
+    def _done(self, item):
+        doc, callback, attempts = item
+        if callback is not None:
+            try:
+                callback()
+            except:
+                logger.exception("Exception from bulk save callback")
+
+
+class SequenceTracker(object):
+    """
+    Tracks changes that are being processed out of order, to find the
+    sequence number up to which every change has been processed.
+
+    Sequence numbers are treated as opaque: changes are considered to be in
+    the order in which they are given to :meth:`start`.
+    """
+
+    def __init__(self, last_seq=None):
+        self.last_seq = last_seq
+        self._started = collections.deque()
+        self._finished = set()
+        self._lock = threading.Lock()
+
+    def start(self, seq):
+        """Note that the change *seq* is being processed."""
+        with self._lock:
+            self._started.append(seq)
+
+    def finish(self, seq):
+        """
+        Note that the change *seq* has been processed, and return the new
+        :attr:`last_seq`.
+        """
+        with self._lock:
+            self._finished.add(seq)
+            while self._started and self._started[0] in self._finished:
+                self.last_seq = self._started.popleft()
+                self._finished.remove(self.last_seq)
+            return self.last_seq
+
+    def __len__(self):
+        """The number of changes started but not yet finished."""
+        with self._lock:
+            return len(self._started)
+
+
+_worker_parser = None
+
+
+def _init_worker(config, db=None):
+    """Create the :class:`Parser` used by this worker process."""
+    global _worker_parser
+    if db is None:
+        _worker_parser = parser.Parser(config)
+    else:
+        _worker_parser = parser.Parser(config, db=db)
+
+
+def _parse_in_worker(seq, doc):
+    """
+    Parse *doc* in a worker process, returning ``(seq, parsed doc)``, or
+    ``(seq, None)`` if it couldn't be parsed.
+    """
+    try:
+        return seq, _worker_parser.parse(doc)
+    except:
+        logger.exception("Exception while parsing change {0}".format(seq))
+        return seq, None
@@ -50,13 +50,97 @@ this case the message should not include a terminating ``*``.
 """
 
 import re
+import functools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from ..parser import ParserModule
-from ..utils import checksums
+from ..sensors import base, stdtelem
+from ..utils import checksums, lru
 
 checksum_algorithms = [
     "crc16-ccitt", "xor", "fletcher-16", "fletcher-16-256", "none"]
 
+# algorithm -> (name for error messages, function returning the hex checksum)
+checksum_functions = dict(
+    (name, (algorithm.label, algorithm.hexdigest))
+    for name, algorithm in checksums.algorithms.items())
+
+
+class SentencePlan(object):
+    """
+    A sentence dictionary that has been verified and prepared by
+    :meth:`UKHASParser.compile`, ready to parse many strings.
+
+    * ``config``: the sentence dictionary it was compiled from
+    * ``checksum``: the checksum algorithm
+    * ``field_count``: the number of fields expected after the callsign
+    * ``sensors``: a list of ``(field name, sensor)`` where ``sensor`` is a
+      callable taking the field's string
+    * ``column_decoders``: for each field, a function that decodes a whole
+      column of that field's strings at once (see
+      :meth:`UKHASParser.parse_many`), or None
+    """
+
+    def __init__(self, config, sensors, column_decoders=None):
+        self.config = config
+        self.checksum = config["checksum"]
+        self.field_count = len(sensors)
+        self.sensors = sensors
+        if column_decoders is None:
+            column_decoders = [None] * len(sensors)
+        self.column_decoders = column_decoders
+
+
+def _decode_floats(config, strings):
+    """
+    Column decoder for ``base.ascii_float``. Like all column decoders, it
+    returns a list of values and a list of flags that are False where the
+    value must instead be found (or rejected) by the sensor itself.
+    """
+    values = numpy.array(strings).astype(numpy.float64)
+    return values.tolist(), numpy.isfinite(values).tolist()
+
+
+def _decode_ints(config, strings):
+    """Column decoder for ``base.ascii_int``."""
+    values = numpy.array(strings).astype(numpy.int64)
+    return values.tolist(), [True] * len(strings)
+
+
+def _decode_coordinates(config, strings):
+    """
+    Column decoder for ``stdtelem.coordinate`` in decimal degrees, checking
+    the range of the whole column at once.
+    """
+    limit = 90.0 if config.get("name") == "latitude" else 180.0
+    values = numpy.array(strings).astype(numpy.float64)
+    in_range = (values >= -limit) & (values <= limit)
+    return values.tolist(), in_range.tolist()
+
+
+class Sentence(object):
+    """
+    A telemetry string that has been checked and split up by
+    :meth:`UKHASParser.tokenise`.
+
+    * ``string``: the string, as received
+    * ``body``: the string without the ``$$``, checksum and newline; that
+      is, what the checksum is computed over
+    * ``checksum``: the checksum given in the string, or None
+    * ``fields``: the comma separated fields of the body, the first of
+      which is the callsign
+    """
+
+    def __init__(self, string, body, checksum, fields):
+        self.string = string
+        self.body = body
+        self.checksum = checksum
+        self.fields = fields
+
 
 class UKHASParser(ParserModule):
     """The UKHAS Parser Module"""
@@ -64,6 +148,15 @@ class UKHASParser(ParserModule):
     string_exp = re.compile("^[\\x20-\\x7E]+$")
     callsign_exp = re.compile("^[a-zA-Z0-9/_\\-]+$")
     checksum_exp = re.compile("^[a-fA-F0-9]+$")
+    plan_cache_size = 256
+    # Enough for every string in a batch to be pre_parsed before any are
+    # parsed (see Parser.parse_many).
+    sentence_cache_size = 1024
+
+    def __init__(self, parser):
+        super(UKHASParser, self).__init__(parser)
+        self.plans = lru.LRUCache(self.plan_cache_size)
+        self.sentences = {}
 
     def _split_basic_format(self, string):
         """
@@ -173,44 +266,130 @@ class UKHASParser(ParserModule):
 
         if checksum == None and algorithm != "none":
             raise ValueError("No checksum found but config specifies one.")
-        elif algorithm == "crc16-ccitt":
-            if checksums.crc16_ccitt(string) != checksum.upper():
-                raise ValueError("Invalid CRC16-CCITT checksum.")
-        elif algorithm == "xor":
-            if checksums.xor(string) != checksum.upper():
-                raise ValueError("Invalid XOR checksum.")
-        elif algorithm == "fletcher-16":
-            if checksums.fletcher_16(string) != checksum.upper():
-                raise ValueError("Invalid Fletcher-16 checksum.")
-        elif algorithm == "fletcher-16-256":
-            if checksums.fletcher_16(string, 256) != checksum.upper():
-                raise ValueError("Invalid Fletcher-16-256 checksum.")
+        elif algorithm in checksums.algorithms:
+            checker = checksums.algorithms[algorithm]
+            if not checker.verify(string, checksum):
+                raise ValueError("Invalid {0} checksum.".format(checker.label))
 
     def _verify_callsign(self, callsign):
         if not self.callsign_exp.search(callsign):
             raise ValueError("Invalid callsign, contains characters "
                              "besides A-Z and 0-9.")
 
-    def _parse_field(self, field, config):
+    def _bind_sensor(self, config):
+        """
+        Prepare the sensor for a field, given its configuration dictionary.
+
+        Returns the name from the config and a callable which takes the
+        field's string and returns the appropriately parsed data.
+        """
+
+        sensor = self.loadable_manager.resolve('sensors.' + config["sensor"])
+        return [config["name"], functools.partial(sensor, config)]
+
+    def _column_decoder(self, config):
+        """
+        Returns a function that decodes a column of strings for the field
+        with the configuration dictionary *config*, or None if the field
+        can't be decoded a column at a time (including if NumPy isn't
+        available).
+        """
+
+        if numpy is None:
+            return None
+
+        sensor = self.loadable_manager.resolve('sensors.' + config["sensor"])
+        if config.get("optional", False):
+            return None
+        elif sensor is base.ascii_float:
+            decoder = _decode_floats
+        elif sensor is base.ascii_int and config.get("base", 10) == 10:
+            decoder = _decode_ints
+        elif sensor is stdtelem.coordinate and \
+                re.match("^d{1,3}\\.d{1,6}$", config.get("format", "")):
+            decoder = _decode_coordinates
+        else:
+            return None
+        return functools.partial(decoder, config)
+
+    def _parse_field(self, field, name, sensor):
         """
-        Parse a *field* string using its configuration dictionary.
+        Parse a *field* string using its bound *sensor*.
 
-        Return the name from the config and the appropriately parsed data.
         :py:exc:`ValueError <exceptions.ValueError>` is raised in invalid
         inputs.
         """
 
-        name = config["name"]
-        sensor = 'sensors.' + config["sensor"]
-
         try:
-            data = self.loadable_manager.run(sensor, config, field)
+            return sensor(field)
         except (ValueError, KeyError) as e:
             # Annotate error with the field name.
             error_type = type(e)
             raise error_type("(field {f}): {e!s}".format(f=name, e=e))
 
-        return [name, data]
+    def compile(self, config, key=None):
+        """
+        Verify the sentence dictionary *config* and prepare it for parsing,
+        returning a :class:`SentencePlan` that may be given to :meth:`parse`
+        in place of *config*.
+
+        If *key* is provided, the plan is cached against it and a cached
+        plan is returned on subsequent calls with the same *key*. The
+        :class:`Parser <habitat.parser.Parser>` uses
+        ``(document _id, _rev, sentence index)``.
+
+        :py:exc:`ValueError <exceptions.ValueError>` is raised if the config
+        is invalid.
+        """
+
+        if key is not None:
+            plan = self.plans.get(key)
+            if plan is not None:
+                return plan
+
+        self._verify_config(config)
+        sensors = [self._bind_sensor(field) for field in config["fields"]]
+        decoders = [self._column_decoder(field) for field in config["fields"]]
+        plan = SentencePlan(config, sensors, decoders)
+
+        if key is not None:
+            self.plans[key] = plan
+        return plan
+
+    def tokenise(self, string):
+        """
+        Check the basic format of *string* and split it up, returning a
+        :class:`Sentence`.
+
+        The result is cached, so that the work is done once when a string
+        is given to :meth:`pre_parse` and then :meth:`parse`. The cache is
+        simply emptied when full, which is much cheaper than keeping track
+        of which strings were used least recently.
+
+        :py:exc:`ValueError <exceptions.ValueError>` is raised if the
+        string is invalid.
+        """
+
+        sentence = self.sentences.get(string)
+        if sentence is None:
+            body, checksum = self._split_basic_format(string)
+            fields = self._extract_fields(body)
+            sentence = Sentence(string, body, checksum, fields)
+            if len(self.sentences) >= self.sentence_cache_size:
+                self.sentences.clear()
+            self.sentences[string] = sentence
+        return sentence
+
+    def sniff(self, string):
+        """
+        Cheaply check whether *string* looks like a UKHAS sentence: that is,
+        that it starts with ``$$`` and ends with a newline.
+
+        Strings that don't cannot be parsed by this module, so the parser
+        won't try to.
+        """
+
+        return string[:2] == "$$" and string[-1:] == "\n"
 
     def pre_parse(self, string):
         """
@@ -221,17 +400,17 @@ class UKHASParser(ParserModule):
         :exc:`ValueError <exceptions.ValueError>` is raised.
         """
 
-        string, checksum = self._split_basic_format(string)
-        fields = self._extract_fields(string)
-        self._verify_callsign(fields[0])
-        return fields[0]
+        callsign = self.tokenise(string).fields[0]
+        self._verify_callsign(callsign)
+        return callsign
 
     def parse(self, string, config):
         """
         Parse *string*, extracting processed field data.
 
         *config* is a dictionary containing the sentence dictionary
-        from the payload's configuration document.
+        from the payload's configuration document, or a
+        :class:`SentencePlan` produced from one by :meth:`compile`.
 
         Returns a dictionary of the parsed data, with field names as
         keys and the result as the value. Also inserts a ``payload`` field
@@ -241,19 +420,95 @@ class UKHASParser(ParserModule):
         :py:exc:`ValueError <exceptions.ValueError>` is raised on invalid
         messages.
         """
-        self._verify_config(config)
-        strippedstring, checksum = self._split_basic_format(string)
-        self._verify_checksum(strippedstring, checksum, config["checksum"])
-
-        fields = self._extract_fields(strippedstring)
-        self._verify_callsign(fields[0])
+        if isinstance(config, SentencePlan):
+            plan = config
+        else:
+            plan = self.compile(config)
 
-        if len(fields) - 1 != len(config["fields"]):
-            raise ValueError("Incorrect number of fields (got {0}, expect {1})"
-                    .format(len(fields) - 1, len(config["fields"])))
+        fields = self._split_fields(string, plan)
 
         output = {"payload": fields[0], "_sentence": string}
-        for field, field_config in zip(fields[1:], config["fields"]):
-            name, data = self._parse_field(field, field_config)
-            output[name] = data
+        for field, (name, sensor) in zip(fields[1:], plan.sensors):
+            output[name] = self._parse_field(field, name, sensor)
         return output
+
+    def parse_many(self, strings, config):
+        """
+        Parse each of *strings* with the same *config* (as for
+        :meth:`parse`), returning a list with, for each string, either the
+        dictionary :meth:`parse` would return or the
+        :py:exc:`ValueError <exceptions.ValueError>` (or
+        :py:exc:`KeyError <exceptions.KeyError>`) it would raise.
+
+        The strings are split into columns, one per field. If NumPy is
+        available, numeric columns (integers, floats and decimal degree
+        coordinates) are converted and range checked in one go; strings
+        that fail are then given to the field's sensor, as :meth:`parse`
+        would, so that the results and errors are exactly the same.
+        """
+        if isinstance(config, SentencePlan):
+            plan = config
+        else:
+            plan = self.compile(config)
+
+        results = [None] * len(strings)
+        rows = []
+        for i, string in enumerate(strings):
+            try:
+                fields = self._split_fields(string, plan)
+            except ValueError as e:
+                results[i] = e
+            else:
+                results[i] = {"payload": fields[0], "_sentence": string}
+                rows.append((i, fields))
+
+        for column, (name, sensor) in enumerate(plan.sensors, 1):
+            rows = self._parse_column(rows, column, name, sensor,
+                                      plan.column_decoders[column - 1],
+                                      results)
+        return results
+
+    def _parse_column(self, rows, column, name, sensor, decoder, results):
+        """
+        Parse field number *column* of each of *rows* (``(index, fields)``)
+        into *results*, returning the rows that didn't fail.
+        """
+        strings = [fields[column] for i, fields in rows]
+        values, decoded = None, None
+        if decoder is not None and strings:
+            try:
+                values, decoded = decoder(strings)
+            except (ValueError, TypeError, OverflowError):
+                # At least one of them is bad: find out which, below.
+                pass
+
+        remaining = []
+        for n, (i, fields) in enumerate(rows):
+            if decoded is not None and decoded[n]:
+                results[i][name] = values[n]
+                remaining.append((i, fields))
+                continue
+            try:
+                results[i][name] = self._parse_field(strings[n], name, sensor)
+            except (ValueError, KeyError) as e:
+                results[i] = e
+            else:
+                remaining.append((i, fields))
+        return remaining
+
+    def _split_fields(self, string, plan):
+        """
+        Tokenise *string* and check its checksum, callsign and number of
+        fields against *plan*, returning its fields.
+        """
+        sentence = self.tokenise(string)
+        self._verify_checksum(sentence.body, sentence.checksum,
+                              plan.checksum)
+
+        fields = sentence.fields
+        self._verify_callsign(fields[0])
+
+        if len(fields) - 1 != plan.field_count:
+            raise ValueError("Incorrect number of fields (got {0}, expect {1})"
+                    .format(len(fields) - 1, plan.field_count))
+        return fields
@@ -0,0 +1,251 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Re-parse a dump of telemetry offline, without CouchDB.
+
+:class:`ParserReplay` reads ``payload_telemetry`` documents, one JSON
+document per line, parses them with a pool of :class:`Parser
+<habitat.parser.Parser>` processes and writes the parsed documents out as
+JSON lines. Configuration comes from a snapshot of ``flight`` and
+``payload_configuration`` documents (in the same format), loaded into a
+:class:`habitat.utils.memory_couch.Database`.
+
+Lines may also be view rows (from a view queried with ``include_docs``), in
+which case the row's ``doc`` is used.
+
+Note that, as when parsing live, a flight's configuration documents are only
+used while the flight's window is open: when replaying old telemetry, the
+latest configuration for each callsign is used instead.
+
+Use ``bin/parser_replay`` to run it from the command line.
+"""
+
+import sys
+import time
+import json
+import logging
+import collections
+import multiprocessing
+from optparse import OptionParser
+
+from . import parser
+from .utils import memory_couch, startup
+
+logger = logging.getLogger("habitat.parser_replay")
+
+__all__ = ["ParserReplay", "read_docs", "main"]
+
+
+def read_docs(lines):
+    """
+    Yields the documents in *lines* (an iterable of JSON strings, such as a
+    file), skipping blank lines and logging and skipping invalid ones.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+        except ValueError:
+            logger.warning("Skipping invalid JSON: {0!r}".format(line[:100]))
+            continue
+        if "doc" in doc and "type" not in doc:
+            doc = doc["doc"]
+        if doc is not None:
+            yield doc
+
+
+class ParserReplay(object):
+    """
+    Parses dumped telemetry with *workers* processes (or in this process,
+    if *workers* is 0), handing them *chunk_size* documents at a time.
+
+    *config* is the habitat configuration, of which the ``parser`` and
+    ``loadables`` sections are used. *configs* is an iterable of flight and
+    payload_configuration documents.
+    """
+
+    def __init__(self, config, configs, workers=None, chunk_size=500):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        self.config = config
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        self.db = memory_couch.Database()
+        count = 0
+        for doc in configs:
+            if doc.get("type") not in ("flight", "payload_configuration"):
+                continue
+            doc = dict(doc)
+            doc.pop("_rev", None)
+            self.db.save_doc(doc)
+            count += 1
+        logger.info("Loaded {0} configuration documents".format(count))
+
+        self.stats = {"read": 0, "parsed": 0, "failed": 0}
+
+    def run(self, lines, output):
+        """
+        Parse the telemetry in *lines* (JSON strings) and write each parsed
+        document to the file *output*, one per line, in the same order.
+
+        Returns a dict of statistics: the number of documents ``read``,
+        ``parsed`` and ``failed``, the ``elapsed`` time in seconds and the
+        number of documents parsed per second, ``docs_per_sec``.
+        """
+        start = time.time()
+        chunks = self._chunks(lines)
+
+        if self.workers:
+            pool = multiprocessing.Pool(self.workers,
+                                        initializer=_init_worker,
+                                        initargs=(self.config, self.db))
+            try:
+                # Keep a few chunks queued for each worker, but no more, so
+                # that huge dumps don't have to fit in memory.
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_parse_chunk, (chunk, )))
+                    if len(pending) >= 4 * self.workers:
+                        self._write(pending.popleft().get(), output, start)
+                while pending:
+                    self._write(pending.popleft().get(), output, start)
+            finally:
+                pool.terminate()
+        else:
+            _init_worker(self.config, self.db)
+            for chunk in chunks:
+                self._write(_parse_chunk(chunk), output, start)
+
+        elapsed = time.time() - start
+        stats = dict(self.stats)
+        stats["elapsed"] = round(elapsed, 3)
+        stats["docs_per_sec"] = \
+            round(stats["read"] / elapsed, 1) if elapsed else None
+        logger.info("Replay finished: {0}".format(json.dumps(stats)))
+        return stats
+
+    def _chunks(self, lines):
+        """Group *lines* into lists of at most :attr:`chunk_size` lines."""
+        chunk = []
+        for line in lines:
+            if not line.strip():
+                continue
+            chunk.append(line)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _write(self, result, output, start):
+        """Write out and count the result of :func:`_parse_chunk`."""
+        parsed_lines, read = result
+        for line in parsed_lines:
+            output.write(line)
+            output.write("\n")
+
+        before = self.stats["read"]
+        self.stats["read"] += read
+        self.stats["parsed"] += len(parsed_lines)
+        self.stats["failed"] += read - len(parsed_lines)
+
+        if before // 100000 != self.stats["read"] // 100000:
+            logger.info("Replayed {0} documents ({1:.0f}/s)".format(
+                self.stats["read"],
+                self.stats["read"] / (time.time() - start)))
+
+
+_replay_parser = None
+
+
+def _init_worker(config, db):
+    """Create the :class:`Parser` used by this worker process."""
+    global _replay_parser
+    _replay_parser = parser.Parser(config, db=db)
+
+
+def _parse_chunk(lines):
+    """
+    Parse the documents in *lines*, returning ``(JSON lines of the parsed
+    documents, number of lines read)``.
+    """
+    docs = list(read_docs(lines))
+    try:
+        results = _replay_parser.parse_many(docs)
+    except:
+        # Find the culprit(s), rather than losing the whole chunk.
+        results = []
+        for doc in docs:
+            try:
+                results.append(_replay_parser.parse(doc))
+            except:
+                logger.exception("Exception while parsing {0}"
+                                 .format(doc.get("_id")))
+    return [json.dumps(doc) for doc in results if doc], len(lines)
+
+
+def main(argv=None):
+    """
+    Command line entry point, used by ``bin/parser_replay``.
+
+    Usage: ``parser_replay [options] CONFIGS TELEMETRY [OUTPUT]``, where
+    the files contain JSON lines and ``-`` means stdin or stdout (the
+    default for *OUTPUT*). Statistics are written to stderr as JSON.
+    """
+    oparser = OptionParser("usage: %prog [options] CONFIGS TELEMETRY "
+                           "[OUTPUT]")
+    oparser.add_option("-c", "--config", dest="config", metavar="FILE",
+                       help="habitat configuration file (./habitat.yml)",
+                       default="./habitat.yml")
+    oparser.add_option("-w", "--workers", dest="workers", type="int",
+                       help="number of parser processes (one per CPU)",
+                       metavar="N", default=None)
+    oparser.add_option("-s", "--chunk-size", dest="chunk_size", type="int",
+                       help="documents per chunk (500)", metavar="N",
+                       default=500)
+    (options, args) = oparser.parse_args(argv)
+
+    if len(args) not in (2, 3):
+        oparser.error("Expected two or three positional arguments")
+
+    def open_file(name, mode):
+        if name == "-":
+            return sys.stdin if mode == "r" else sys.stdout
+        return open(name, mode)
+
+    config = startup.load_config(options.config)
+    startup.setup_logging(config, "parserreplay")
+    startup.setup_metrics(config)
+
+    configs = open_file(args[0], "r")
+    replay = ParserReplay(config, read_docs(configs), options.workers,
+                          options.chunk_size)
+
+    telemetry = open_file(args[1], "r")
+    output = open_file(args[2] if len(args) == 3 else "-", "w")
+    try:
+        stats = replay.run(telemetry, output)
+    finally:
+        output.flush()
+        if output is not sys.stdout:
+            output.close()
+
+    sys.stderr.write(json.dumps(stats) + "\n")
@@ -0,0 +1,68 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.benchmarks.corpus
+"""
+
+from nose.tools import eq_
+
+from ...benchmarks import corpus, suites
+from ...loadable_manager import LoadableManager
+from ...parser_modules import ukhas_parser
+
+
+class FakeParser:
+    def __init__(self):
+        self.loadable_manager = LoadableManager(suites.parser_config)
+
+
+class TestCorpus(object):
+    def setup(self):
+        self.module = ukhas_parser.UKHASParser(FakeParser())
+
+    def check_parses(self, field_count, checksum):
+        config, strings = corpus.make_corpus(20, field_count=field_count,
+                                             checksum=checksum)
+        sentence = config["sentences"][0]
+        eq_(len(sentence["fields"]), field_count)
+        for string in strings:
+            data = self.module.parse(string, sentence)
+            eq_(data["payload"], "BENCH")
+            eq_(len(data), field_count + 2)
+
+    def test_strings_parse(self):
+        for field_count in (3, 5, 12):
+            for checksum in ("crc16-ccitt", "xor", "fletcher-16", "none"):
+                yield self.check_parses, field_count, checksum
+
+    def test_is_deterministic(self):
+        eq_(corpus.make_corpus(5, seed=3), corpus.make_corpus(5, seed=3))
+        assert corpus.make_corpus(5, seed=3) != corpus.make_corpus(5, seed=4)
+
+    def test_heavy_strings_need_filtering(self):
+        config, strings = corpus.make_corpus(5, filters="heavy")
+        filters = config["sentences"][0]["filters"]
+        eq_(filters["intermediate"][0]["checksum"], "crc16-ccitt")
+        for string in strings:
+            assert ";" in string
+            assert string.startswith("$$BENCH,")
+
+    def test_telemetry_doc(self):
+        doc = corpus.make_telemetry_doc("$$BENCH,1*00\n", 4)
+        eq_(doc["_id"], "telemetry_4")
+        eq_(doc["data"]["_raw"], "JCRCRU5DSCwxKjAwCg==")
@@ -0,0 +1,62 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.benchmarks.runner
+"""
+
+import time
+
+from nose.tools import eq_, assert_raises
+
+from ...benchmarks import runner
+
+
+class TestPercentile(object):
+    def test_nearest_rank(self):
+        samples = range(1, 101)
+        eq_(runner.percentile(samples, 50), 50)
+        eq_(runner.percentile(samples, 95), 95)
+        eq_(runner.percentile(samples, 99), 99)
+        eq_(runner.percentile(samples, 100), 100)
+        eq_(runner.percentile(samples, 0), 1)
+
+    def test_empty(self):
+        eq_(runner.percentile([], 50), None)
+
+
+class TestMeasure(object):
+    def test_calls_each_input(self):
+        calls = []
+
+        def func(item):
+            calls.append(item)
+            time.sleep(0.001)
+
+        result = runner.measure("test", func, [1, 2, 3], max_calls=7,
+                                warmup=2)
+        eq_(calls, [1, 2, 3, 1, 2, 3, 1, 2, 3])
+        eq_(result["name"], "test")
+        eq_(result["calls"], 7)
+        assert result["ops_per_sec"] > 0
+
+        latency = result["latency"]
+        assert 0 <= latency["p50"] <= latency["p95"] <= latency["p99"] \
+                <= latency["max"]
+
+    def test_needs_inputs(self):
+        assert_raises(ValueError, runner.measure, "test", len, [])
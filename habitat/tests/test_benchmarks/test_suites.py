@@ -0,0 +1,39 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.benchmarks.suites
+"""
+
+from nose.tools import eq_
+
+from ...benchmarks import suites
+
+
+class TestSuites(object):
+    def test_runs_every_benchmark(self):
+        results = suites.run_all(count=4, max_calls=2, filters="heavy")
+        names = set(r["name"] for r in results)
+        for name in ("ukhas_parser.parse", "parser.parse",
+                     "checksums.xor", "sensors.stdtelem.time",
+                     "filters.numeric_scale",
+                     "uploader.extractor.push_string",
+                     "parser_daemon.change"):
+            assert name in names
+        for result in results:
+            eq_(result["calls"], 2)
+            eq_(result["options"]["filters"], "heavy")
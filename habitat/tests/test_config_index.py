@@ -0,0 +1,259 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the in-memory configuration document index.
+"""
+
+import mox
+import couchdbkit
+
+from nose.tools import assert_raises, eq_
+
+from ..utils import immortal_changes
+from .. import config_index
+
+# 2012-07-14T22:00:00Z
+t0 = 1342303200
+
+def make_flight(flight_id, start, end, payloads, approved=True):
+    return {"_id": flight_id, "type": "flight", "approved": approved,
+            "start": "2012-07-14T{0}:00:00Z".format(start),
+            "end": "2012-07-14T{0}:00:00Z".format(end),
+            "payloads": payloads}
+
+def make_config(config_id, created, callsigns):
+    return {"_id": config_id, "type": "payload_configuration",
+            "time_created": "2012-07-14T{0}:00:00Z".format(created),
+            "sentences": [{"callsign": c} for c in callsigns]}
+
+
+class TestConfigIndex(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.db = self.m.CreateMock(couchdbkit.Database)
+        self.db.res = self.m.CreateMockAnything()
+        self.index = config_index.ConfigIndex(self.db)
+
+        self.old = make_config("old", 10, ["habitat"])
+        self.new = make_config("new", 12, ["habitat", "other"])
+        self.flown = make_config("flown", 11, ["habitat"])
+        self.flight = make_flight("flight", 21, 23, ["flown"])
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def expect_build(self, flight_rows, config_rows, seq=100):
+        self.m.StubOutWithMock(config_index, 'time')
+        config_index.time.time().AndReturn(t0)
+        self.db.info().AndReturn({"update_seq": seq})
+        self.db.view("flight/end_start_including_payloads",
+                     include_docs=True, startkey=[t0]).AndReturn(flight_rows)
+        self.db.view("payload_configuration/callsign_time_created_index",
+                     include_docs=True).AndReturn(config_rows)
+
+    def config_rows(self, *docs):
+        return [{"id": d["_id"], "doc": d}
+                for d in docs for s in d["sentences"]]
+
+    def test_build_loads_flights_and_configs(self):
+        flight_rows = [{"id": "flight", "key": [0, 0, "flight", 0],
+                        "doc": self.flight},
+                       {"id": "flight", "key": [0, 0, "flight", 1],
+                        "doc": self.flown}]
+        self.expect_build(flight_rows,
+                          self.config_rows(self.old, self.new, self.flown))
+        self.m.ReplayAll()
+        self.index.build()
+        self.m.VerifyAll()
+
+        eq_(self.index.last_seq, 100)
+        eq_(self.index.lookup("habitat", t0 - 3600), {
+            "id": "new", "payload_configuration": self.new})
+        eq_(self.index.lookup("habitat", t0 - 30 * 60), {
+            "id": "flown", "flight_id": "flight",
+            "payload_configuration": self.flown})
+        eq_(self.index.lookup("other", t0 - 30 * 60), {
+            "id": "new", "payload_configuration": self.new})
+        eq_(self.index.lookup("nobody", t0), None)
+
+    def test_build_skips_missing_linked_docs(self):
+        flight_rows = [{"id": "flight", "key": [0, 0, "flight", 0],
+                        "doc": self.flight},
+                       {"id": "flight", "key": [0, 0, "flight", 1],
+                        "doc": None}]
+        self.expect_build(flight_rows, [])
+        self.m.ReplayAll()
+        self.index.build()
+        self.m.VerifyAll()
+        eq_(self.index.lookup("habitat", t0 - 30 * 60), None)
+
+    def test_picks_earliest_ending_active_flight(self):
+        a = make_config("a", 10, ["habitat"])
+        b = make_config("b", 10, ["habitat"])
+        for doc in [a, b, make_flight("late", 20, 23, ["a"]),
+                    make_flight("early", 21, 22, ["b"])]:
+            self.index.handle_change({"id": doc["_id"], "seq": 1,
+                                      "doc": doc})
+        result = self.index.lookup("habitat", t0 - 30 * 60)
+        eq_(result["flight_id"], "early")
+        eq_(result["id"], "b")
+
+    def test_ignores_unapproved_and_unstarted_flights(self):
+        self.index.handle_change({"id": "flown", "seq": 1, "doc": self.flown})
+        unapproved = make_flight("u", 20, 23, ["flown"], approved=False)
+        self.index.handle_change({"id": "u", "seq": 2, "doc": unapproved})
+        eq_(self.index.lookup("habitat", t0 - 30 * 60),
+            {"id": "flown", "payload_configuration": self.flown})
+
+        self.index.handle_change({"id": "flight", "seq": 3,
+                                  "doc": self.flight})
+        eq_(self.index.lookup("habitat", t0 - 2 * 3600),
+            {"id": "flown", "payload_configuration": self.flown})
+
+    def test_forgets_finished_flights(self):
+        for doc in [self.flown, self.flight]:
+            self.index.handle_change({"id": doc["_id"], "seq": 1,
+                                      "doc": doc})
+        assert "flight_id" in self.index.lookup("habitat", t0 - 30 * 60)
+        assert "flight_id" not in self.index.lookup("habitat", t0 + 7200)
+        assert "flight" not in self.index._flights
+
+    def test_changes_update_and_delete(self):
+        self.index.handle_change({"id": "old", "seq": 5, "doc": self.old})
+        eq_(self.index.last_seq, 5)
+        eq_(self.index.lookup("habitat", t0)["id"], "old")
+
+        self.index.handle_change({"id": "new", "seq": 6, "doc": self.new})
+        eq_(self.index.lookup("habitat", t0)["id"], "new")
+
+        changed = make_config("new", 12, ["other"])
+        self.index.handle_change({"id": "new", "seq": 7, "doc": changed})
+        eq_(self.index.lookup("habitat", t0)["id"], "old")
+        eq_(self.index.lookup("other", t0)["payload_configuration"],
+            changed)
+
+        self.index.handle_change({"id": "new", "seq": 8, "deleted": True,
+                                  "doc": {"_id": "new", "_deleted": True}})
+        eq_(self.index.lookup("other", t0), None)
+        eq_(self.index.last_seq, 8)
+
+    def test_follow_uses_changes_feed(self):
+        self.index.last_seq = 191238
+        self.m.StubOutWithMock(config_index, 'immortal_changes')
+        c = self.m.CreateMock(immortal_changes.Consumer)
+        config_index.immortal_changes.Consumer(self.db).AndReturn(c)
+        c.wait(self.index.handle_change, filter="parser/config",
+               since=191238, include_docs=True, heartbeat=1000)
+        self.m.ReplayAll()
+        self.index.follow()
+        self.m.VerifyAll()
+
+    def test_start_checks_filter_exists(self):
+        self.db.res.get("_changes", filter="parser/config", limit=0)\
+                .AndRaise(couchdbkit.exceptions.ResourceNotFound("missing"))
+        self.m.ReplayAll()
+        assert_raises(config_index.FilterMissing, self.index.start)
+        self.m.VerifyAll()
+        assert self.index._thread is None
+
+
+class TestMissingConfigCache(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.db = self.m.CreateMock(couchdbkit.Database)
+        self.db.res = self.m.CreateMockAnything()
+        self.cache = config_index.MissingConfigCache(self.db, 60)
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def test_remembers_for_ttl(self):
+        self.cache.add("habitat", self.cache.generation, now=t0)
+        assert self.cache.is_missing("habitat", now=t0 + 59)
+        assert not self.cache.is_missing("other", now=t0 + 59)
+        assert not self.cache.is_missing("habitat", now=t0 + 60)
+        eq_(len(self.cache), 0)
+
+    def test_sweeps_expired_callsigns(self):
+        self.cache.sweep_every = 3
+        self.cache.add("garbage1", self.cache.generation, now=t0)
+        self.cache.add("garbage2", self.cache.generation, now=t0 + 30)
+        eq_(len(self.cache), 2)
+        self.cache.add("habitat", self.cache.generation, now=t0 + 60)
+        eq_(len(self.cache), 2)
+        assert not self.cache.is_missing("garbage1", now=t0 + 60)
+        assert self.cache.is_missing("garbage2", now=t0 + 60)
+        assert self.cache.is_missing("habitat", now=t0 + 60)
+
+        self.cache.add("junk1", self.cache.generation, now=t0 + 200)
+        self.cache.add("junk2", self.cache.generation, now=t0 + 200)
+        self.cache.add("habitat", self.cache.generation, now=t0 + 300)
+        eq_(self.cache._expires.keys(), ["habitat"])
+
+    def test_configs_invalidate_their_callsigns(self):
+        for callsign in ["habitat", "other", "third"]:
+            self.cache.add(callsign, self.cache.generation, now=t0)
+        self.cache.handle_change({"id": "new", "seq": 3,
+            "doc": make_config("new", 12, ["habitat", "other"])})
+        assert not self.cache.is_missing("habitat", now=t0)
+        assert not self.cache.is_missing("other", now=t0)
+        assert self.cache.is_missing("third", now=t0)
+        eq_(self.cache.last_seq, 3)
+
+    def test_flights_invalidate_everything(self):
+        self.cache.add("habitat", self.cache.generation, now=t0)
+        self.cache.handle_change({"id": "flight", "seq": 4,
+            "doc": make_flight("flight", 21, 23, ["flown"])})
+        eq_(len(self.cache), 0)
+
+    def test_ignores_adds_from_before_a_change(self):
+        generation = self.cache.generation
+        self.cache.handle_change({"id": "new", "seq": 3,
+            "doc": make_config("new", 12, ["habitat"])})
+        self.cache.add("habitat", generation, now=t0)
+        assert not self.cache.is_missing("habitat", now=t0)
+
+    def test_follows_changes_from_start(self):
+        self.m.StubOutWithMock(config_index, 'threading')
+        thread = self.m.CreateMockAnything()
+        self.db.res.get("_changes", filter="parser/config", limit=0)
+        self.db.info().AndReturn({"update_seq": 100})
+        config_index.threading.Thread(target=self.cache.follow,
+            name="habitat MissingConfigCache").AndReturn(thread)
+        thread.start()
+        self.m.ReplayAll()
+        self.cache.start()
+        self.m.VerifyAll()
+        eq_(self.cache.last_seq, 100)
+
+        self.m.ResetAll()
+        self.m.StubOutWithMock(config_index, 'immortal_changes')
+        c = self.m.CreateMock(immortal_changes.Consumer)
+        config_index.immortal_changes.Consumer(self.db).AndReturn(c)
+        c.wait(self.cache.handle_change, filter="parser/config",
+               since=100, include_docs=True, heartbeat=1000)
+        self.m.ReplayAll()
+        self.cache.follow()
+        self.m.VerifyAll()
+
+    def test_start_checks_filter_exists(self):
+        self.db.res.get("_changes", filter="parser/config", limit=0)\
+                .AndRaise(couchdbkit.exceptions.ResourceNotFound("missing"))
+        self.m.ReplayAll()
+        assert_raises(config_index.FilterMissing, self.cache.start)
+        self.m.VerifyAll()
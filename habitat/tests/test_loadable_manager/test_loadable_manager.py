@@ -20,7 +20,7 @@ Tests the Loadable Manager
 """
 
 import mox
-from nose.tools import raises
+from nose.tools import raises, assert_raises
 from ... import loadable_manager
 
 from . import example_loadable_library_a, example_loadable_library_b
@@ -49,17 +49,21 @@ class TestLoadableManager(object):
     def teardown(self):
         self.mocker.UnsetStubs()
 
+    def expect_load(self, suffix, library, one_arg=()):
+        # Every function in __all__ is inspected when the library is loaded
+        loadable_manager.dynamicloader.load(example_path + suffix).AndReturn(
+            library)
+        for name in library.__all__:
+            f = getattr(library, name)
+            loadable_manager.dynamicloader.hasnumargs(f, 1)\
+                    .AndReturn(name in one_arg)
+
+    def expect_load_all(self, one_arg=()):
+        self.expect_load("_a", example_loadable_library_a, one_arg)
+        self.expect_load("_b", example_loadable_library_b, one_arg)
+
     def test_init_loads_db_listed_modules_and_works(self):
-        loadable_manager.dynamicloader.load(example_path + "_a").AndReturn(
-            example_loadable_library_a)
-        loadable_manager.dynamicloader.load(example_path + "_b").AndReturn(
-            example_loadable_library_b)
-        f_a = example_loadable_library_a.format_a
-        f_b = example_loadable_library_a.format_b
-        f_c = example_loadable_library_b.format_c
-        loadable_manager.dynamicloader.hasnumargs(f_a, 1).AndReturn(False)
-        loadable_manager.dynamicloader.hasnumargs(f_b, 1).AndReturn(False)
-        loadable_manager.dynamicloader.hasnumargs(f_c, 1).AndReturn(False)
+        self.expect_load_all()
         self.mocker.ReplayAll()
         self.mgr = loadable_manager.LoadableManager(fake_config)
         assert len(self.mgr.libraries) == 2
@@ -74,12 +78,7 @@ class TestLoadableManager(object):
 
     @raises(ValueError)
     def test_errors_bubble_up(self):
-        loadable_manager.dynamicloader.load(example_path + "_a").AndReturn(
-            example_loadable_library_a)
-        loadable_manager.dynamicloader.load(example_path + "_b").AndReturn(
-            example_loadable_library_b)
-        f_d = example_loadable_library_b.format_d
-        loadable_manager.dynamicloader.hasnumargs(f_d, 1).AndReturn(False)
+        self.expect_load_all()
         self.mocker.ReplayAll()
 
         loadable_manager.LoadableManager(fake_config).run("libb.format_d", {},
@@ -89,12 +88,7 @@ class TestLoadableManager(object):
         self.mocker.ResetAll()
 
     def test_run_passes_config_dict(self):
-        loadable_manager.dynamicloader.load(example_path + "_a").AndReturn(
-            example_loadable_library_a)
-        loadable_manager.dynamicloader.load(example_path + "_b").AndReturn(
-            example_loadable_library_b)
-        f_c = example_loadable_library_b.format_c
-        loadable_manager.dynamicloader.hasnumargs(f_c, 1).AndReturn(False)
+        self.expect_load_all()
         self.mocker.ReplayAll()
 
         loadable_manager.LoadableManager(fake_config).run("libb.format_c",
@@ -105,10 +99,7 @@ class TestLoadableManager(object):
 
     @raises(ValueError)
     def test_cannot_use_loadable_not_in_all(self):
-        loadable_manager.dynamicloader.load(example_path + "_a").AndReturn(
-            example_loadable_library_a)
-        loadable_manager.dynamicloader.load(example_path + "_b").AndReturn(
-            example_loadable_library_b)
+        self.expect_load_all()
         self.mocker.ReplayAll()
 
         loadable_manager.LoadableManager(fake_config).run("libb.somethingelse",
@@ -118,8 +109,35 @@ class TestLoadableManager(object):
         self.mocker.ResetAll()
 
     def test_repr_describes_manager(self):
+        self.expect_load("_a", example_loadable_library_a)
+        self.mocker.ReplayAll()
         mgr = loadable_manager.LoadableManager(empty_config)
         expect = "<habitat.LoadableManager: {num} libraries loaded>"
         assert repr(mgr) == expect.format(num=0)
         mgr.load(example_path + "_a", "liba")
         assert repr(mgr) == expect.format(num=1)
+        self.mocker.VerifyAll()
+
+    def test_resolve_returns_adapters(self):
+        self.expect_load_all(one_arg=["format_b"])
+        self.mocker.ReplayAll()
+        mgr = loadable_manager.LoadableManager(fake_config)
+        self.mocker.VerifyAll()
+
+        format_a = mgr.resolve("liba.format_a")
+        assert format_a is example_loadable_library_a.format_a
+        assert format_a(None, "x") == ('formatted by a', "'x'")
+
+        # format_b was reported to take only data
+        format_b = mgr.resolve("liba.format_b")
+        assert format_b.__name__ == "format_b"
+        assert_raises(TypeError, format_b, None, "x")
+
+    def test_resolve_rejects_unknown_names(self):
+        self.expect_load_all()
+        self.mocker.ReplayAll()
+        mgr = loadable_manager.LoadableManager(fake_config)
+        assert_raises(ValueError, mgr.resolve, "libc.format_a")
+        assert_raises(ValueError, mgr.resolve, "libb.something_else")
+        assert_raises(ValueError, mgr.resolve, "format_a")
+        self.mocker.VerifyAll()
@@ -21,6 +21,9 @@ Unit tests for the Parser's Sink class.
 
 import os
 import mox
+import base64
+import shutil
+import tempfile
 
 import couchdbkit
 import M2Crypto
@@ -28,7 +31,8 @@ import M2Crypto
 from copy import deepcopy
 from nose.tools import assert_raises, eq_
 
-from ... import parser, loadable_manager
+from ... import parser, loadable_manager, config_index
+from ...utils import frozen
 
 
 class TestParser(object):
@@ -120,6 +124,37 @@ class TestParser(object):
         # initialised with CouchDB mocks in all other tests.
         assert self.parser.db == self.mock_db
 
+    def test_init_starts_config_index(self):
+        new_config = deepcopy(self.parser_config)
+        new_config["parser"]["config_index"] = True
+        self.m.StubOutWithMock(parser.config_index, 'ConfigIndex')
+        index = self.m.CreateMock(config_index.ConfigIndex)
+        parser.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        parser.config_index.ConfigIndex(self.mock_db).AndReturn(index)
+        index.start()
+        self.m.ReplayAll()
+        p = parser.Parser(new_config)
+        assert p.config_index is index
+        self.m.VerifyAll()
+
+    def test_init_falls_back_to_views_without_filter(self):
+        new_config = deepcopy(self.parser_config)
+        new_config["parser"]["config_index"] = True
+        self.m.StubOutWithMock(parser.config_index, 'ConfigIndex')
+        index = self.m.CreateMock(config_index.ConfigIndex)
+        parser.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        parser.config_index.ConfigIndex(self.mock_db).AndReturn(index)
+        index.start().AndRaise(config_index.FilterMissing)
+        self.m.ReplayAll()
+        p = parser.Parser(new_config)
+        assert p.config_index is None
+        assert p.missing_configs is None
+        self.m.VerifyAll()
+
     def test_find_config_doc_looks_for_flights(self):
         view_result = [{"key": [5, 5, 654, 0]}, # this flight has ended
                        {"key": [5, 5, 654, 1], "doc": {
@@ -164,6 +199,58 @@ class TestParser(object):
         eq_(result, {"id": 123, "payload_configuration": config_result["doc"]})
         self.m.VerifyAll()
 
+    def test_find_config_doc_uses_index(self):
+        self.parser.config_index = self.m.CreateMock(config_index.ConfigIndex)
+        self.parser.config_index.lookup("habitat").AndReturn("the config")
+        self.m.ReplayAll()
+        assert self.parser._find_config_doc("habitat") == "the config"
+        self.m.VerifyAll()
+
+    def test_init_starts_missing_config_cache(self):
+        new_config = deepcopy(self.parser_config)
+        new_config["parser"]["missing_config_ttl"] = 600
+        self.m.StubOutWithMock(parser.config_index, 'MissingConfigCache')
+        cache = self.m.CreateMock(config_index.MissingConfigCache)
+        parser.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        parser.config_index.MissingConfigCache(self.mock_db, 600)\
+                .AndReturn(cache)
+        cache.start()
+        self.m.ReplayAll()
+        p = parser.Parser(new_config)
+        assert p.missing_configs is cache
+        self.m.VerifyAll()
+
+    def test_find_config_doc_skips_missing_configs(self):
+        self.parser.missing_configs = \
+                self.m.CreateMock(config_index.MissingConfigCache)
+        self.parser.missing_configs.is_missing("habitat").AndReturn(True)
+        self.m.ReplayAll()
+        assert self.parser._find_config_doc("habitat") is None
+        self.m.VerifyAll()
+
+    def test_find_config_doc_remembers_missing_configs(self):
+        self.parser.missing_configs = \
+                self.m.CreateMock(config_index.MissingConfigCache)
+        self.parser.missing_configs.generation = 4
+        mock_view = self.m.CreateMock(couchdbkit.ViewResults)
+        self.m.StubOutWithMock(parser, 'time')
+        self.parser.missing_configs.is_missing("habitat").AndReturn(False)
+        parser.time.time().AndReturn(4)
+        self.parser.db.view("flight/end_start_including_payloads",
+            include_docs=True, startkey=[4]).AndReturn([])
+        self.parser.db.view(
+            "payload_configuration/callsign_time_created_index",
+            startkey=["habitat", "inf"], include_docs=True, limit=1,
+            descending=True
+            ).AndReturn(mock_view)
+        mock_view.first().AndReturn(None)
+        self.parser.missing_configs.add("habitat", 4)
+        self.m.ReplayAll()
+        assert self.parser._find_config_doc("habitat") is None
+        self.m.VerifyAll()
+
     def test_is_ok_with_configs_without_sentences(self):
         # issue #255: KeyError because sentences is optional in
         # payload_configuration documents
@@ -232,6 +319,174 @@ class TestParser(object):
         assert len(result['receivers']) == 1
         self.m.VerifyAll()
 
+    def make_doc(self, raw):
+        doc = {'data': {'_raw': base64.b64encode(raw)},
+               'receivers': {'tester': {}}, '_id': raw}
+        doc['receivers']['tester']['time_created'] = 123
+        return doc
+
+    def test_parse_many(self):
+        docs = [self.make_doc(r) for r in ["one a", "bad", "two", "one b"]]
+        config = {'payload_configuration': {'sentences': [
+            {"callsign": "one", 'protocol': 'Mock'},
+            {"callsign": "two", 'protocol': 'Mock'}]}, 'id': 'test'}
+        sentences = config['payload_configuration']['sentences']
+        self.m.StubOutWithMock(self.parser, '_find_config_doc')
+        self.mock_module.pre_parse('one a').AndReturn('one')
+        self.mock_module.pre_parse('bad').AndRaise(ValueError)
+        self.mock_module.pre_parse('two').AndReturn('two')
+        self.mock_module.pre_parse('one b').AndReturn('one')
+        # The config for 'one' is only looked up once.
+        self.parser._find_config_doc('one').AndReturn(config)
+        self.mock_module.parse('one a', sentences[0]).AndReturn({"a": 1})
+        self.mock_module.parse('one b', sentences[0]).AndRaise(ValueError)
+        self.parser._find_config_doc('two').AndReturn(config)
+        self.mock_module.parse('two', sentences[1]).AndReturn({"t": 2})
+        self.m.ReplayAll()
+        results = self.parser.parse_many(docs)
+        self.m.VerifyAll()
+
+        assert len(results) == 4
+        assert results[0] is docs[0] and results[2] is docs[2]
+        assert results[1] is None and results[3] is None
+        assert results[0]['data']['a'] == 1
+        assert results[2]['data']['t'] == 2
+        assert results[2]['data']['_parsed']['configuration_sentence_index'] \
+                == 1
+
+    def test_parse_many_tries_next_module_in_order(self):
+        second_module = self.m.CreateMock(parser.ParserModule)
+        self.parser.modules.append({"name": "MockTwo",
+                                    "module": second_module})
+        config = {'payload_configuration': {'sentences': [
+            {"callsign": "cs", 'protocol': 'MockTwo'}]}, 'id': 'test'}
+        docs = [self.make_doc(r) for r in ["x", "y"]]
+        self.m.StubOutWithMock(self.parser, '_find_config_doc')
+        self.mock_module.pre_parse('x').AndRaise(ValueError)
+        self.mock_module.pre_parse('y').AndRaise(ValueError)
+        second_module.pre_parse('x').AndReturn('cs')
+        second_module.pre_parse('y').AndReturn('cs')
+        self.parser._find_config_doc('cs').AndReturn(config)
+        second_module.parse('x', mox.IgnoreArg()).AndReturn({})
+        second_module.parse('y', mox.IgnoreArg()).AndReturn({})
+        self.m.ReplayAll()
+        results = self.parser.parse_many(docs)
+        self.m.VerifyAll()
+        assert [r["_id"] for r in results] == ["x", "y"]
+        assert results[0]["data"]["_protocol"] == "MockTwo"
+
+    def test_parse_many_parses_groups_in_one_go(self):
+        self.parser.modules[0]["compiles"] = True
+        self.parser.modules[0]["parses_many"] = True
+        self.mock_module.compile = self.m.CreateMockAnything()
+        self.mock_module.parse_many = self.m.CreateMockAnything()
+        config = {'payload_configuration': {'sentences': [
+            {"callsign": "cs", 'protocol': 'Mock'}]}, 'id': 'test'}
+        sentence = config['payload_configuration']['sentences'][0]
+        docs = [self.make_doc(r) for r in ["x", "y", "z"]]
+        self.m.StubOutWithMock(self.parser, '_find_config_doc')
+        for raw in ["x", "y", "z"]:
+            self.mock_module.pre_parse(raw).AndReturn('cs')
+        self.parser._find_config_doc('cs').AndReturn(config)
+        self.mock_module.compile(sentence, None).AndReturn("plan")
+        self.mock_module.parse_many(["x", "y", "z"], "plan")\
+                .AndReturn([{"v": "x"}, ValueError("bad"), {"v": "z"}])
+        # y is tried again the usual way, to log why it failed
+        self.mock_module.compile(sentence, None).AndReturn("plan")
+        self.mock_module.parse('y', "plan").AndRaise(ValueError)
+        self.m.ReplayAll()
+        results = self.parser.parse_many(docs)
+        self.m.VerifyAll()
+        eq_(results[1], None)
+        eq_([results[i]["data"]["v"] for i in (0, 2)], ["x", "z"])
+        eq_(results[2]["data"]["_parsed"]["payload_configuration"], "test")
+        eq_(results[2]["data"]["_protocol"], "Mock")
+
+    def add_sniffing_module(self, name, verdict):
+        module = self.m.CreateMockAnything()
+        module.sniff('test string').AndReturn(verdict)
+        self.parser.modules.append({"name": name, "module": module,
+                                    "sniffs": True})
+        return module
+
+    def test_dispatch_order_follows_sniffs(self):
+        no = self.add_sniffing_module("No", False)
+        maybe = self.add_sniffing_module("Maybe", None)
+        yes = self.add_sniffing_module("Yes", True)
+        self.m.ReplayAll()
+        modules, skipped = self.parser._dispatch_order('test string')
+        self.m.VerifyAll()
+        eq_([m["name"] for m in modules], ["Yes", "Mock", "Maybe"])
+        eq_(skipped, 1)
+
+    def test_dispatch_order_survives_sniff_exceptions(self):
+        module = self.m.CreateMockAnything()
+        module.sniff('test string').AndRaise(IndexError)
+        self.parser.modules.append({"name": "Bad", "module": module,
+                                    "sniffs": True})
+        self.m.ReplayAll()
+        modules, skipped = self.parser._dispatch_order('test string')
+        self.m.VerifyAll()
+        eq_([m["name"] for m in modules], ["Mock", "Bad"])
+        eq_(skipped, 0)
+
+    def test_init_doesnt_sniff_with_pre_filters(self):
+        class SniffingModule(parser.ParserModule):
+            def sniff(self, string):
+                return False
+
+        modules = [{"name": "A", "class": SniffingModule},
+                   {"name": "B", "class": SniffingModule,
+                    "pre-filters": [{"type": "normal", "filter": "a.b"}]}]
+        config = deepcopy(self.parser_config)
+        config["parser"]["modules"] = modules
+        parser.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        self.m.ReplayAll()
+        p = parser.Parser(config)
+        self.m.VerifyAll()
+        eq_([m["sniffs"] for m in p.modules], [True, False])
+
+    def test_skips_modules_that_rule_themselves_out(self):
+        self.parser.modules[0]["sniffs"] = True
+        self.mock_module.sniff = self.m.CreateMockAnything()
+        self.mock_module.sniff('test string').AndReturn(False)
+        doc = {'data': {'_raw': "dGVzdCBzdHJpbmc="},
+               'receivers': {'tester': {}}, '_id': 'test_id'}
+        self.m.StubOutWithMock(parser, 'metrics')
+        parser.metrics.increment("parser.ascii_doc")
+        parser.metrics.increment("parser.sniff.skipped", 1)
+        parser.metrics.increment("parser.sniff.rejected")
+        parser.metrics.increment("parser.failed")
+        self.m.ReplayAll()
+        assert self.parser.parse(doc) is None
+        self.m.VerifyAll()
+
+    def test_parse_many_uses_each_documents_dispatch_order(self):
+        second_module = self.m.CreateMock(parser.ParserModule)
+        second_module.sniff = self.m.CreateMockAnything()
+        self.parser.modules.append({"name": "MockTwo", "sniffs": True,
+                                    "module": second_module})
+        config = {'payload_configuration': {'sentences': [
+            {"callsign": "cs", 'protocol': 'MockTwo'},
+            {"callsign": "cs", 'protocol': 'Mock'}]}, 'id': 'test'}
+        docs = [self.make_doc(r) for r in ["x", "y"]]
+        self.m.StubOutWithMock(self.parser, '_find_config_doc')
+        second_module.sniff('x').AndReturn(True)
+        second_module.sniff('y').AndReturn(False)
+        self.mock_module.pre_parse('y').AndReturn('cs')
+        self.parser._find_config_doc('cs').AndReturn(config)
+        self.mock_module.parse('y', mox.IgnoreArg()).AndReturn({})
+        second_module.pre_parse('x').AndReturn('cs')
+        self.parser._find_config_doc('cs').AndReturn(config)
+        second_module.parse('x', mox.IgnoreArg()).AndReturn({})
+        self.m.ReplayAll()
+        results = self.parser.parse_many(docs)
+        self.m.VerifyAll()
+        eq_(results[0]["data"]["_protocol"], "MockTwo")
+        eq_(results[1]["data"]["_protocol"], "Mock")
+
     def setup_parse(self, config=None, doc=None):
         if config is None:
             config = {'payload_configuration': {'sentences': [
@@ -247,6 +502,34 @@ class TestParser(object):
         self.mock_module.parse('test string', payload_config).AndReturn({})
         return doc, config
 
+    def test_compiles_sentences_with_key(self):
+        self.parser.modules[0]["compiles"] = True
+        self.mock_module.compile = self.m.CreateMockAnything()
+
+        config = {'payload_configuration': {'sentences': [
+            {"callsign": "callsign", "protocol": "Mock"}], "_rev": "1-a"},
+            "id": "test"}
+        doc = {'data': {'_raw': "dGVzdCBzdHJpbmc="},
+               'receivers': {'tester': {}}, '_id': 'test_id'}
+        sentence = config['payload_configuration']['sentences'][0]
+        self.m.StubOutWithMock(self.parser, '_find_config_doc')
+        self.mock_module.pre_parse('test string').AndReturn('callsign')
+        self.parser._find_config_doc('callsign').AndReturn(config)
+        self.mock_module.compile(sentence, ("test", "1-a", 0))\
+                .AndReturn("plan")
+        self.mock_module.parse('test string', "plan").AndReturn({})
+        self.m.ReplayAll()
+        assert self.parser.parse(doc)
+        self.m.VerifyAll()
+
+    def test_plan_key_requires_id_and_rev(self):
+        config = {"id": None, "payload_configuration": {"_rev": "1-a"}}
+        assert self.parser._plan_key(config, 0) is None
+        config = {"id": "test", "payload_configuration": {}}
+        assert self.parser._plan_key(config, 0) is None
+        config = {"id": "test", "payload_configuration": {"_rev": "1-a"}}
+        assert self.parser._plan_key(config, 2) == ("test", "1-a", 2)
+
     def test_calls_filters(self):
         doc, config = self.setup_parse()
         mock_filtering = self.m.CreateMock(parser.ParserFiltering)
@@ -320,6 +603,13 @@ class TestParser(object):
                   "payload_configuration": config}
         assert self.parser._get_config('supply', config) == result
 
+    def test_uses_frozen_copy_of_provided_config(self):
+        config = {"sentences": [{"callsign": "supply", "protocol": "Mock"}]}
+        result = self.parser._get_config('supply', frozen.freeze(config))
+        assert "_id" not in result["payload_configuration"]
+        assert_raises(TypeError,
+            result["payload_configuration"]["sentences"].append, {})
+
     def test_raises_if_provided_config_doesnt_have_correct_callsign(self):
         config = {"sentences": [{"callsign": "bad", "protocol": "Mock"}]}
         assert_raises(parser.CantGetConfig, self.parser._get_config,
@@ -384,6 +674,87 @@ class TestParserFiltering(object):
         assert self.fil.post_filter(data, config) == {'result': True}
         self.m.VerifyAll()
 
+    def test_rolls_back_failed_filters(self):
+        data = {"a": 1, "b": [1, 2], "c": 3}
+
+        def bad_filter(name, config, data):
+            data["a"] = 2
+            data["b"].append(3)
+            del data["c"]
+            data.update(d=4)
+            data.setdefault("e", 5)
+            raise ValueError("oh no")
+
+        f = {"type": "normal", "filter": "bad"}
+        self.fil.loadable_manager.run('filters.bad', f, mox.IgnoreArg())\
+                .WithSideEffects(bad_filter)
+        self.m.ReplayAll()
+        eq_(self.fil._filter(data, f, dict), {"a": 1, "b": [1, 2], "c": 3})
+        self.m.VerifyAll()
+        eq_(data, {"a": 1, "b": [1, 2], "c": 3})
+
+    def test_keeps_changes_from_earlier_filters(self):
+        def good_filter(name, config, data):
+            data["a"] = 2
+            return data
+
+        def bad_filter(name, config, data):
+            data.pop("a")
+            data.clear()
+            raise ValueError("oh no")
+
+        good = {"type": "normal", "filter": "good"}
+        bad = {"type": "normal", "filter": "bad"}
+        self.fil.loadable_manager.run('filters.good', good, mox.IgnoreArg())\
+                .WithSideEffects(good_filter)
+        self.fil.loadable_manager.run('filters.bad', bad, mox.IgnoreArg())\
+                .WithSideEffects(bad_filter)
+        self.m.ReplayAll()
+        data = self.fil._filter({"a": 1}, good, dict)
+        eq_(self.fil._filter(data, bad, dict), {"a": 2})
+        self.m.VerifyAll()
+
+    def test_only_copies_nested_values_that_are_read(self):
+        b = [1, 2]
+        c = {"x": 1}
+        data = {"a": 1, "b": b, "c": c}
+
+        def good_filter(name, config, data):
+            data["a"] = data["a"] + 1
+            return data
+
+        f = {"type": "normal", "filter": "good"}
+        self.fil.loadable_manager.run('filters.good', f, mox.IgnoreArg())\
+                .WithSideEffects(good_filter)
+        self.m.ReplayAll()
+        result = self.fil._apply_filters(data, {"filters": {"post": [f]}},
+                                         "post", dict)
+        self.m.VerifyAll()
+        eq_(result, {"a": 2, "b": [1, 2], "c": {"x": 1}})
+        assert result["b"] is b
+        assert result["c"] is c
+
+    def test_rolls_back_nested_values_however_they_are_read(self):
+        data = {"a": [1], "b": {"x": 1}, "c": [1], "d": [1]}
+
+        def bad_filter(name, config, data):
+            data.get("a").append(2)
+            for key, value in data.iteritems():
+                if key == "b":
+                    value["x"] = 2
+            data.setdefault("c", []).append(2)
+            data.pop("d").append(2)
+            raise ValueError("oh no")
+
+        f = {"type": "normal", "filter": "bad"}
+        self.fil.loadable_manager.run('filters.bad', f, mox.IgnoreArg())\
+                .WithSideEffects(bad_filter)
+        self.m.ReplayAll()
+        expect = {"a": [1], "b": {"x": 1}, "c": [1], "d": [1]}
+        eq_(self.fil._filter(data, f, dict), expect)
+        self.m.VerifyAll()
+        eq_(data, expect)
+
     def test_filters_must_have_type(self):
         assert self.fil._filter('test data', {}, str) == 'test data'
 
@@ -455,7 +826,7 @@ class TestParserFiltering(object):
         self.m.StubOutWithMock(self.fil, '_get_certificate')
         self.m.StubOutWithMock(self.fil, '_verify_certificate')
         self.m.StubOutWithMock(self.fil, '_compile_hotfix')
-        f = {'certificate': 'cert'}
+        f = {'certificate': 'cert', 'code': 'code', 'signature': 'sig'}
         env = {'f': lambda data: 'hotfix ran'}
         self.fil._sanity_check_hotfix(f)
         self.fil._get_certificate('cert').AndReturn('got_cert')
@@ -470,7 +841,8 @@ class TestParserFiltering(object):
         self.m.StubOutWithMock(self.fil, '_get_certificate')
         self.m.StubOutWithMock(self.fil, '_verify_certificate')
         self.m.StubOutWithMock(self.fil, '_compile_hotfix')
-        f = {'certificate': 'cert', 'type': 'hotfix'}
+        f = {'certificate': 'cert', 'type': 'hotfix', 'code': 'code',
+             'signature': 'sig'}
 
         class OhNoError(Exception):
             pass
@@ -487,6 +859,70 @@ class TestParserFiltering(object):
         assert self.fil._filter('unfiltered', f, str) == 'unfiltered'
         self.m.VerifyAll()
 
+    def test_hotfix_filters_are_verified_once(self):
+        self.m.StubOutWithMock(self.fil, '_get_certificate')
+        self.m.StubOutWithMock(self.fil, '_verify_certificate')
+        f = {'certificate': 'cert', 'code': 'return data * 2',
+             'signature': 'sig'}
+        g = dict(f, signature='other')
+        self.fil._get_certificate('cert').AndReturn('got_cert')
+        self.fil._verify_certificate(f, 'got_cert')
+        self.fil._get_certificate('cert').AndReturn('got_cert')
+        self.fil._verify_certificate(g, 'got_cert')
+        self.m.ReplayAll()
+        assert self.fil._hotfix_filter('a', f) == 'aa'
+        assert self.fil._hotfix_filter('b', f) == 'bb'
+        assert self.fil._hotfix_filter('c', g) == 'cc'
+        self.m.VerifyAll()
+
+    def test_hotfix_cache_dropped_when_certs_change(self):
+        self.m.StubOutWithMock(self.fil, '_get_certificate')
+        self.m.StubOutWithMock(self.fil, '_verify_certificate')
+        self.m.StubOutWithMock(self.fil, '_get_certs_mtime')
+        self.fil.certs_check_interval = 0
+        f = {'certificate': 'cert', 'code': 'return data', 'signature': 'sig'}
+        mtime = self.fil.certs_mtime
+        self.fil._get_certs_mtime().AndReturn(mtime)
+        self.fil._get_certificate('cert').AndReturn('got_cert')
+        self.fil._verify_certificate(f, 'got_cert')
+        self.fil._get_certs_mtime().AndReturn((0, 0))
+        self.fil._get_certs_mtime().AndReturn((0, 0))
+        self.fil._get_certificate('cert').AndReturn('got_cert')
+        self.fil._verify_certificate(f, 'got_cert')
+        self.m.ReplayAll()
+        self.fil._hotfix_filter('a', f)
+        self.fil.loaded_certs['cert'] = 'stale'
+        self.fil._hotfix_filter('b', f)
+        self.m.VerifyAll()
+        assert self.fil.certs_mtime == (0, 0)
+        assert 'cert' not in self.fil.loaded_certs
+        assert len(self.fil.certificate_authorities) == 1
+
+    def test_certs_checked_at_most_every_interval(self):
+        self.m.StubOutWithMock(self.fil, '_get_certs_mtime')
+        self.m.StubOutWithMock(parser, 'time')
+        self.fil.certs_checked = 100
+        parser.time.time().AndReturn(104)
+        parser.time.time().AndReturn(105)
+        self.fil._get_certs_mtime().AndReturn(self.fil.certs_mtime)
+        parser.time.time().AndReturn(109)
+        self.m.ReplayAll()
+        assert not self.fil._certs_changed()
+        assert not self.fil._certs_changed()
+        assert not self.fil._certs_changed()
+        self.m.VerifyAll()
+        eq_(self.fil.certs_checked, 105)
+
+    def test_init_doesnt_need_certs_dir(self):
+        cert_path = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(cert_path, 'ca'))
+            config = {"parser": {"certs_dir": cert_path}}
+            fil = parser.ParserFiltering(config, None)
+            eq_(fil.certs_mtime[1], None)
+        finally:
+            shutil.rmtree(cert_path)
+
     def test_handles_hotfix_syntax_error(self):
         f = {'code': "this isn't python!"}
         assert_raises(ValueError, self.fil._compile_hotfix, f)
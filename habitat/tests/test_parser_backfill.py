@@ -0,0 +1,132 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.parser_backfill
+"""
+
+import os
+import copy
+import json
+import shutil
+import tempfile
+
+from nose.tools import eq_, assert_raises
+
+from ..benchmarks import corpus, suites
+from ..utils import memory_couch
+from .. import parser
+from .. import parser_backfill
+
+
+class TestParserBackfill(object):
+    def setup(self):
+        self.db = memory_couch.Database()
+        self.good, strings = corpus.make_corpus(12, field_count=5)
+        self.good["_id"] = "good"
+        self.bad = copy.deepcopy(self.good)
+        self.bad["_id"] = "bad"
+        self.bad["sentences"][0]["fields"][4]["name"] = "height"
+        for doc in (self.good, self.bad):
+            self.db.save_doc(doc)
+        for flight_id in ("flight", "other"):
+            self.db.save_doc({"_id": flight_id, "type": "flight"})
+
+        # Telemetry received during the flight, parsed with the wrong
+        # configuration, and one string from another flight.
+        p = parser.Parser(suites.parser_config, db=self.db)
+        for i, string in enumerate(strings):
+            doc = p.parse(corpus.make_telemetry_doc(string, i), self.bad)
+            doc["data"]["_parsed"]["flight"] = "other" if i == 11 \
+                                               else "flight"
+            self.db.save_doc(doc)
+
+        self.tempdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tempdir, "checkpoint.json")
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def backfill(self, **options):
+        options = dict({"db": self.db, "workers": 0, "page_size": 4,
+                        "batch_size": 3, "checkpoint": self.checkpoint},
+                       **options)
+        return parser_backfill.ParserBackfill(suites.parser_config, "flight",
+                                              "good", **options)
+
+    def check_backfilled(self):
+        for i in xrange(12):
+            data = self.db["telemetry_{0}".format(i)]["data"]
+            if i == 11:
+                eq_(data["_parsed"]["flight"], "other")
+                assert "height" in data
+                continue
+            assert "height" not in data
+            assert "altitude" in data
+            eq_(data["_parsed"]["payload_configuration"], "good")
+            eq_(data["_parsed"]["flight"], "flight")
+        assert not os.path.exists(self.checkpoint)
+
+    def check_reparses(self, **options):
+        stats = self.backfill(**options).run()
+        # Each doc is seen again once it has moved to "good".
+        eq_((stats["read"], stats["skipped"], stats["parsed"],
+             stats["failed"]), (22, 11, 11, 0))
+        self.check_backfilled()
+
+    def test_reparses_in_process(self):
+        self.check_reparses()
+
+    def test_reparses_with_workers(self):
+        self.check_reparses(workers=2)
+
+    def test_reparses_only_source(self):
+        stats = self.backfill(source="bad").run()
+        eq_((stats["read"], stats["skipped"], stats["parsed"]), (11, 0, 11))
+        self.check_backfilled()
+
+    def test_resumes_from_checkpoint(self):
+        backfill = self.backfill(source="bad")
+        save_many = backfill.saver.save_many
+        pages = []
+
+        def interrupt(docs):
+            if pages:
+                raise KeyboardInterrupt
+            pages.append(docs)
+            save_many(docs)
+
+        backfill.saver.save_many = interrupt
+        assert_raises(KeyboardInterrupt, backfill.run)
+        with open(self.checkpoint) as f:
+            eq_(json.load(f)["stats"]["read"], 4)
+
+        stats = self.backfill(source="bad").run()
+        eq_((stats["read"], stats["parsed"]), (11, 11))
+        self.check_backfilled()
+
+    def test_rejects_other_checkpoints(self):
+        with open(self.checkpoint, "w") as f:
+            json.dump({"flight": "other", "payload_configuration": "good",
+                       "source": None}, f)
+        assert_raises(ValueError, self.backfill)
+
+    def test_rejects_wrong_documents(self):
+        assert_raises(ValueError, parser_backfill.ParserBackfill,
+                      suites.parser_config, "good", "good", db=self.db)
+        assert_raises(ValueError, parser_backfill.ParserBackfill,
+                      suites.parser_config, "flight", "flight", db=self.db)
@@ -19,15 +19,18 @@
 Unit tests for the Parser's Sink class.
 """
 
+import os
 import mox
+import Queue
 import couchdbkit
 
 from copy import deepcopy
-from nose.tools import assert_raises
+from nose.tools import assert_raises, eq_
 
-from ..utils import immortal_changes
+from ..utils import immortal_changes, memory_couch
+from ..benchmarks import corpus
 
-from .. import parser_daemon
+from .. import parser_daemon, uploader
 
 
 class TestParserDaemon(object):
@@ -134,3 +137,451 @@ class TestParserDaemon(object):
         assert_raises(RuntimeError, self.daemon._save_updated_doc, parsed_doc)
         self.m.VerifyAll()
 
+
+
+class TestParserDaemonWorkers(object):
+    def setup(self):
+        self.m = mox.Mox()
+
+        self.config = {
+            "couch_uri": "http://localhost:5984", "couch_db": "test",
+            "parserdaemon": {"workers": 2, "max_in_flight": 2}}
+
+        self.m.StubOutWithMock(parser_daemon, 'couchdbkit')
+        self.m.StubOutWithMock(parser_daemon, 'immortal_changes')
+        self.m.StubOutWithMock(parser_daemon, 'multiprocessing')
+        self.mock_server = self.m.CreateMock(couchdbkit.Server)
+        self.mock_db = self.m.CreateMock(couchdbkit.Database)
+        parser_daemon.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        self.mock_db.info().AndReturn({"update_seq": 10})
+
+        self.m.ReplayAll()
+        self.daemon = parser_daemon.ParserDaemon(self.config)
+        self.m.VerifyAll()
+        self.m.ResetAll()
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def start(self, seq):
+        """Pretend that change *seq* has been handed to the pool"""
+        self.daemon._in_flight.acquire()
+        self.daemon.sequence.start(seq)
+        self.daemon._pending[seq] = self.m.CreateMockAnything()
+
+    def test_init_reads_config(self):
+        eq_(self.daemon.workers, 2)
+        eq_(self.daemon.max_in_flight, 2)
+        eq_(self.daemon.task_timeout, 60)
+        assert self.daemon.parser is None
+
+    def test_run_starts_pool(self):
+        pool = self.m.CreateMockAnything()
+        parser_daemon.multiprocessing.Pool(2,
+            initializer=parser_daemon._init_worker,
+            initargs=(self.config, )).AndReturn(pool)
+        c = self.m.CreateMock(immortal_changes.Consumer)
+        parser_daemon.immortal_changes.Consumer(self.daemon.db).AndReturn(c)
+        c.wait(self.daemon._couch_callback, filter="parser/unparsed",
+               since=10, include_docs=True, heartbeat=1000)
+        pool.terminate()
+        self.m.ReplayAll()
+        self.daemon.run()
+        self.m.VerifyAll()
+
+    def test_dispatches_to_workers_and_saves_results(self):
+        self.daemon.pool = self.m.CreateMockAnything()
+        self.m.StubOutWithMock(self.daemon, '_save_updated_doc')
+        for seq in [11, 12]:
+            self.daemon.pool.apply_async(parser_daemon._parse_in_worker,
+                (seq, {"seq": seq}), callback=self.daemon._worker_callback)\
+                .AndReturn(self.m.CreateMockAnything())
+        self.daemon._save_updated_doc({"parsed": 12})
+        self.daemon._save_updated_doc({"parsed": 11})
+        self.m.ReplayAll()
+
+        for seq in [11, 12]:
+            self.daemon._couch_callback({"seq": seq, "doc": {"seq": seq}})
+        eq_(len(self.daemon.sequence), 2)
+
+        # 12 finishing first mustn't move last_seq past 11
+        self.daemon._worker_callback((12, {"parsed": 12}))
+        eq_(self.daemon.last_seq, 10)
+        self.daemon._worker_callback((11, {"parsed": 11}))
+        eq_(self.daemon.last_seq, 12)
+        self.m.VerifyAll()
+
+    def test_worker_callback_survives_save_errors(self):
+        self.m.StubOutWithMock(self.daemon, '_save_updated_doc')
+        self.daemon._save_updated_doc({"parsed": 11})\
+                .AndRaise(RuntimeError("conflicts"))
+        self.m.ReplayAll()
+        self.start(11)
+        self.daemon._worker_callback((11, {"parsed": 11}))
+        self.m.VerifyAll()
+        eq_(self.daemon.last_seq, 11)
+
+    def test_unparsed_docs_advance_seq(self):
+        self.start(11)
+        self.daemon._worker_callback((11, None))
+        eq_(self.daemon.last_seq, 11)
+
+    def test_worker_results_go_to_save_stage(self):
+        self.daemon.save_queue = Queue.Queue()
+        self.start(11)
+        self.daemon._worker_callback((11, {"parsed": 11}))
+        eq_(self.daemon.save_queue.get_nowait(), (11, {"parsed": 11}))
+
+    def test_worker_results_finish_once_bulk_saved(self):
+        self.daemon.saver = self.m.CreateMock(parser_daemon.BulkSaver)
+        callback = mox.Func(lambda c: c() is None)
+        self.daemon.saver.save({"parsed": 11}, callback)
+        self.m.ReplayAll()
+        self.start(11)
+        self.daemon._worker_callback((11, {"parsed": 11}))
+        self.m.VerifyAll()
+        eq_(self.daemon.last_seq, 11)
+
+    def test_gives_up_on_lost_tasks(self):
+        self.daemon.task_timeout = 0.1
+        self.daemon.in_flight_poll_interval = 0.01
+        self.daemon.pool = old_pool = self.m.CreateMockAnything()
+        new_pool = self.m.CreateMockAnything()
+        self.m.StubOutWithMock(self.daemon, '_save_updated_doc')
+        for seq in [11, 12]:
+            old_pool.apply_async(parser_daemon._parse_in_worker,
+                (seq, {"seq": seq}), callback=self.daemon._worker_callback)\
+                .AndReturn(self.m.CreateMockAnything())
+
+        # both tasks are lost, so 13 waits for a slot until they are given
+        # up on and the pool is replaced
+        old_pool.terminate()
+        parser_daemon.multiprocessing.Pool(2,
+            initializer=parser_daemon._init_worker,
+            initargs=(self.config, )).AndReturn(new_pool)
+        new_pool.apply_async(parser_daemon._parse_in_worker,
+            (13, {"seq": 13}), callback=self.daemon._worker_callback)\
+            .AndReturn(self.m.CreateMockAnything())
+        self.daemon._save_updated_doc({"parsed": 13})
+        self.m.ReplayAll()
+
+        for seq in [11, 12, 13]:
+            self.daemon._couch_callback({"seq": seq, "doc": {"seq": seq}})
+        assert self.daemon.pool is new_pool
+        eq_(self.daemon.last_seq, 12)
+
+        # a late result is ignored
+        self.daemon._worker_callback((11, {"parsed": 11}))
+        self.daemon._worker_callback((13, {"parsed": 13}))
+        eq_(self.daemon.last_seq, 13)
+        self.m.VerifyAll()
+
+
+class TestParserDaemonPipeline(object):
+    def setup(self):
+        self.m = mox.Mox()
+
+        self.config = {
+            "couch_uri": "http://localhost:5984", "couch_db": "test",
+            "parserdaemon": {"pipeline": {"queue_size": 2}}}
+
+        self.m.StubOutWithMock(parser_daemon, 'couchdbkit')
+        self.m.StubOutWithMock(parser_daemon, 'parser')
+        self.mock_server = self.m.CreateMock(couchdbkit.Server)
+        self.mock_db = self.m.CreateMock(couchdbkit.Database)
+        parser_daemon.couchdbkit.Server("http://localhost:5984")\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        self.mock_db.info().AndReturn({"update_seq": 10})
+        parser_daemon.parser.Parser(self.config)
+
+        self.m.ReplayAll()
+        self.daemon = parser_daemon.ParserDaemon(self.config)
+        self.m.VerifyAll()
+        self.m.ResetAll()
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def test_init_creates_bounded_queues(self):
+        eq_(self.daemon.parse_queue.maxsize, 2)
+        eq_(self.daemon.save_queue.maxsize, 2)
+        eq_(self.daemon.queue_report_interval, 10)
+        eq_((self.daemon.parse_threads, self.daemon.save_threads), (1, 1))
+
+    def test_starts_threads_for_each_stage(self):
+        self.daemon.parse_threads = 2
+        self.daemon.save_threads = 3
+        self.m.StubOutWithMock(parser_daemon.threading, "Thread")
+        names = []
+        for i in xrange(6):
+            thread = self.m.CreateMockAnything()
+            parser_daemon.threading.Thread(target=mox.IgnoreArg(),
+                    name=mox.Func(lambda n: names.append(n) is None))\
+                    .AndReturn(thread)
+            thread.start()
+        self.m.ReplayAll()
+        self.daemon._start_stages()
+        self.m.VerifyAll()
+        eq_(sorted(set((n, names.count(n)) for n in names)),
+            [("habitat ParserDaemon parse", 2),
+             ("habitat ParserDaemon queue report", 1),
+             ("habitat ParserDaemon save", 3)])
+
+    def test_pool_size_shares_a_connection_pool_with_the_parser(self):
+        self.config["parserdaemon"]["pipeline"]["pool_size"] = 20
+        parser_daemon.couchdbkit.Server("http://localhost:5984",
+                pool=mox.IsA(parser_daemon.ConnectionPool))\
+                .AndReturn(self.mock_server)
+        self.mock_server.__getitem__("test").AndReturn(self.mock_db)
+        self.mock_db.info().AndReturn({"update_seq": 10})
+        parser_daemon.parser.Parser(self.config, db=self.mock_db)
+        self.m.ReplayAll()
+        parser_daemon.ParserDaemon(self.config)
+        self.m.VerifyAll()
+
+    def test_changes_are_parsed_then_saved_in_stages(self):
+        self.m.StubOutWithMock(self.daemon, 'parser')
+        self.m.StubOutWithMock(self.daemon, '_save_updated_doc')
+        self.daemon.parser.parse({"seq": 11}).AndReturn({"parsed": 11})
+        self.daemon.parser.parse({"seq": 12}).AndReturn(None)
+        self.daemon._save_updated_doc({"parsed": 11})
+        self.m.ReplayAll()
+
+        for seq in [11, 12]:
+            self.daemon._couch_callback({"seq": seq, "doc": {"seq": seq}})
+        eq_(self.daemon.queue_depths(),
+            {"in_flight": 2, "parse": 2, "save": 0})
+
+        for i in xrange(2):
+            self.daemon._parse_change(self.daemon.parse_queue.get())
+        # 12 couldn't be parsed, but mustn't move last_seq past 11
+        eq_(self.daemon.last_seq, 10)
+        eq_(self.daemon.queue_depths(),
+            {"in_flight": 2, "parse": 0, "save": 1})
+
+        self.daemon._save_change(*self.daemon.save_queue.get())
+        eq_(self.daemon.last_seq, 12)
+        self.m.VerifyAll()
+
+    def test_stages_survive_errors(self):
+        self.m.StubOutWithMock(self.daemon, 'parser')
+        self.m.StubOutWithMock(self.daemon, '_save_updated_doc')
+        self.daemon.parser.parse({"seq": 11}).AndRaise(KeyError)
+        self.daemon._save_updated_doc({"parsed": 12})\
+                .AndRaise(RuntimeError("conflicts"))
+        self.m.ReplayAll()
+
+        for seq in [11, 12]:
+            self.daemon.sequence.start(seq)
+        self.daemon._parse_change({"seq": 11, "doc": {"seq": 11}})
+        self.daemon._save_change(12, {"parsed": 12})
+        self.m.VerifyAll()
+        eq_(self.daemon.last_seq, 12)
+
+    def test_full_queue_blocks_changes(self):
+        for seq in [11, 12]:
+            self.daemon._couch_callback({"seq": seq, "doc": {}})
+        assert self.daemon.parse_queue.full()
+
+
+class TestBulkSaver(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.db = self.m.CreateMock(couchdbkit.Database)
+        self.saver = parser_daemon.BulkSaver(self.db, batch_size=3,
+                                             flush_interval=0.01,
+                                             max_attempts=2)
+        self.saver.error_delay = 0
+        self.done = []
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def item(self, doc_id, attempts=0):
+        doc = {"_id": doc_id, "data": {"parsed": doc_id}}
+        return (doc, lambda: self.done.append(doc_id), attempts)
+
+    def row(self, doc_id):
+        return {"id": doc_id, "doc": {"_id": doc_id, "_rev": "1",
+                                      "receivers": ["new"], "data": {}}}
+
+    def merged(self, doc_id):
+        doc = self.row(doc_id)["doc"]
+        doc["data"]["parsed"] = doc_id
+        return doc
+
+    def test_next_batch_collects_up_to_batch_size(self):
+        for doc_id in "abcd":
+            self.saver.save({"_id": doc_id})
+        eq_([d["_id"] for d, c, a in self.saver._next_batch()], list("abc"))
+        eq_([d["_id"] for d, c, a in self.saver._next_batch()], ["d"])
+
+    def test_next_batch_starts_with_retries(self):
+        self.saver._retry = [self.item("a", 1)]
+        self.saver.save({"_id": "b"})
+        eq_([d["_id"] for d, c, a in self.saver._next_batch()], ["a", "b"])
+        eq_(self.saver._retry, [])
+
+    def test_flush_merges_and_saves_in_bulk(self):
+        self.db.all_docs(keys=["a", "b"], include_docs=True)\
+                .AndReturn([self.row("a"), self.row("b")])
+        self.db.save_docs([self.merged("a"), self.merged("b")])\
+                .AndReturn([{"id": "a", "rev": "2"}, {"id": "b", "rev": "2"}])
+        self.m.ReplayAll()
+        self.saver.flush([self.item("a"), self.item("b")])
+        self.m.VerifyAll()
+        eq_(self.done, ["a", "b"])
+        eq_(self.saver._retry, [])
+
+    def test_flush_retries_conflicts_in_next_batch(self):
+        results = [{"id": "a", "rev": "2"},
+                   {"id": "b", "error": "conflict", "reason": "conflict"},
+                   {"id": "c", "error": "conflict", "reason": "conflict"}]
+        self.db.all_docs(keys=["a", "b", "c"], include_docs=True)\
+                .AndReturn([self.row("a"), self.row("b"), self.row("c")])
+        self.db.save_docs([self.merged("a"), self.merged("b"),
+                           self.merged("c")])\
+                .AndRaise(couchdbkit.exceptions.BulkSaveError(
+                    results[1:], results))
+        self.m.ReplayAll()
+        self.saver.flush([self.item("a"), self.item("b"),
+                          self.item("c", attempts=1)])
+        self.m.VerifyAll()
+        # c has used up its attempts
+        eq_(self.done, ["a", "c"])
+        eq_([(d["_id"], a) for d, c, a in self.saver._retry], [("b", 1)])
+
+    def test_flush_gives_up_on_missing_docs(self):
+        self.db.all_docs(keys=["a"], include_docs=True)\
+                .AndReturn([{"key": "a", "error": "not_found"}])
+        self.m.ReplayAll()
+        self.saver.flush([self.item("a")])
+        self.m.VerifyAll()
+        eq_(self.done, ["a"])
+
+    def test_flush_retries_everything_after_errors(self):
+        self.db.all_docs(keys=["a"], include_docs=True)\
+                .AndRaise(IOError)
+        self.m.ReplayAll()
+        self.saver.flush([self.item("a")])
+        self.m.VerifyAll()
+        eq_(self.done, [])
+        eq_([(d["_id"], a) for d, c, a in self.saver._retry], [("a", 1)])
+
+    def test_save_many_saves_in_batches_until_done(self):
+        conflict = {"id": "b", "error": "conflict", "reason": "conflict"}
+        self.db.all_docs(keys=["a", "b", "c"], include_docs=True)\
+                .AndReturn([self.row("a"), self.row("b"), self.row("c")])
+        self.db.save_docs([self.merged("a"), self.merged("b"),
+                           self.merged("c")])\
+                .AndRaise(couchdbkit.exceptions.BulkSaveError(
+                    [conflict], [{"id": "a"}, conflict, {"id": "c"}]))
+        self.db.all_docs(keys=["d"], include_docs=True)\
+                .AndReturn([self.row("d")])
+        self.db.save_docs([self.merged("d")]).AndReturn([{"id": "d"}])
+        self.db.all_docs(keys=["b"], include_docs=True)\
+                .AndReturn([self.row("b")])
+        self.db.save_docs([self.merged("b")]).AndReturn([{"id": "b"}])
+        self.m.ReplayAll()
+        self.saver.save_many([self.item(i)[0] for i in "abcd"])
+        self.m.VerifyAll()
+        eq_(self.saver._retry, [])
+
+
+class TestSequenceTracker(object):
+    def test_advances_in_start_order(self):
+        t = parser_daemon.SequenceTracker(5)
+        for seq in ["a", "b", "c", "d"]:
+            t.start(seq)
+        eq_(t.finish("c"), 5)
+        eq_(t.finish("a"), "a")
+        eq_(t.finish("d"), "a")
+        eq_(t.finish("b"), "d")
+        eq_(len(t), 0)
+        eq_(t.last_seq, "d")
+
+
+class TestWorker(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.m.StubOutWithMock(parser_daemon, 'parser')
+
+    def teardown(self):
+        self.m.UnsetStubs()
+        parser_daemon._worker_parser = None
+
+    def test_parses_with_worker_parser(self):
+        p = self.m.CreateMockAnything()
+        parser_daemon.parser.Parser({"config": True}).AndReturn(p)
+        p.parse({"doc": 1}).AndReturn({"parsed": 1})
+        p.parse({"doc": 2}).AndRaise(KeyError)
+        self.m.ReplayAll()
+        parser_daemon._init_worker({"config": True})
+        eq_(parser_daemon._parse_in_worker(4, {"doc": 1}), (4, {"parsed": 1}))
+        eq_(parser_daemon._parse_in_worker(5, {"doc": 2}), (5, None))
+        self.m.VerifyAll()
+
+
+class TestParserDaemonMemoryCouch(object):
+    def setup(self):
+        certs_dir = os.path.join(os.path.dirname(__file__), "test_parser",
+                                 "certs")
+        self.config = {
+            "parser": {
+                "certs_dir": certs_dir,
+                "modules": [{
+                    "name": "UKHAS",
+                    "class": "habitat.parser_modules.ukhas_parser.UKHASParser"
+                }]
+            },
+            "loadables": [
+                {"name": "sensors.base", "class": "habitat.sensors.base"},
+                {"name": "sensors.stdtelem",
+                 "class": "habitat.sensors.stdtelem"}
+            ]
+        }
+        self.db = memory_couch.Database()
+
+    def test_parses_uploaded_telemetry(self):
+        config, strings = corpus.make_corpus(3)
+        self.db.save_doc(config)
+        listener = uploader.Uploader("LISTENER", db=self.db)
+        doc_ids = [listener.payload_telemetry(s) for s in strings]
+
+        daemon = parser_daemon.ParserDaemon(self.config, db=self.db)
+        eq_(daemon.last_seq, 4)
+        changes = self.db.changes(filter="parser/unparsed", include_docs=True)
+        for change in changes["results"]:
+            daemon._couch_callback(change)
+
+        for doc_id in doc_ids:
+            doc = self.db[doc_id]
+            eq_(doc["data"]["payload"], "BENCH")
+            eq_(doc["data"]["_parsed"]["payload_configuration"], config["_id"])
+            assert "LISTENER" in doc["receivers"]
+        eq_(self.db.changes(filter="parser/unparsed")["results"], [])
+
+    def test_pipeline_parses_uploaded_telemetry(self):
+        config, strings = corpus.make_corpus(3)
+        self.db.save_doc(config)
+        listener = uploader.Uploader("LISTENER", db=self.db)
+        for s in strings:
+            listener.payload_telemetry(s)
+
+        self.config["parserdaemon"] = {"pipeline": True,
+                                       "bulk_save": {"batch_size": 2}}
+        daemon = parser_daemon.ParserDaemon(self.config, db=self.db)
+        changes = self.db.changes(filter="parser/unparsed", include_docs=True)
+        for change in changes["results"]:
+            daemon._couch_callback(change)
+        for change in changes["results"]:
+            daemon._parse_change(daemon.parse_queue.get())
+            daemon._save_change(*daemon.save_queue.get())
+        while not daemon.saver.queue.empty():
+            daemon.saver.flush(daemon.saver._next_batch())
+
+        eq_(daemon.last_seq, changes["last_seq"])
+        eq_(self.db.changes(filter="parser/unparsed")["results"], [])
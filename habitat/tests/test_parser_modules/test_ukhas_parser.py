@@ -20,10 +20,12 @@ Test the UKHAS protocol parser.
 """
 
 from nose.tools import assert_raises
+from nose.plugins.skip import SkipTest
 from copy import deepcopy
 
 # Mocking the LoadableManager is a heck of a lot of effort. Not worth it.
 from ...loadable_manager import LoadableManager
+from ...parser_modules import ukhas_parser
 from ...parser_modules.ukhas_parser import UKHASParser
 
 # Provide the sensor functions to the parser
@@ -106,6 +108,13 @@ class TestUKHASParser:
         for sentence in good_sentences:
             assert self.p.pre_parse(sentence) == "good"
 
+    def test_sniff(self):
+        assert self.p.sniff("$$good,data*CCCC\n") is True
+        assert self.p.sniff("$$bad,data*GH\n") is True
+        for sentence in ["", "\n", "bad\n", "$bad,data\n",
+                         "$$missing,newline*CCCC", "\x00\x01\x02"]:
+            assert self.p.sniff(sentence) is False
+
     def test_pre_parse_rejects_bad_callsigns(self):
         bad_callsigns = ["abcdef@123", "ABC\xFA", "$$", "almost good"]
         callsign_template = "$${0},data*CC\n"
@@ -420,3 +429,108 @@ class TestUKHASParser:
         bad_sentence = "$$habitat,123,12:45:06,-35.1032,138.8568,4285*5260"
 
         assert_raises(ValueError, self.p.parse, bad_sentence, base_config)
+
+    def test_compiles_plans(self):
+        plan = self.p.compile(base_config)
+        assert plan.config is base_config
+        assert plan.checksum == "crc16-ccitt"
+        assert plan.field_count == len(base_config["fields"])
+        assert [name for name, sensor in plan.sensors] == \
+                [f["name"] for f in base_config["fields"]]
+
+    def test_compile_rejects_invalid_configs(self):
+        config = deepcopy(base_config)
+        config["protocol"] = "invalid"
+        assert_raises(ValueError, self.p.compile, config)
+        assert_raises(ValueError, self.p.compile, config, ("id", "1-a", 0))
+        assert ("id", "1-a", 0) not in self.p.plans
+
+    def test_caches_plans_by_key(self):
+        key = ("id", "1-a", 0)
+        plan = self.p.compile(base_config, key)
+        assert self.p.compile(base_config, key) is plan
+        assert self.p.compile(base_config, ("id", "2-b", 0)) is not plan
+        assert self.p.compile(base_config) is not plan
+
+    def test_parses_with_plans(self):
+        sentence = "$$habitat,123,12:45:06,-35.1032,138.8568,4285,3.6,hab" \
+                   "*5681\n"
+        plan = self.p.compile(base_config, ("id", "1-a", 0))
+        assert self.p.parse(sentence, plan) == \
+                self.p.parse(sentence, base_config)
+
+    def test_tokenises_sentences(self):
+        sentence = self.p.tokenise("$$habitat,123,4285*5260\n")
+        assert sentence.string == "$$habitat,123,4285*5260\n"
+        assert sentence.body == "habitat,123,4285"
+        assert sentence.checksum == "5260"
+        assert sentence.fields == ["habitat", "123", "4285"]
+        assert self.p.tokenise("$$habitat,123\n").checksum is None
+
+    def test_tokenises_once_for_pre_parse_and_parse(self):
+        string = "$$habitat,123,12:45:06,-35.1032,138.8568,4285,3.6,hab" \
+                 "*5681\n"
+        calls = []
+        split = self.p._split_basic_format
+
+        def counting_split(string):
+            calls.append(string)
+            return split(string)
+
+        self.p._split_basic_format = counting_split
+        assert self.p.pre_parse(string) == "habitat"
+        assert self.p.parse(string, base_config)["altitude"] == 4285
+        assert calls == [string]
+        assert self.p.tokenise(string) is self.p.sentences.get(string)
+
+    def test_does_not_cache_invalid_strings(self):
+        assert_raises(ValueError, self.p.tokenise, "$$bad*GH\n")
+        assert "$$bad*GH\n" not in self.p.sentences
+
+    def check_parse_many(self, strings, config):
+        results = self.p.parse_many(strings, config)
+        assert len(results) == len(strings)
+        for string, result in zip(strings, results):
+            try:
+                expect = self.p.parse(string, config)
+            except (ValueError, KeyError) as e:
+                assert type(result) is type(e)
+                assert str(result) == str(e)
+            else:
+                assert result == expect
+                assert [type(v) for v in sorted(result.items())] == \
+                        [type(v) for v in sorted(expect.items())]
+
+    def sentence(self, body):
+        checksum = ukhas_parser.checksums.crc16_ccitt(body)
+        return "$$" + body + "*" + checksum + "\n"
+
+    def test_parse_many_matches_parse(self):
+        strings = [self.sentence(body) for body in [
+            "habitat,123,12:45:06,-35.1032,138.8568,4285,3.6,hab",
+            "habitat,124,12:45:07,-35.1032,138.8568,4285,3.6,hab",
+            "habitat,125,12:45:08,-95.1032,138.8568,4285,3.6,hab",
+            "habitat,126,12:45:09,-35.1032,138.8568,4285,nan,hab",
+            "habitat,127,12:45:10,-35.1032,138.8568,42.5,3.6,hab",
+            "habitat,128,12:45:11,-35.1032,138.8568,4285"]]
+        strings += ["$$habitat,129,12:45:12*0000\n", "not a sentence\n"]
+        results = self.p.parse_many(strings, base_config)
+        assert [type(r) for r in results] == [dict, dict] + [ValueError] * 6
+        self.check_parse_many(strings, base_config)
+        self.check_parse_many(strings, self.p.compile(base_config))
+
+    def test_parse_many_decodes_columns_with_numpy(self):
+        if ukhas_parser.numpy is None:
+            raise SkipTest("NumPy is not installed")
+        plan = self.p.compile(base_config)
+        assert [d is not None for d in plan.column_decoders] == \
+                [True, False, True, True, True, True, False]
+
+        strings = []
+        for i, (lat, speed) in enumerate([("51.5", "0.1"), ("-90", "1e3"),
+                                           ("90.0001", "-0.0"),
+                                           ("inf", "1e400"), ("1e2", "2")]):
+            strings.append(self.sentence(
+                "habitat,{0},12:45:06,{1},138.8568,4285,{2},hab"
+                .format(i, lat, speed)))
+        self.check_parse_many(strings, plan)
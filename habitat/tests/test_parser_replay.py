@@ -0,0 +1,70 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.parser_replay
+"""
+
+import json
+from StringIO import StringIO
+
+from nose.tools import eq_
+
+from ..benchmarks import corpus, suites
+from .. import parser_replay
+
+
+class TestReadDocs(object):
+    def test_reads_docs_and_rows(self):
+        lines = ['{"_id": "a", "type": "payload_telemetry"}\n', '\n',
+                 'not json\n', '{"id": "b", "doc": {"_id": "b"}}\n']
+        eq_([d["_id"] for d in parser_replay.read_docs(lines)], ["a", "b"])
+
+
+class TestParserReplay(object):
+    def setup(self):
+        self.config, strings = corpus.make_corpus(25)
+        self.lines = [json.dumps(corpus.make_telemetry_doc(s, i))
+                      for i, s in enumerate(strings)]
+        self.lines.insert(3, json.dumps(
+            corpus.make_telemetry_doc("$$UNKNOWN,1*00\n", 100)))
+        self.lines.insert(7, "garbage")
+
+    def check_replays(self, workers):
+        other = {"_id": "x", "type": "listener_information"}
+        replay = parser_replay.ParserReplay(suites.parser_config,
+                                            [self.config, other],
+                                            workers=workers, chunk_size=4)
+        eq_(replay.db.info()["doc_count"], 1)
+
+        output = StringIO()
+        stats = replay.run(self.lines, output)
+        eq_((stats["read"], stats["parsed"], stats["failed"]), (27, 25, 2))
+
+        docs = [json.loads(line) for line in output.getvalue().splitlines()]
+        eq_([d["_id"] for d in docs],
+            ["telemetry_{0}".format(i) for i in xrange(25)])
+        for doc in docs:
+            eq_(doc["data"]["payload"], "BENCH")
+            eq_(doc["data"]["_parsed"]["payload_configuration"],
+                self.config["_id"])
+
+    def test_replays_in_process(self):
+        self.check_replays(0)
+
+    def test_replays_with_workers(self):
+        self.check_replays(2)
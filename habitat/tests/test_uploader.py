@@ -26,6 +26,9 @@ import uuid
 import threading
 import time
 import json
+from StringIO import StringIO
+
+from nose.tools import assert_raises
 
 import couchdbkit
 import couchdbkit.resource
@@ -416,8 +419,8 @@ class TestUploader(object):
 
 
 class MyUploaderThread(uploader.UploaderThread):
-    def __init__(self):
-        super(MyUploaderThread, self).__init__()
+    def __init__(self, **kwargs):
+        super(MyUploaderThread, self).__init__(**kwargs)
         self.thread_error = False
 
     def log(self, msg):
@@ -575,6 +578,131 @@ class TestUploaderThread(object):
 
         self.mocker.VerifyAll()
 
+    def blocked(self):
+        """
+        Queue a payload_telemetry call that doesn't return until the
+        returned event is set, so that more calls can be queued meanwhile.
+        """
+        delay_event = threading.Event()
+        started = threading.Event()
+
+        def delay(x):
+            started.set()
+            delay_event.wait()
+
+        self.fake_uploader.payload_telemetry("delayme").WithSideEffects(delay)
+        return delay_event, started
+
+    def test_prioritises(self):
+        delay_event, started = self.blocked()
+        self.fake_uploader.payload_telemetry("second")
+        self.fake_uploader.listener_information("info")
+        self.fake_uploader.payloads()
+        self.fake_uploader.flights()
+
+        self.mocker.ReplayAll()
+
+        self.uthr.payload_telemetry("delayme")
+        started.wait()
+        self.uthr.payloads()
+        self.uthr.listener_information("info")
+        self.uthr.flights()
+        self.uthr.payload_telemetry("second")
+
+        delay_event.set()
+        self.uthr.join()
+        self.mocker.VerifyAll()
+
+    def test_coalesces_listener_updates(self):
+        delay_event, started = self.blocked()
+        self.fake_uploader.listener_telemetry("position 3")
+        self.fake_uploader.listener_information("info 2")
+
+        self.mocker.ReplayAll()
+
+        self.uthr.payload_telemetry("delayme")
+        started.wait()
+        self.uthr.listener_telemetry("position 1")
+        self.uthr.listener_information("info 1")
+        self.uthr.listener_telemetry("position 2")
+        self.uthr.listener_telemetry("position 3")
+        self.uthr.listener_information("info 2")
+
+        delay_event.set()
+        self.uthr.join()
+        self.mocker.VerifyAll()
+
+    def test_settings_are_barriers(self):
+        delay_event, started = self.blocked()
+        self.fake_uploader.listener_telemetry("position 1")
+
+        fake_two = self.mocker.CreateMock(self.uploader_class)
+        uploader.Uploader("CALL2").AndReturn(fake_two)
+        fake_two.payload_telemetry("second")
+        fake_two.listener_telemetry("position 2")
+
+        self.mocker.ReplayAll()
+
+        self.uthr.payload_telemetry("delayme")
+        started.wait()
+        self.uthr.listener_telemetry("position 1")
+        self.uthr.settings("CALL2")
+        self.uthr.listener_telemetry("position 2")
+        self.uthr.payload_telemetry("second")
+
+        delay_event.set()
+        self.uthr.join()
+        self.mocker.VerifyAll()
+
+    def restart(self, fake_uploader, **kwargs):
+        self.uthr.join()
+        self.uthr = MyUploaderThread(**kwargs)
+        self.uthr.start()
+
+        uploader.Uploader("CALL1").AndReturn(fake_uploader)
+        self.mocker.ReplayAll()
+        self.uthr.settings("CALL1")
+        self.uthr._queue.join()
+        self.mocker.VerifyAll()
+        self.mocker.ResetAll()
+
+    def test_workers(self):
+        # Each call waits for the other to start: both must be made at once.
+        events = {"a": threading.Event(), "b": threading.Event()}
+        made = []
+
+        class FakeUploader(object):
+            def payload_telemetry(self, x):
+                other = "b" if x == "a" else "a"
+                events[x].set()
+                assert events[other].wait(5)
+                made.append(x)
+
+        self.restart(FakeUploader(), workers=2)
+        self.uthr.payload_telemetry("a")
+        self.uthr.payload_telemetry("b")
+        self.uthr.join()
+        assert sorted(made) == ["a", "b"]
+
+    def test_download_lane(self):
+        flights_done = threading.Event()
+        made = []
+
+        class FakeUploader(object):
+            def payload_telemetry(self, x):
+                assert flights_done.wait(5)
+                made.append(x)
+
+            def flights(self):
+                return ["flight"]
+
+        self.restart(FakeUploader(), download_lane=True)
+        self.uthr.got_flights = lambda flights: flights_done.set()
+        self.uthr.payload_telemetry("delayme")
+        self.uthr.flights()
+        self.uthr.join()
+        assert made == ["delayme"]
+
 
 # Class that is 'equal' to another string if the value it is initialised is
 # contained in that string; used to avoid writing out the large extractor log
@@ -627,12 +755,106 @@ class TestExtractorManager(object):
 
         self.mocker.VerifyAll()
 
+    def test_push_bytes(self):
+        mgr = uploader.ExtractorManager(None)
+        extr = self.mocker.CreateMock(uploader.Extractor)
+        extr.push_bytes("abc")
+        extr.push_bytes("$$d\n", baudot_hack=True)
+        self.mocker.ReplayAll()
+
+        mgr.add(extr)
+        mgr.push_bytes("abc")
+        mgr.push_bytes("$$d\n", baudot_hack=True)
+        self.mocker.VerifyAll()
+
+    def test_extractor_push_bytes_pushes_each_byte(self):
+        extr = uploader.Extractor()
+        self.mocker.StubOutWithMock(extr, "push")
+        extr.push("a", baudot_hack=True)
+        extr.push("b", baudot_hack=True)
+        self.mocker.ReplayAll()
+
+        extr.push_bytes("ab", baudot_hack=True)
+        self.mocker.VerifyAll()
+
     def test_kwargs_future_proof(self):
         mgr = uploader.ExtractorManager(None)
         mgr.add(uploader.UKHASExtractor())
         mgr.push("a", some_unknown_kwarg=5) # should be ignored w/o error
 
 
+class TestChannelExtractorManager(object):
+    def setup(self):
+        self.mocker = mox.Mox()
+        self.uplr = self.mocker.CreateMock(uploader.Uploader)
+        self.mgr = uploader.ChannelExtractorManager(self.uplr)
+        self.mocker.StubOutWithMock(self.mgr, "status")
+        self.mocker.StubOutWithMock(self.mgr, "data")
+
+    def teardown(self):
+        self.mocker.UnsetStubs()
+
+    def expect_extraction_of(self, channel, string):
+        self.uplr.payload_telemetry(string)
+        self.mgr.status(channel, EqualIfIn("extracted"))
+        self.mgr.status(channel, EqualIfIn("parse failed"))
+        self.mgr.data(channel, {"_sentence": string})
+
+    def test_separates_channels(self):
+        self.mgr.status(434.1, EqualIfIn("start delim"))
+        self.mgr.status(434.2, EqualIfIn("start delim"))
+        self.expect_extraction_of(434.2, "$$two,2*00\n")
+        self.expect_extraction_of(434.1, "$$one,1*00\n")
+        self.mocker.ReplayAll()
+
+        self.mgr.push_many([(434.1, "$$one"), (434.2, "$$t"),
+                            (434.2, "wo,2*00\n$"), (434.1, ",1*0")])
+        self.mgr.push(434.1, "0")
+        self.mgr.push(434.1, "\n")
+        self.mgr.skipped(434.2, 3)
+        self.mocker.VerifyAll()
+
+        assert self.mgr.stats() == {
+            434.1: {"bytes": 11, "skipped": 0, "strings": 1},
+            434.2: {"bytes": 12, "skipped": 3, "strings": 1}
+        }
+        assert self.mgr.channel(434.1) is self.mgr.channel(434.1)
+
+    def test_extractors(self):
+        extractors = []
+
+        def new_extractors():
+            extractors.append(self.mocker.CreateMock(uploader.Extractor))
+            return [extractors[-1]]
+
+        mgr = uploader.ChannelExtractorManager(self.uplr, new_extractors)
+        mgr.push_bytes("a", "$$")
+        mgr.push_bytes("b", "$$")
+        assert len(extractors) == 2
+
+        self.mocker.ResetAll()
+        extractors[0].push_bytes("more", baudot_hack=True)
+        extractors[1].push("x")
+        self.mocker.ReplayAll()
+
+        mgr.push_many([("a", "more")], baudot_hack=True)
+        mgr.push("b", "x")
+        self.mocker.VerifyAll()
+
+
+def test_read_channel_frames():
+    frames = uploader.read_channel_frames(
+        StringIO("434.1 4\n$$a,\n\nch 2 3\nb\n$434.1 2\n1\n"))
+    assert list(frames) == [("434.1", "$$a,"), ("ch 2", "b\n$"),
+                            ("434.1", "1\n")]
+
+    # An incomplete frame at the end is ignored.
+    assert list(uploader.read_channel_frames(StringIO("a 4\nabc"))) == []
+
+    frames = uploader.read_channel_frames(StringIO("bad\n"))
+    assert_raises(ValueError, list, frames)
+
+
 # Usage: with MoxSilence(self.mocker): ensures that no mock calls happen
 # inside block.
 class MoxSilence(object):
@@ -649,6 +871,14 @@ class MoxSilence(object):
         self.mocker.ResetAll()
 
 
+class RecordingUploader(object):
+    def __init__(self, log):
+        self.log = log
+
+    def payload_telemetry(self, string):
+        self.log.append(string)
+
+
 class TestUKHASExtractor(object):
     def setup(self):
         self.mocker = mox.Mox()
@@ -771,6 +1001,88 @@ class TestUKHASExtractor(object):
         self.check_newline_no_upload()
         self.test_extracts()
 
+    def test_push_bytes(self):
+        self.mgr.status(EqualIfIn("start delim"))
+        self.expect_extraction_of("$$a,simple,test*00\n")
+        self.mgr.status(EqualIfIn("start delim"))
+        self.mgr.status(EqualIfIn("start delim"))
+        self.expect_extraction_of("$$second\n")
+        self.mocker.ReplayAll()
+
+        self.mgr.push_bytes("garbage $$a,simple,test*00\r$$fir")
+        self.mgr.push_bytes("st$")
+        self.mgr.push_bytes("$second\nmore garbage$")
+        self.mocker.VerifyAll()
+        assert self.ukhas_extractor.last == "$"
+
+    def test_push_bytes_baudot_hack(self):
+        self.mgr.status(EqualIfIn("start delim"))
+        self.expect_extraction_of("$$a,simple,test*00\n")
+        self.mocker.ReplayAll()
+
+        self.mgr.push_bytes("#$$a,simple,test#00\n", baudot_hack=True)
+        self.mocker.VerifyAll()
+
+    def test_push_bytes_gives_up(self):
+        self.mgr.status(EqualIfIn("start delim"))
+        self.mgr.status(EqualIfIn("giving up"))
+        self.mgr.status(EqualIfIn("start delim"))
+        self.mgr.status(EqualIfIn("giving up"))
+        self.mgr.status(EqualIfIn("start delim"))
+        self.expect_extraction_of("$$a,simple,test*00\n")
+        self.mocker.ReplayAll()
+
+        self.mgr.push_bytes("$$" + "a" * 1022 + "\n")
+        self.mgr.push_bytes("$$some,legit,data" + "\t" * 17 + "\n")
+        self.mgr.push_bytes("$$a,simple,test*00\n")
+        self.mocker.VerifyAll()
+
+    def test_push_bytes_same_as_push(self):
+        stream = ("a#\t$a\nab$$$$$*\t\r\r#\nbb$\na\ta*\t$$habitat,good*4918\n"
+                  "$,\t#\r$$\x80#\t$\n$*$\n$$" + "\0" * 20 + "\n$$" +
+                  "x" * 1100 + "\n$$habitat,bad*4918\n$$xorpayload,1,2*08\n"
+                  "$$xorpayload,1*2*08\n$$habitat,a*b*4918\n$$plain,1\n"
+                  "$$habitat,good*49\n$$other,1*00\n$$hab")
+        payloads = TestUKHASExtractorChecksums.payloads
+
+        for baudot_hack in (False, True):
+            for chunk in (1, 3, 7, 13):
+                results = []
+                for push_bytes in (False, True):
+                    statuses = []
+                    uplr = RecordingUploader(statuses)
+                    mgr = uploader.ExtractorManager(uplr)
+                    mgr.status = statuses.append
+                    mgr.data = statuses.append
+                    extractor = uploader.UKHASExtractor(payloads)
+                    mgr.add(extractor)
+
+                    checksums = []
+                    upload = mgr.uploader.payload_telemetry
+
+                    def payload_telemetry(string):
+                        checksums.append((string, extractor.checksum_ok))
+                        upload(string)
+                    mgr.uploader.payload_telemetry = payload_telemetry
+
+                    if push_bytes:
+                        for i in xrange(0, len(stream), chunk):
+                            mgr.push_bytes(stream[i:i + chunk],
+                                           baudot_hack=baudot_hack)
+                    else:
+                        for char in stream:
+                            mgr.push(char, baudot_hack=baudot_hack)
+                    results.append((statuses, checksums, extractor.last,
+                                    extractor.buffer,
+                                    extractor.garbage_count))
+
+                assert results[0] == results[1]
+
+            # the checksums were actually checked
+            assert [ok for string, ok in results[0][1]
+                    if string.startswith("$$habitat")] == \
+                    [True, False, False, False]
+
     def test_skipped(self):
         self.mgr.status(EqualIfIn("start delim"))
         self.expect_extraction_of("$$some\0\0\0\0\0data\n")
@@ -780,3 +1092,120 @@ class TestUKHASExtractor(object):
         self.mgr.skipped(5)
         self.push("data\n")
         self.mocker.VerifyAll()
+
+
+class TestUKHASExtractorChecksums(object):
+    payloads = [
+        {"type": "payload_configuration", "sentences": [
+            {"protocol": "UKHAS", "callsign": "habitat",
+             "checksum": "crc16-ccitt"},
+            {"protocol": "UKHAS", "callsign": "xorpayload",
+             "checksum": "xor"},
+            {"protocol": "UKHAS", "callsign": "plain", "checksum": "none"},
+            {"protocol": "RTTY", "callsign": "other", "checksum": "xor"}
+        ]}
+    ]
+
+    def setup(self):
+        self.mocker = mox.Mox()
+        self.uplr = self.mocker.CreateMock(uploader.Uploader)
+        self.mgr = uploader.ExtractorManager(self.uplr)
+        self.extractor = uploader.UKHASExtractor(self.payloads)
+        self.mgr.add(self.extractor)
+
+        self.mocker.StubOutWithMock(self.mgr, "status")
+        self.mocker.StubOutWithMock(self.mgr, "data")
+
+    def teardown(self):
+        self.mocker.UnsetStubs()
+
+    def push(self, string, **kwargs):
+        for char in string:
+            self.mgr.push(char, **kwargs)
+
+    def check(self, string, status, ok, **kwargs):
+        self.mgr.status(EqualIfIn("start delim"))
+        if status is None:
+            self.mgr.status(EqualIfIn("dropped"))
+        else:
+            self.uplr.payload_telemetry(string)
+            self.mgr.status(status)
+            self.mgr.status(EqualIfIn("parse failed"))
+            self.mgr.data({"_sentence": string})
+        self.mocker.ReplayAll()
+
+        self.push(string.replace("*", "#") if kwargs else string, **kwargs)
+        self.mocker.VerifyAll()
+        self.mocker.ResetAll()
+        assert self.extractor.checksum_ok is ok
+
+    def test_valid(self):
+        self.check("$$habitat,good*4918\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+        self.check("$$xorpayload,1,2*08\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+        self.check("$$plain,1,2\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+
+    def test_corrupt(self):
+        self.check("$$habitat,bad*4918\n",
+                   "UKHAS: extracted string (bad checksum)", False)
+        self.check("$$habitat,good*49\n",
+                   "UKHAS: extracted string (bad checksum)", False)
+        self.check("$$habitat,good\n",
+                   "UKHAS: extracted string (bad checksum)", False)
+
+    def test_unknown_callsign(self):
+        self.check("$$unknown,good*4918\n", "UKHAS: extracted string", None)
+        self.check("$$other,1,2*49\n", "UKHAS: extracted string", None)
+
+    def test_star_in_body(self):
+        self.check("$$xorpayload,1*2*0E\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+
+    def test_baudot_hack(self):
+        self.check("$$habitat,good*4918\n",
+                   "UKHAS: extracted string (checksum OK)", True,
+                   baudot_hack=True)
+
+    def test_restarts(self):
+        self.mgr.status(EqualIfIn("start delim"))
+        self.mocker.ReplayAll()
+        self.push("$$habitat,garb")
+        self.mocker.VerifyAll()
+        self.mocker.ResetAll()
+
+        self.check("$$habitat,good*4918\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+
+    def test_drops_corrupt(self):
+        self.extractor.drop_corrupt = True
+        self.check("$$habitat,bad*4918\n", None, False)
+        self.check("$$habitat,good*4918\n",
+                   "UKHAS: extracted string (checksum OK)", True)
+        self.check("$$unknown,bad*4918\n", "UKHAS: extracted string", None)
+
+    def test_set_payloads(self):
+        self.extractor.set_payloads([])
+        self.check("$$habitat,bad*4918\n", "UKHAS: extracted string", None)
+
+        self.mgr.status(EqualIfIn("start delim"))
+        self.mocker.ReplayAll()
+        self.push("$$habitat,bad")
+        self.mocker.VerifyAll()
+        self.mocker.ResetAll()
+
+        # Takes effect from the next string.
+        self.extractor.set_payloads(self.payloads)
+        self.uplr.payload_telemetry("$$habitat,bad*4918\n")
+        self.mgr.status("UKHAS: extracted string")
+        self.mgr.status(EqualIfIn("parse failed"))
+        self.mgr.data({"_sentence": "$$habitat,bad*4918\n"})
+        self.mocker.ReplayAll()
+        self.push("*4918\n")
+        self.mocker.VerifyAll()
+        self.mocker.ResetAll()
+        assert self.extractor.checksum_ok is None
+
+        self.check("$$habitat,bad*4918\n",
+                   "UKHAS: extracted string (bad checksum)", False)
@@ -33,3 +33,49 @@ class TestChecksums:
 
     def test_calculates_fletcher_16_checksum_modulus_256(self):
         assert checksums.fletcher_16(self.data, 256) == "8848"
+
+    def test_calculates_fletcher_16_256_checksum(self):
+        assert checksums.fletcher_16_256(self.data) == "8848"
+
+    def test_accepts_buffers(self):
+        for data in (bytearray(self.data), buffer(self.data),
+                     memoryview(self.data), unicode(self.data)):
+            assert checksums.crc16_ccitt(data) == "D4C0"
+            assert checksums.xor(data) == "0C"
+            assert checksums.fletcher_16(data) == "8C65"
+
+    def test_registry(self):
+        expect = {"crc16-ccitt": ("CRC16-CCITT", 4, "D4C0"),
+                  "xor": ("XOR", 2, "0C"),
+                  "fletcher-16": ("Fletcher-16", 4, "8C65"),
+                  "fletcher-16-256": ("Fletcher-16-256", 4, "8848")}
+        assert sorted(checksums.algorithms) == sorted(expect)
+        for name, (label, digits, value) in expect.items():
+            algorithm = checksums.algorithms[name]
+            assert algorithm.label == label
+            assert algorithm.digits == digits
+            assert algorithm.hexdigest(self.data) == value
+            assert algorithm.value(self.data) == int(value, 16)
+
+    def test_zero_fills(self):
+        assert checksums.xor("aa") == "00"
+        assert checksums.fletcher_16("") == "0000"
+
+    def test_verify(self):
+        assert checksums.verify(self.data, "D4C0", "crc16-ccitt")
+        assert checksums.verify(self.data, "d4c0", "crc16-ccitt")
+        assert not checksums.verify(self.data, "D4C1", "crc16-ccitt")
+        assert not checksums.verify(self.data, "0D4C0", "crc16-ccitt")
+        assert not checksums.verify(self.data, "C", "xor")
+        assert not checksums.verify(self.data, "0X", "xor")
+        assert not checksums.verify(self.data, None, "xor")
+        assert checksums.verify(self.data, None, "none")
+        assert checksums.verify(self.data, "0C", "xor")
+
+    def test_verify_many(self):
+        bodies = [self.data, self.data, "hello,world", "hello,world"]
+        given = ["8848", "8849", "6848", "48"]
+        assert checksums.verify_many(bodies, given, "fletcher-16-256") == \
+                [True, False, True, False]
+        assert checksums.verify_many(bodies, given, "none") == [True] * 4
+        assert checksums.verify_many([], [], "xor") == []
@@ -32,6 +32,10 @@ class TestUKHASChecksumFixer:
         self.check_fixer("xor", "$$habitat,good*4c\n",
             "$$habitat,other*4c\n", "$$habitat,other*2B\n")
 
+    def test_updates_fletcher_16_256_checksum(self):
+        self.check_fixer("fletcher-16-256", "$$habitat,good*B296\n",
+            "$$habitat,other*B296\n", "$$habitat,other*2BE3\n")
+
     def test_leaves_when_protocol_is_none(self):
         self.check_fixer("none", "$$habitat,boring\n",
             "$$habitat,sucky\n", "$$habitat,sucky\n")
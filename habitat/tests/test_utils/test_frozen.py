@@ -0,0 +1,92 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for habitat.utils.frozen
+"""
+
+import copy
+import pickle
+
+from nose.tools import assert_raises, eq_
+
+from ...utils import frozen
+
+
+class TestFreeze(object):
+    def setup(self):
+        self.doc = {"sentences": [{"callsign": "habitat",
+                                   "fields": [{"name": "altitude"}]}],
+                    "_id": "abc"}
+        self.frozen = frozen.freeze(self.doc)
+
+    def test_is_equal_to_original(self):
+        eq_(self.frozen, self.doc)
+        assert isinstance(self.frozen, dict)
+        assert isinstance(self.frozen["sentences"], list)
+
+    def test_is_a_copy(self):
+        self.doc["sentences"][0]["callsign"] = "changed"
+        eq_(self.frozen["sentences"][0]["callsign"], "habitat")
+
+    def test_dicts_are_read_only(self):
+        d = self.frozen["sentences"][0]
+        assert_raises(TypeError, d.__setitem__, "callsign", "x")
+        assert_raises(TypeError, d.__delitem__, "callsign")
+        assert_raises(TypeError, d.update, {"a": 1})
+        assert_raises(TypeError, d.setdefault, "a", 1)
+        assert_raises(TypeError, d.pop, "callsign")
+        assert_raises(TypeError, d.popitem)
+        assert_raises(TypeError, d.clear)
+
+    def test_lists_are_read_only(self):
+        l = self.frozen["sentences"][0]["fields"]
+        assert_raises(TypeError, l.__setitem__, 0, {})
+        assert_raises(TypeError, l.__delitem__, 0)
+        assert_raises(TypeError, l.append, {})
+        assert_raises(TypeError, l.extend, [{}])
+        assert_raises(TypeError, l.insert, 0, {})
+        assert_raises(TypeError, l.pop)
+        assert_raises(TypeError, l.sort)
+        assert_raises(TypeError, l.reverse)
+
+        def iadd():
+            l2 = l
+            l2 += [{}]
+        assert_raises(TypeError, iadd)
+        eq_(len(l), 1)
+
+    def test_freezing_frozen_is_free(self):
+        assert frozen.freeze(self.frozen) is self.frozen
+        assert copy.copy(self.frozen) is self.frozen
+
+    def test_leaves_other_things_alone(self):
+        eq_(frozen.freeze("string"), "string")
+        eq_(frozen.freeze(None), None)
+
+    def test_deepcopy_and_thaw_are_mutable(self):
+        for thawed in [copy.deepcopy(self.frozen), frozen.thaw(self.frozen)]:
+            eq_(thawed, self.doc)
+            assert type(thawed) is dict
+            assert type(thawed["sentences"]) is list
+            thawed["sentences"][0]["callsign"] = "changed"
+            eq_(self.frozen["sentences"][0]["callsign"], "habitat")
+
+    def test_pickles(self):
+        unpickled = pickle.loads(pickle.dumps(self.frozen))
+        eq_(unpickled, self.doc)
+        assert isinstance(unpickled, frozen.FrozenDict)
+        assert isinstance(unpickled["sentences"], frozen.FrozenList)
@@ -0,0 +1,62 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.utils.lru
+"""
+
+from nose.tools import assert_raises
+
+from ...utils import lru
+
+
+class TestLRUCache(object):
+    def setup(self):
+        self.cache = lru.LRUCache(2)
+
+    def test_stores_items(self):
+        self.cache["a"] = 1
+        assert "a" in self.cache
+        assert self.cache.get("a") == 1
+        assert self.cache.get("b") is None
+        assert self.cache.get("b", 5) == 5
+
+    def test_evicts_least_recently_used(self):
+        self.cache["a"] = 1
+        self.cache["b"] = 2
+        self.cache.get("a")
+        self.cache["c"] = 3
+        assert "a" in self.cache
+        assert "b" not in self.cache
+        assert "c" in self.cache
+        assert len(self.cache) == 2
+
+    def test_replacing_counts_as_use(self):
+        self.cache["a"] = 1
+        self.cache["b"] = 2
+        self.cache["a"] = 3
+        self.cache["c"] = 4
+        assert self.cache.get("a") == 3
+        assert "b" not in self.cache
+
+    def test_clear(self):
+        self.cache["a"] = 1
+        self.cache.clear()
+        assert len(self.cache) == 0
+
+    def test_rejects_silly_sizes(self):
+        assert_raises(ValueError, lru.LRUCache, 0)
@@ -0,0 +1,215 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for habitat.utils.memory_couch
+"""
+
+import couchdbkit
+import couchdbkit.exceptions
+from nose.tools import eq_, assert_raises
+
+from ...utils import memory_couch
+
+
+def config_doc(doc_id, callsign, created):
+    return {
+        "_id": doc_id,
+        "type": "payload_configuration",
+        "name": doc_id,
+        "time_created": created,
+        "sentences": [{"callsign": callsign}]
+    }
+
+
+class TestCollation(object):
+    def test_type_order(self):
+        values = [None, False, True, -1, 2.5, 10, "", "a", "b", [], [1],
+                  [1, "a"], [2], {}]
+        keys = [memory_couch.collation_key(v) for v in values]
+        eq_(keys, sorted(keys))
+
+
+class TestDatabase(object):
+    def setup(self):
+        self.db = memory_couch.Database()
+
+    def test_save_and_get(self):
+        doc = {"_id": "a", "x": 1}
+        self.db.save_doc(doc)
+        assert doc["_rev"].startswith("1-")
+
+        got = self.db["a"]
+        eq_(got, doc)
+        got["x"] = 2
+        eq_(self.db["a"]["x"], 1)
+
+        assert "a" in self.db
+        assert "b" not in self.db
+        assert_raises(couchdbkit.exceptions.ResourceNotFound,
+                      self.db.get, "b")
+
+    def test_assigns_ids(self):
+        doc = {"x": 1}
+        self.db.save_doc(doc)
+        eq_(self.db[doc["_id"]]["x"], 1)
+
+    def test_conflicts(self):
+        doc = {"_id": "a"}
+        self.db.save_doc(doc)
+        old = dict(doc)
+        self.db.save_doc(doc)
+        assert doc["_rev"].startswith("2-")
+        assert_raises(couchdbkit.exceptions.ResourceConflict,
+                      self.db.save_doc, old)
+        assert_raises(couchdbkit.exceptions.ResourceConflict,
+                      self.db.save_doc, {"_id": "a"})
+
+    def test_delete(self):
+        doc = {"_id": "a"}
+        self.db.save_doc(doc)
+        self.db.delete_doc(doc)
+        assert "a" not in self.db
+        eq_(self.db.info()["doc_count"], 0)
+        self.db.save_doc({"_id": "a"})
+        assert self.db["a"]["_rev"].startswith("3-")
+
+    def test_save_docs(self):
+        a = {"_id": "a"}
+        self.db.save_doc(a)
+        docs = [{"_id": "a"}, {"_id": "b"}]
+        try:
+            self.db.save_docs(docs)
+        except couchdbkit.exceptions.BulkSaveError as e:
+            eq_(e.results[0]["error"], "conflict")
+            eq_(e.results[1]["id"], "b")
+        else:
+            raise AssertionError("expected BulkSaveError")
+        assert "_rev" in docs[1]
+        assert "b" in self.db
+
+        results = self.db.save_docs([a])
+        eq_(results[0]["rev"], a["_rev"])
+
+    def test_all_docs(self):
+        self.db.save_doc({"_id": "b"})
+        self.db.save_doc({"_id": "a"})
+        rows = self.db.all_docs(keys=["b", "c"], include_docs=True).all()
+        eq_(rows[0]["doc"]["_id"], "b")
+        eq_(rows[1], {"key": "c", "error": "not_found"})
+
+        eq_([r["id"] for r in self.db.all_docs()], ["a", "b"])
+        eq_([r["id"] for r in self.db.all_docs(startkey="b")], ["b"])
+
+    def test_view_range(self):
+        self.db.save_doc(config_doc("1", "A", "2012-01-01T00:00:00Z"))
+        self.db.save_doc(config_doc("2", "B", "2012-01-01T00:00:00Z"))
+        self.db.save_doc(config_doc("3", "B", "2012-01-02T00:00:00Z"))
+        self.db.save_doc({"_id": "x", "type": "payload_telemetry"})
+        name = "payload_configuration/callsign_time_created_index"
+
+        eq_([r["id"] for r in self.db.view(name)], ["1", "2", "3"])
+
+        view = self.db.view(name, startkey=["B", "inf"], descending=True,
+                            limit=1, include_docs=True)
+        row = view.first()
+        eq_(row["id"], "3")
+        eq_(row["key"][0], "B")
+        eq_(row["doc"]["_id"], "3")
+
+        rows = self.db.view(name, startkey=["AA"], endkey=["B", {}])
+        eq_([r["id"] for r in rows], ["2", "3"])
+
+    def test_view_startkey_docid(self):
+        for doc_id in ("1", "2", "3"):
+            self.db.save_doc(config_doc(doc_id, "A", "2012-01-01T00:00:00Z"))
+        name = "payload_configuration/callsign_time_created_index"
+        key = self.db.view(name).first()["key"]
+
+        rows = self.db.view(name, startkey=key, startkey_docid="2")
+        eq_([r["id"] for r in rows], ["2", "3"])
+        rows = self.db.view(name, startkey=key, startkey_docid="2",
+                            descending=True)
+        eq_([r["id"] for r in rows], ["2", "1"])
+
+    def test_view_is_updated(self):
+        name = "payload_configuration/name_time_created"
+        eq_(self.db.view(name).count(), 0)
+        doc = config_doc("1", "A", "2012-01-01T00:00:00Z")
+        self.db.save_doc(doc)
+        eq_(self.db.view(name).count(), 1)
+        self.db.delete_doc(doc)
+        eq_(self.db.view(name).count(), 0)
+
+    def test_linked_docs(self):
+        self.db.save_doc(config_doc("c", "A", "2012-01-01T00:00:00Z"))
+        self.db.save_doc({"_id": "f", "type": "flight", "approved": True,
+                          "start": "2012-01-01T00:00:00Z",
+                          "end": "2012-01-02T00:00:00Z",
+                          "payloads": ["c", "missing"]})
+        rows = self.db.view("flight/end_start_including_payloads",
+                            include_docs=True).all()
+        eq_([r["doc"] and r["doc"]["_id"] for r in rows], ["f", "c", None])
+
+    def test_unknown_view(self):
+        assert_raises(couchdbkit.exceptions.ResourceNotFound,
+                      self.db.view, "flight/nonexistent")
+
+    def test_update_handler(self):
+        url = "_design/payload_telemetry/_update/add_listener/abc"
+        for callsign in ("A", "B"):
+            proto = {"data": {"_raw": "aGVsbG8="},
+                     "receivers": {callsign: {"time_created": "now"}}}
+            self.db.res.put(url, payload=proto).skip_body()
+        doc = self.db["abc"]
+        eq_(sorted(doc["receivers"]), ["A", "B"])
+        eq_(doc["type"], "payload_telemetry")
+
+    def test_changes(self):
+        self.db.save_doc(config_doc("c", "A", "2012-01-01T00:00:00Z"))
+        doc = {"_id": "t", "type": "payload_telemetry", "data": {}}
+        self.db.save_doc(doc)
+        doc["data"]["_parsed"] = True
+        self.db.save_doc(doc)
+        eq_(self.db.info()["update_seq"], 3)
+
+        changes = self.db.changes()
+        eq_([(c["seq"], c["id"]) for c in changes["results"]],
+            [(1, "c"), (3, "t")])
+        eq_(changes["last_seq"], 3)
+
+        eq_(self.db.changes(since=1)["results"][0]["id"], "t")
+        changes = self.db.changes(filter="parser/config", include_docs=True)
+        eq_([c["doc"]["_id"] for c in changes["results"]], ["c"])
+
+    def test_consumer(self):
+        self.db.save_doc({"_id": "a", "type": "flight"})
+        self.db.save_doc({"_id": "b", "type": "payload_telemetry"})
+        self.db.save_doc({"_id": "c", "type": "payload_configuration"})
+        seen = []
+        consumer = couchdbkit.Consumer(self.db)
+        consumer.wait(seen.append, since=1, filter="parser/config",
+                      include_docs=True, timeout=10)
+        eq_([(c["seq"], c["doc"]["_id"]) for c in seen], [(3, "c")])
+
+
+class TestServer(object):
+    def test_creates_databases(self):
+        server = memory_couch.Server()
+        db = server["habitat"]
+        assert server["habitat"] is db
+        eq_(server.all_dbs(), ["habitat"])
@@ -0,0 +1,161 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for habitat.utils.metrics
+"""
+
+import mox
+
+from nose.tools import eq_
+
+from ...utils import metrics
+
+
+class ListSink(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, counters, timings):
+        self.sent.append((counters, timings))
+
+
+class TestAggregator(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.sink = ListSink()
+        self.aggregator = metrics.Aggregator(self.sink, interval=3600)
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def test_aggregates_until_flushed(self):
+        self.aggregator.increment("a")
+        self.aggregator.increment("a", 4)
+        self.aggregator.increment("b")
+        self.aggregator.timing("t", 5)
+        self.aggregator.timing("t", 7)
+        eq_(self.sink.sent, [])
+        self.aggregator.flush()
+        eq_(len(self.sink.sent), 1)
+        counters, timings = self.sink.sent[0]
+        eq_(counters, {"a": 5, "b": 1})
+        eq_(timings.keys(), ["t"])
+        eq_((timings["t"].count, timings["t"].samples), (2, [5, 7]))
+        eq_(timings["t"].sample_rate, 1.0)
+
+    def test_timings_are_bounded(self):
+        for i in xrange(1000):
+            self.aggregator.timing("t", i)
+        timer = self.aggregator._timings["t"]
+        assert not hasattr(timer, "__dict__")
+        eq_(timer.count, 1000)
+        eq_(len(timer.samples), 100)
+        eq_(len(set(timer.samples)), 100)
+        assert all(0 <= ms < 1000 for ms in timer.samples)
+        eq_(timer.sample_rate, 0.1)
+
+    def test_doesnt_send_nothing(self):
+        self.aggregator.increment("a")
+        self.aggregator.flush()
+        self.aggregator.flush()
+        eq_(len(self.sink.sent), 1)
+
+    def test_starts_flush_thread_once(self):
+        self.aggregator.increment("a")
+        thread = self.aggregator._thread
+        assert thread.daemon and thread.is_alive()
+        self.aggregator.timing("t", 1)
+        assert self.aggregator._thread is thread
+
+    def test_survives_sink_errors(self):
+        sink = self.m.CreateMock(ListSink)
+        sink.send({"a": 1}, {}).AndRaise(IOError)
+        self.m.ReplayAll()
+        self.aggregator.sink = sink
+        self.aggregator.increment("a")
+        self.aggregator.flush()
+        self.m.VerifyAll()
+
+
+class RecordingClient(object):
+    def __init__(self):
+        self.sent = []
+
+    def incr(self, bucket, delta=1):
+        self.sent.append((bucket, "{0}|c".format(delta)))
+
+    def timing(self, bucket, ms):
+        self.sent.append((bucket, "{0}|ms".format(ms)))
+
+    def _send(self, bucket, value):
+        self.sent.append((bucket, value))
+
+
+class TestStatsdSink(object):
+    def setup(self):
+        self.sink = metrics.StatsdSink()
+        self.sink.client = RecordingClient()
+
+    def test_sends_totals(self):
+        timer = metrics.TimerSamples()
+        timer.add(3)
+        timer.add(4)
+        self.sink.send({"a": 5}, {"t": timer})
+        eq_(sorted(self.sink.client.sent),
+            [("a", "5|c"), ("t", "3|ms"), ("t", "4|ms")])
+
+    def test_many_samples_bounded_sends(self):
+        aggregator = metrics.Aggregator(self.sink, interval=3600)
+        for i in xrange(1000):
+            aggregator.timing("t", i)
+        aggregator.flush()
+        sent = self.sink.client.sent
+        eq_(len(sent), 100)
+        for bucket, value in sent:
+            eq_(bucket, "t")
+            assert value.endswith("|ms|@0.1")
+
+
+class TestModuleFunctions(object):
+    def setup(self):
+        self.old = metrics._aggregator
+        self.sink = ListSink()
+        metrics._aggregator = metrics.Aggregator(self.sink, interval=3600)
+
+    def teardown(self):
+        metrics._aggregator = self.old
+
+    def test_increment_and_configure(self):
+        metrics.increment("a", 2)
+        new_sink = ListSink()
+        metrics.configure(sink=new_sink, interval=5)
+        eq_(self.sink.sent, [({"a": 2}, {})])
+        eq_(metrics._aggregator.interval, 5)
+        metrics.increment("b")
+        metrics.flush()
+        eq_(new_sink.sent, [({"b": 1}, {})])
+
+    def test_timed(self):
+        @metrics.timed("f_time")
+        def f(x):
+            return x * 2
+
+        eq_(f(2), 4)
+        metrics.flush()
+        counters, timings = self.sink.sent[0]
+        eq_(timings.keys(), ["f_time"])
+        eq_(timings["f_time"].count, 1)
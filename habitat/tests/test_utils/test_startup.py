@@ -255,6 +255,36 @@ class TestSetupLogging(object):
 
         self.mocker.VerifyAll()
 
+class TestSetupMetrics(object):
+    def setup(self):
+        self.mocker = mox.Mox()
+        self.mocker.StubOutWithMock(startup, 'metrics')
+
+    def teardown(self):
+        self.mocker.UnsetStubs()
+
+    def test_defaults(self):
+        startup.metrics.configure(sink=None, interval=None)
+        self.mocker.ReplayAll()
+        startup.setup_metrics({})
+        self.mocker.VerifyAll()
+
+    def test_loads_sink(self):
+        self.mocker.StubOutWithMock(startup, 'dynamicloader')
+        sink_class = self.mocker.CreateMockAnything()
+        startup.dynamicloader.load("some.Sink").AndReturn(sink_class)
+        sink_class(host="example").AndReturn("the sink")
+        startup.metrics.configure(sink="the sink", interval=2)
+        self.mocker.ReplayAll()
+        startup.setup_metrics({
+            "metrics": {
+                "sink": "some.Sink",
+                "interval": 2,
+                "sink_options": {"host": "example"}
+            }
+        })
+        self.mocker.VerifyAll()
+
 class TestMain(object):
     def setup(self):
         self.mocker = mox.Mox()
@@ -265,6 +295,7 @@ class TestMain(object):
     def test_works(self):
         self.mocker.StubOutWithMock(startup, 'load_config')
         self.mocker.StubOutWithMock(startup, 'setup_logging')
+        self.mocker.StubOutWithMock(startup, 'setup_metrics')
 
         main_class = self.mocker.CreateMockAnything()
         main_class.__name__ = "ExampleDaemon"
@@ -273,6 +304,7 @@ class TestMain(object):
 
         startup.load_config().AndReturn({"the_config": True})
         startup.setup_logging({"the_config": True}, "exampledaemon")
+        startup.setup_metrics({"the_config": True})
         main_class({"the_config": True}, "exampledaemon")\
                 .AndReturn(main_object)
         main_object.run()
@@ -0,0 +1,108 @@
+# Copyright 2012 (C) Daniel Richman
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for habitat.utils.tracing
+"""
+
+import mox
+
+from nose.tools import eq_
+
+from ...utils import tracing
+
+
+class TestHistogram(object):
+    def setup(self):
+        self.h = tracing.Histogram()
+
+    def test_empty(self):
+        eq_(self.h.percentile(50), None)
+        eq_(self.h.summary()["count"], 0)
+
+    def test_percentiles_are_close(self):
+        for i in xrange(1, 1001):
+            self.h.record(i / 1000.0)
+        for p in [50, 95, 99]:
+            estimate = self.h.percentile(p)
+            assert abs(estimate - p / 100.0) < 0.05 * p / 100.0, (p, estimate)
+        eq_(self.h.percentile(100), 1.0)
+        summary = self.h.summary()
+        eq_(summary["count"], 1000)
+        eq_(summary["max"], 1.0)
+        assert abs(summary["mean"] - 0.5005) < 1e-9
+
+    def test_extremes(self):
+        self.h.record(0)
+        self.h.record(1000)
+        eq_(self.h.percentile(50), self.h.minimum)
+        eq_(self.h.percentile(99), 1000)
+
+
+class TestStageTracer(object):
+    def setup(self):
+        self.m = mox.Mox()
+        self.tracer = tracing.StageTracer()
+
+    def teardown(self):
+        self.m.UnsetStubs()
+
+    def test_stage_records_time(self):
+        self.m.StubOutWithMock(tracing, 'time')
+        tracing.time.time().AndReturn(10.0)
+        tracing.time.time().AndReturn(10.5)
+        self.m.ReplayAll()
+        with self.tracer.stage("parse", "habitat"):
+            pass
+        self.m.VerifyAll()
+
+        stats = self.tracer.stats()
+        eq_(stats["stages"]["parse"]["count"], 1)
+        assert abs(stats["stages"]["parse"]["p50"] - 0.5) < 0.05 * 0.5
+        eq_(stats["callsigns"]["habitat"]["parse"]["max"], 0.5)
+
+    def test_records_even_if_stage_raises(self):
+        try:
+            with self.tracer.stage("parse"):
+                raise ValueError
+        except ValueError:
+            pass
+        eq_(self.tracer.stats()["stages"]["parse"]["count"], 1)
+        eq_(self.tracer.stats()["callsigns"], {})
+
+    def test_limits_callsigns(self):
+        self.tracer.max_callsigns = 2
+        for callsign in ["a", "b", "c"]:
+            self.tracer.record("parse", 0.1, callsign)
+        stats = self.tracer.stats()
+        eq_(sorted(stats["callsigns"]), ["a", "b"])
+        eq_(stats["stages"]["parse"]["count"], 3)
+
+    def test_reset(self):
+        self.tracer.record("parse", 0.1, "a")
+        self.tracer.reset()
+        eq_(self.tracer.stats(), {"stages": {}, "callsigns": {}})
+
+    def test_log_summary(self):
+        self.m.StubOutWithMock(tracing, 'logger')
+        tracing.logger.info(mox.And(
+            mox.Regex(r"^Stage parse: 1 calls, p50 9\d\.\d\dms "
+                      r"p95 9\d\.\d\dms p99 9\d\.\d\dms"),
+            mox.StrContains("max 100.00ms")))
+        self.m.ReplayAll()
+        self.tracer.record("parse", 0.1)
+        self.tracer.log_summary()
+        self.m.VerifyAll()
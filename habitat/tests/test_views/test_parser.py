@@ -51,3 +51,12 @@ def test_unparsed_filter():
 def test_issue_241():
     # this should not produce an exception
     parser.unparsed_filter({"_deleted": True}, {})
+
+def test_config_filter():
+    fil = parser.config_filter
+
+    assert not fil(doc, {})
+    assert fil({"type": "flight"}, {})
+    assert fil({"type": "payload_configuration"}, {})
+    assert fil({"_deleted": True}, {})
+    assert not fil({}, {})
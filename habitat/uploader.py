@@ -24,6 +24,7 @@ by a daemon for further processing.
 
 """
 
+import re
 import sys
 import copy
 import base64
@@ -33,13 +34,14 @@ import couchdbkit.exceptions
 import restkit
 import restkit.errors
 import threading
-import Queue
+import heapq
+import collections
 import time
 import traceback
 import json
 import logging
 
-from .utils import rfc3339
+from .utils import rfc3339, checksums
 
 logger = logging.getLogger("habitat.uploader")
 
@@ -77,7 +79,7 @@ class Uploader(object):
     def __init__(self, callsign,
                        couch_uri="http://habitat.habhub.org/",
                        couch_db="habitat",
-                       max_merge_attempts=20):
+                       max_merge_attempts=20, db=None):
         # NB: update default options in /bin/uploader
 
         self._lock = threading.RLock()
@@ -85,8 +87,12 @@ class Uploader(object):
         self._latest = {}
         self._max_merge_attempts = max_merge_attempts
 
-        server = couchdbkit.Server(couch_uri)
-        self._db = server[couch_db]
+        if db is None:
+            server = couchdbkit.Server(couch_uri)
+            self._db = server[couch_db]
+        else:
+            # e.g., a habitat.utils.memory_couch.Database, for testing
+            self._db = db
 
     def listener_telemetry(self, data, time_created=None):
         """
@@ -287,6 +293,141 @@ class Uploader(object):
         return [row["doc"] for row in view]
 
 
+class _UploadQueue(object):
+    """
+    The queue of calls waiting to be made by :class:`UploaderThread`.
+
+    Calls are taken in order of priority (from :attr:`priorities`), then
+    in the order they were queued. A queued ``listener_telemetry`` or
+    ``listener_information`` call is replaced by a newer call of the same
+    kind, so only the latest is made.
+
+    Settings changes (``init``), resets and shutdown (``None``) are
+    barriers: they are made once every call queued before them has
+    finished, and no call queued after them starts until they have
+    finished.
+
+    If *lanes* is True, downloads (``flights`` and ``payloads``) are given
+    only to workers that ask for the ``download`` lane; otherwise every
+    call is in the ``upload`` lane.
+    """
+
+    priorities = {
+        "payload_telemetry": 0,
+        "listener_telemetry": 1,
+        "listener_information": 1,
+        "flights": 2,
+        "payloads": 2
+    }
+    coalesce = ["listener_telemetry", "listener_information"]
+    downloads = ["flights", "payloads"]
+
+    def __init__(self, lanes=False):
+        self._lanes = lanes
+        self._cond = threading.Condition()
+        self._heaps = {"upload": [], "download": []}
+        self._barriers = collections.deque()
+        self._latest = {}
+        self._epoch = 0
+        self._seq = 0
+        self._active = 0
+        self._in_barrier = False
+        self._shutdown = False
+        self._unfinished = 0
+
+    def put(self, item):
+        with self._cond:
+            self._unfinished += 1
+
+            if item is None or item[0] in ("init", "reset"):
+                self._barriers.append((self._epoch, item))
+                self._epoch += 1
+            else:
+                func = item[0]
+                latest = self._latest.get(func)
+                if latest is not None and latest[0] == self._epoch:
+                    # Replace the older call, which was never made.
+                    latest[3] = item
+                    self._unfinished -= 1
+                    return
+
+                entry = [self._epoch, self.priorities.get(func, 0),
+                         self._seq, item]
+                self._seq += 1
+                heapq.heappush(self._heaps[self._lane(func)], entry)
+                if func in self.coalesce:
+                    self._latest[func] = entry
+
+            self._cond.notify_all()
+
+    def _lane(self, func):
+        if self._lanes and func in self.downloads:
+            return "download"
+        else:
+            return "upload"
+
+    def get(self, lane="upload"):
+        """
+        Wait for and return the next call for a worker in *lane*, or None
+        when the queue is shut down.
+        """
+        with self._cond:
+            while True:
+                if self._shutdown:
+                    return None
+
+                heap = self._heaps[lane]
+                if self._barriers:
+                    barrier_epoch = self._barriers[0][0]
+                else:
+                    barrier_epoch = None
+
+                if not self._in_barrier and heap and \
+                        (barrier_epoch is None or heap[0][0] <= barrier_epoch):
+                    entry = heapq.heappop(heap)
+                    func = entry[3][0]
+                    if self._latest.get(func) is entry:
+                        del self._latest[func]
+                    self._active += 1
+                    return entry[3]
+
+                if barrier_epoch is not None and not self._in_barrier and \
+                        self._active == 0 and \
+                        not self._before_barrier(barrier_epoch):
+                    epoch, item = self._barriers.popleft()
+                    if item is None:
+                        self._shutdown = True
+                        self._unfinished -= 1
+                        self._cond.notify_all()
+                        return None
+                    self._in_barrier = True
+                    return item
+
+                self._cond.wait()
+
+    def _before_barrier(self, epoch):
+        for heap in self._heaps.values():
+            if heap and heap[0][0] <= epoch:
+                return True
+        return False
+
+    def task_done(self):
+        """Mark the call last returned by :meth:`get` to this worker done"""
+        with self._cond:
+            if self._in_barrier:
+                self._in_barrier = False
+            else:
+                self._active -= 1
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self):
+        """Block until every queued call has been made"""
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+
 class UploaderThread(threading.Thread):
     """
     An easy wrapper around :class:`Uploader` to make a non blocking Uploader
@@ -317,20 +458,49 @@ class UploaderThread(threading.Thread):
 
     The :meth:`reset` method destroys the underlying Uploader. Calls will
     emit warnings in the same fashion as a failed initialisation.
+
+    Queued calls are not necessarily made in the order they were queued:
+
+     - :meth:`payload_telemetry` calls are made first, then
+       :meth:`listener_telemetry` and :meth:`listener_information`, then
+       downloads (:meth:`flights` and :meth:`payloads`).
+     - If a :meth:`listener_telemetry` (or :meth:`listener_information`)
+       call is queued while an earlier one is still waiting, only the newer
+       one is made.
+     - :meth:`settings` and :meth:`reset` still take effect exactly
+       between the calls queued before and after them.
+
+    *workers* threads make the calls (the UploaderThread itself, and more
+    if *workers* is greater than 1), so that one slow call need not hold up
+    the rest; they share one :class:`Uploader`. If *download_lane* is True,
+    another thread makes only the downloads, so that they never delay
+    uploads.
     """
 
-    def __init__(self):
+    def __init__(self, workers=1, download_lane=False):
         super(UploaderThread, self).__init__(name="habitat UploaderThread")
-        self._queue = Queue.Queue()
+        self._queue = _UploadQueue(lanes=download_lane)
         self._sent_shutdown = False
         self._sent_shutdown_lock = threading.Lock()
 
-        # For use by run() only
+        self._workers = []
+        for i in xrange(1, workers):
+            self._workers.append(threading.Thread(
+                target=self._work, args=("upload", ),
+                name="habitat UploaderThread worker {0}".format(i)))
+        if download_lane:
+            self._workers.append(threading.Thread(
+                target=self._work, args=("download", ),
+                name="habitat UploaderThread downloads"))
+
+        # For use by the worker threads only
         self._uploader = None
 
     def start(self):
         """Start the background UploaderThread"""
         super(UploaderThread, self).start()
+        for worker in self._workers:
+            worker.start()
 
     def _do_queue(self, item):
         self.debug("Queuing " + self._describe(item))
@@ -344,6 +514,8 @@ class UploaderThread(threading.Thread):
                 self._do_queue(None)
 
         super(UploaderThread, self).join()
+        for worker in self._workers:
+            worker.join()
 
     def settings(self, *args, **kwargs):
         """See :class:`Uploader`'s initialiser"""
@@ -452,9 +624,11 @@ class UploaderThread(threading.Thread):
 
     def run(self):
         self.debug("Started")
+        self._work("upload")
 
+    def _work(self, lane):
         while True:
-            item = self._queue.get()
+            item = self._queue.get(lane)
 
             self.debug("Running " + self._describe(item))
 
@@ -537,6 +711,21 @@ class ExtractorManager(object):
             for e in self._extractors:
                 e.push(b, **kwargs)
 
+    def push_bytes(self, buf, **kwargs):
+        """
+        Push many received bytes at once, buf, to all extractors.
+
+        buf must be of type str. This has the same effect as calling
+        :meth:`push` with each byte in turn, but is much faster when data
+        arrives in chunks (e.g., when reading a file or pipe).
+        """
+
+        assert isinstance(buf, str)
+
+        with self._lock:
+            for e in self._extractors:
+                e.push_bytes(buf, **kwargs)
+
     def skipped(self, n):
         """
         Tell all extractors that approximately n undecodable bytes have passed
@@ -560,6 +749,165 @@ class ExtractorManager(object):
         logger.debug("Extractor gave us provisional parse: " + json.dumps(d))
 
 
+class ChannelExtractorManager(object):
+    """
+    Manage the extractors for many channels of data received at once, such
+    as the RTTY channels decoded from one wideband receiver.
+
+    Each channel (identified by any hashable *channel* id, such as a
+    frequency) has its own :class:`ExtractorManager` and set of extractors,
+    created when data for it first arrives by calling *extractors*, which
+    should return a list of new :class:`Extractor` objects (by default, a
+    single :class:`UKHASExtractor`). Extracted strings from every channel
+    are uploaded by the one *uploader* (an :class:`Uploader` or, if data
+    arrives in more than one thread, an :class:`UploaderThread`).
+
+    As for :class:`ExtractorManager`, the user should override
+    :meth:`status` and :meth:`data`, which are given the channel id as well.
+
+    Channels are independent, so each has its own lock: data for different
+    channels may be pushed from different threads.
+    """
+
+    def __init__(self, uploader, extractors=None):
+        if extractors is None:
+            extractors = lambda: [UKHASExtractor()]
+
+        self.uploader = uploader
+        self._extractors = extractors
+        self._lock = threading.RLock()
+        self._channels = {}
+
+    def channel(self, channel):
+        """
+        Returns the :class:`ExtractorManager` for *channel*, creating it if
+        it doesn't exist.
+        """
+        try:
+            return self._channels[channel]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if channel not in self._channels:
+                manager = _ChannelManager(self, channel)
+                for extractor in self._extractors():
+                    manager.add(extractor)
+                self._channels[channel] = manager
+            return self._channels[channel]
+
+    def push(self, channel, b, **kwargs):
+        """see :meth:`ExtractorManager.push`"""
+        self.channel(channel).push(b, **kwargs)
+
+    def push_bytes(self, channel, buf, **kwargs):
+        """see :meth:`ExtractorManager.push_bytes`"""
+        self.channel(channel).push_bytes(buf, **kwargs)
+
+    def push_many(self, chunks, **kwargs):
+        """
+        Push each ``(channel, buf)`` in the iterable *chunks*, which may
+        interleave the data of many channels (e.g., as read from a single
+        stream by :func:`read_channel_frames`).
+        """
+        for channel, buf in chunks:
+            self.channel(channel).push_bytes(buf, **kwargs)
+
+    def skipped(self, channel, n):
+        """see :meth:`ExtractorManager.skipped`"""
+        self.channel(channel).skipped(n)
+
+    def stats(self):
+        """
+        Returns a dict of statistics for each channel, by channel id: the
+        number of ``bytes`` pushed, bytes ``skipped`` and ``strings``
+        uploaded.
+        """
+        with self._lock:
+            channels = self._channels.items()
+        return dict((channel, dict(manager.stats))
+                    for channel, manager in channels)
+
+    def status(self, channel, msg):
+        """Logging method, called by Extractors when something happens"""
+        logger.info("{0}: {1}".format(channel, msg))
+
+    def data(self, channel, d):
+        """Called by Extractors if they are able to parse extracted data"""
+        logger.debug("{0}: Extractor gave us provisional parse: {1}"
+                     .format(channel, json.dumps(d)))
+
+
+class _ChannelManager(ExtractorManager):
+    """The :class:`ExtractorManager` for one channel."""
+
+    def __init__(self, parent, channel):
+        self.stats = {"bytes": 0, "skipped": 0, "strings": 0}
+        uploader = _ChannelUploader(parent.uploader, self.stats)
+        super(_ChannelManager, self).__init__(uploader)
+        self._parent = parent
+        self._channel = channel
+
+    def push(self, b, **kwargs):
+        with self._lock:
+            super(_ChannelManager, self).push(b, **kwargs)
+            self.stats["bytes"] += 1
+
+    def push_bytes(self, buf, **kwargs):
+        with self._lock:
+            super(_ChannelManager, self).push_bytes(buf, **kwargs)
+            self.stats["bytes"] += len(buf)
+
+    def skipped(self, n):
+        with self._lock:
+            super(_ChannelManager, self).skipped(n)
+            self.stats["skipped"] += n
+
+    def status(self, msg):
+        self._parent.status(self._channel, msg)
+
+    def data(self, d):
+        self._parent.data(self._channel, d)
+
+
+class _ChannelUploader(object):
+    """Counts a channel's strings, and passes them to the shared uploader"""
+
+    def __init__(self, uploader, stats):
+        self._uploader = uploader
+        self._stats = stats
+
+    def payload_telemetry(self, string, *args, **kwargs):
+        self._stats["strings"] += 1
+        return self._uploader.payload_telemetry(string, *args, **kwargs)
+
+
+def read_channel_frames(f):
+    """
+    Read data for many channels, interleaved, from the file *f*, yielding
+    ``(channel, data)`` for :meth:`ChannelExtractorManager.push_many`.
+
+    Each frame is a header line, ``<channel> <length>\\n``, followed by
+    *length* bytes of data. Reading stops at the end of the file.
+    """
+    while True:
+        header = f.readline()
+        if not header:
+            return
+        header = header.strip()
+        if not header:
+            continue
+        try:
+            channel, length = header.rsplit(" ", 1)
+            length = int(length)
+        except ValueError:
+            raise ValueError("Invalid frame header: {0!r}".format(header))
+        data = f.read(length)
+        if len(data) != length:
+            return
+        yield channel, data
+
+
 class Extractor(object):
     """
     A base class for an Extractor.
@@ -584,67 +932,280 @@ class Extractor(object):
         """see :meth:`ExtractorManager.push`"""
         raise NotImplementedError
 
+    def push_bytes(self, buf, **kwargs):
+        """
+        see :meth:`ExtractorManager.push_bytes`
+
+        The default implementation calls :meth:`push` for each byte.
+        """
+        for b in buf:
+            self.push(b, **kwargs)
+
     def skipped(self, n):
         """see :meth:`ExtractorManager.skipped`"""
         raise NotImplementedError
 
 
 class UKHASExtractor(Extractor):
-    def __init__(self):
+    """
+    Extracts UKHAS strings: everything from a ``$$`` to a newline.
+
+    If it is given the payload_configuration documents of the payloads
+    being received (with *payloads* or :meth:`set_payloads`), the
+    extractor also computes each string's checksum as its bytes arrive,
+    with the checksum algorithms those payloads use, so that on reaching
+    the newline it knows whether the string is intact. The result is
+    available as :attr:`checksum_ok`: True or False, or None if the
+    string's callsign isn't one of the payloads'. If *drop_corrupt* is
+    True, strings with bad checksums are not uploaded.
+    """
+
+    max_length = 1000
+    max_garbage = 16
+    # Bytes that count towards max_garbage: non printable ascii
+    garbage_exp = re.compile("[^\x20-\x7E]")
+
+    def __init__(self, payloads=None, drop_corrupt=False):
         super(UKHASExtractor, self).__init__()
         self.last = None
         self.buffer = ""
         self.garbage_count = 0
         self.extracting = False
+        self.drop_corrupt = drop_corrupt
+        self.checksum_ok = None
+        self.set_payloads(payloads or [])
+        self._reset_checksums()
+
+    def set_payloads(self, payloads):
+        """
+        Check the checksums of strings from the payloads described by the
+        payload_configuration documents *payloads* (as returned by
+        :meth:`Uploader.payloads`), from the next start delimiter on.
+
+        This may be called from a thread other than the one pushing data.
+        """
+        callsign_checksums = {}
+        for doc in payloads:
+            for sentence in doc.get("sentences", []):
+                if sentence.get("protocol") != "UKHAS":
+                    continue
+                algorithm = sentence.get("checksum")
+                if algorithm != "none" and \
+                        algorithm not in checksums.algorithms:
+                    continue
+                callsign_checksums.setdefault(
+                    sentence.get("callsign"), set()).add(algorithm)
+
+        names = set()
+        for algorithms in callsign_checksums.values():
+            names.update(algorithms)
+        names.discard("none")
+        self._payload_checksums = (callsign_checksums, sorted(names))
+
+    def _reset_checksums(self):
+        self._callsign_checksums, names = self._payload_checksums
+        self._running = [(name, checksums.algorithms[name].new())
+                         for name in names]
+        self._star = None
+        self._body_checksums = None
 
     def push(self, b, **kwargs):
         if b == '\r':
             b = '\n'
 
         if self.last == '$' and b == '$':
-            self.buffer = self.last + b
-            self.garbage_count = 0
-            self.extracting = True
-
-            self.manager.status("UKHAS: found start delimiter")
+            self._start()
 
         elif self.extracting and b == '\n':
-            self.buffer += b
-            self.manager.uploader.payload_telemetry(self.buffer)
-
-            self.manager.status("UKHAS: extracted string")
-
-            try:
-                # TODO self.manager.data(self.crude_parse(self.buffer))
-                raise ValueError("crude parse doesn't exist yet")
-
-            except (ValueError, KeyError) as e:
-                self.manager.status("UKHAS: crude parse failed: " + str(e))
-                self.manager.data({"_sentence": self.buffer})
-
-            self.buffer = None
-            self.extracting = False
+            self._finish()
 
         elif self.extracting:
             if "baudot_hack" in kwargs and kwargs["baudot_hack"] and b == '#':
                 # baudot doesn't support '*', we use '#'
                 b = '*'
 
+            if b == '*':
+                # The checksum follows the last '*'; any before it are part
+                # of the body, so keep going.
+                self._star = len(self.buffer)
+                self._body_checksums = \
+                    [running.value() for name, running in self._running]
+
             self.buffer += b
+            for name, running in self._running:
+                running.update(b)
 
             if ord(b) < 0x20 or ord(b) > 0x7E:
                 # Non ascii chars
                 self.garbage_count += 1
 
             # Sane limits to avoid uploading tonnes of garbage
-            if len(self.buffer) > 1000 or self.garbage_count > 16:
-                self.manager.status("UKHAS: giving up")
-
-                self.buffer = None
-                self.extracting = False
+            if len(self.buffer) > self.max_length or \
+                    self.garbage_count > self.max_garbage:
+                self._give_up()
 
         self.last = b
 
+    def push_bytes(self, buf, **kwargs):
+        """
+        see :meth:`ExtractorManager.push_bytes`
+
+        Rather than looking at each byte, this searches *buf* for the
+        delimiters and adds everything between them to the buffer at once.
+        """
+        if not buf:
+            return
+
+        buf = buf.replace('\r', '\n')
+        baudot_hack = "baudot_hack" in kwargs and kwargs["baudot_hack"]
+
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            if self.last == '$' and buf[pos] == '$':
+                self._start()
+                self.last = '$'
+                pos += 1
+
+            elif not self.extracting:
+                start = buf.find('$$', pos)
+                if start == -1:
+                    self.last = buf[-1]
+                    break
+                self.last = '$'
+                pos = start + 1
+
+            else:
+                # Add everything up to the newline or the next start
+                # delimiter in one go.
+                newline = buf.find('\n', pos)
+                restart = buf.find('$$', pos, end if newline == -1
+                                                else newline)
+                if restart != -1:
+                    stop = restart + 1
+                elif newline != -1:
+                    stop = newline
+                else:
+                    stop = end
+
+                data = buf[pos:stop]
+                if baudot_hack:
+                    # baudot doesn't support '*', we use '#'
+                    data = data.replace('#', '*')
+
+                used = self._append(data)
+                pos += used
+                if used:
+                    self.last = data[used - 1]
+                if self.extracting and pos == newline:
+                    self._finish()
+                    self.last = '\n'
+                    pos += 1
+
+    def _start(self):
+        self.buffer = "$$"
+        self.garbage_count = 0
+        self.extracting = True
+        self._reset_checksums()
+
+        self.manager.status("UKHAS: found start delimiter")
+
+    def _append(self, data):
+        """
+        Add *data* to the string being extracted, stopping if it becomes
+        too long or contains too much garbage. Returns the number of bytes
+        used.
+        """
+        used = min(len(data), self.max_length + 1 - len(self.buffer))
+        garbage = [m.start() for m in self.garbage_exp.finditer(data, 0, used)]
+        allowed = self.max_garbage - self.garbage_count
+        if len(garbage) > allowed:
+            used = garbage[allowed] + 1
+            garbage = garbage[:allowed + 1]
+        self.garbage_count += len(garbage)
+        data = data[:used]
+
+        star = data.rfind('*')
+        if star != -1:
+            for name, running in self._running:
+                running.update(data[:star])
+            self._star = len(self.buffer) + star
+            self._body_checksums = \
+                [running.value() for name, running in self._running]
+            data_after = data[star:]
+        else:
+            data_after = data
+        for name, running in self._running:
+            running.update(data_after)
+        self.buffer += data
+
+        if len(self.buffer) > self.max_length or \
+                self.garbage_count > self.max_garbage:
+            self._give_up()
+        return used
+
+    def _give_up(self):
+        self.manager.status("UKHAS: giving up")
+
+        self.buffer = None
+        self.extracting = False
+
+    def _finish(self):
+        self.buffer += '\n'
+        self.checksum_ok = self._check_checksum()
+
+        if self.checksum_ok is False and self.drop_corrupt:
+            self.manager.status("UKHAS: dropped string with bad checksum")
+        else:
+            self._extracted()
+
+        self.buffer = None
+        self.extracting = False
+
+    def _extracted(self):
+        """Upload the string in :attr:`buffer`."""
+        self.manager.uploader.payload_telemetry(self.buffer)
+
+        if self.checksum_ok is None:
+            self.manager.status("UKHAS: extracted string")
+        elif self.checksum_ok:
+            self.manager.status("UKHAS: extracted string (checksum OK)")
+        else:
+            self.manager.status("UKHAS: extracted string (bad checksum)")
+
+        try:
+            # TODO self.manager.data(self.crude_parse(self.buffer))
+            raise ValueError("crude parse doesn't exist yet")
+
+        except (ValueError, KeyError) as e:
+            self.manager.status("UKHAS: crude parse failed: " + str(e))
+            self.manager.data({"_sentence": self.buffer})
+
+    def _check_checksum(self):
+        """
+        Whether the string in :attr:`buffer` has a valid checksum for any of
+        the algorithms its payload uses, or None if it's not known what
+        those are.
+        """
+        if self._star is None:
+            body = self.buffer[2:-1]
+        else:
+            body = self.buffer[2:self._star]
+        algorithms = self._callsign_checksums.get(body.split(",", 1)[0])
+        if algorithms is None:
+            return None
+        elif "none" in algorithms:
+            return True
+        elif self._star is None:
+            return False
+
+        checksum = self.buffer[self._star + 1:-1]
+        for (name, running), value in zip(self._running,
+                                          self._body_checksums):
+            if name in algorithms and \
+                    checksums.algorithms[name].matches(value, checksum):
+                return True
+        return False
+
     def skipped(self, n):
-        for i in xrange(n):
-            self.push("\0")
+        self.push_bytes("\0" * n)
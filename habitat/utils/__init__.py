@@ -24,14 +24,24 @@ Various utilities for general use by ``habitat``.
     habitat.utils.checksums
     habitat.utils.dynamicloader
     habitat.utils.filtertools
+    habitat.utils.frozen
     habitat.utils.startup
     habitat.utils.immortal_changes
+    habitat.utils.lru
+    habitat.utils.memory_couch
+    habitat.utils.metrics
     habitat.utils.rfc3339
+    habitat.utils.tracing
 """
 
 from . import checksums
 from . import dynamicloader
 from . import filtertools
+from . import frozen
 from . import startup
 from . import immortal_changes
+from . import lru
+from . import memory_couch
+from . import metrics
 from . import rfc3339
+from . import tracing
@@ -15,10 +15,169 @@
 # You should have received a copy of the GNU General Public License
 # along with habitat.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Various checksum calculation utilities."""
+"""
+Various checksum calculation utilities.
 
-import crcmod
-from operator import xor as op_xor
+Each algorithm in :data:`algorithms` is prepared once, when this module is
+imported (the CRC function is built by :mod:`crcmod` then, not per call).
+Data may be a ``str`` or any object supporting the buffer protocol, such as
+a ``bytearray``.
+
+:func:`crc16_ccitt`, :func:`xor`, :func:`fletcher_16` and
+:func:`fletcher_16_256` return checksums as hex strings, as they appear in
+telemetry; :func:`verify` and :func:`verify_many` check given checksums.
+"""
+
+import crcmod.predefined
+from binascii import hexlify
+
+__all__ = ["Algorithm", "algorithms", "crc16_ccitt", "xor", "fletcher_16",
+           "fletcher_16_256", "verify", "verify_many"]
+
+
+def _as_bytes(data):
+    """*data* as something that every algorithm accepts."""
+    if isinstance(data, (str, buffer)):
+        return data
+    elif isinstance(data, unicode):
+        return data.encode("ascii")
+    else:
+        return str(bytearray(data))
+
+
+_crc16_ccitt = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+_crc16_ccitt_initial = crcmod.predefined.Crc('crc-ccitt-false')
+
+
+def _xor(data):
+    """The XOR of every byte of *data*, by repeatedly folding it in half."""
+    value = int(hexlify(data) or "0", 16)
+    bits = 8 * len(data)
+    while bits > 8:
+        half = (bits // 16) * 8
+        value = (value >> half) ^ (value & ((1 << half) - 1))
+        bits -= half
+    return value
+
+
+def _fletcher_16(data, modulus=255):
+    """Fletcher-16 of *data*, reducing the sums only at the end."""
+    a = b = 0
+    for number in bytearray(data):
+        a += number
+        b += a
+    return ((a % modulus) << 8) | (b % modulus)
+
+
+class _RunningCRC16(object):
+    def __init__(self):
+        self._crc = _crc16_ccitt_initial.new()
+
+    def update(self, data):
+        self._crc.update(data)
+
+    def value(self):
+        return self._crc.crcValue
+
+
+class _RunningXOR(object):
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        for number in bytearray(data):
+            self._value ^= number
+
+    def value(self):
+        return self._value
+
+
+class _RunningFletcher16(object):
+    def __init__(self, modulus=255):
+        self._modulus = modulus
+        self._a = self._b = 0
+
+    def update(self, data):
+        for number in bytearray(data):
+            self._a += number
+            self._b += self._a
+
+    def value(self):
+        return ((self._a % self._modulus) << 8) | (self._b % self._modulus)
+
+
+class Algorithm(object):
+    """
+    A checksum algorithm: *label* is its name for error messages,
+    *digits* the number of hex digits it is written with and *function*
+    computes it, as an integer, from a ``str`` or read-only buffer.
+
+    *running* creates an object with methods ``update(data)`` and
+    ``value()``, for computing the checksum of data that arrives a piece at
+    a time; see :meth:`new`.
+    """
+
+    def __init__(self, label, digits, function, running):
+        self.label = label
+        self.digits = digits
+        self.function = function
+        self.running = running
+        self._format = "{0:0" + str(digits) + "X}"
+
+    def value(self, data):
+        """The checksum of *data*, as an integer."""
+        return self.function(_as_bytes(data))
+
+    def hexdigest(self, data):
+        """The checksum of *data*, as an upper case, zero-filled hex string."""
+        return self._format.format(self.function(_as_bytes(data)))
+
+    def new(self):
+        """
+        Start computing a checksum incrementally: call ``update(data)`` on
+        the returned object with each piece of data (a ``str``) and
+        ``value()`` for the checksum, as an integer, of the data so far.
+
+        >>> running = algorithms["xor"].new()
+        >>> running.update("hello,")
+        >>> running.update("world")
+        >>> algorithms["xor"].matches(running.value(), "2c")
+        True
+        """
+        return self.running()
+
+    def matches(self, value, checksum):
+        """
+        Whether the hex string *checksum* (in either case, and with the
+        right number of digits) is equal to the integer *value*.
+        """
+        if checksum is None or len(checksum) != self.digits:
+            return False
+        try:
+            return int(checksum, 16) == value
+        except ValueError:
+            return False
+
+    def verify(self, data, checksum):
+        """
+        Whether the hex string *checksum* (in either case) is the checksum
+        of *data*.
+        """
+        if checksum is None or len(checksum) != self.digits:
+            return False
+        return self.matches(self.function(_as_bytes(data)), checksum)
+
+
+#: The checksum algorithms, by the names used in configuration documents.
+algorithms = {
+    "crc16-ccitt": Algorithm("CRC16-CCITT", 4, _crc16_ccitt, _RunningCRC16),
+    "xor": Algorithm("XOR", 2, _xor, _RunningXOR),
+    "fletcher-16": Algorithm("Fletcher-16", 4, _fletcher_16,
+                             _RunningFletcher16),
+    "fletcher-16-256": Algorithm("Fletcher-16-256", 4,
+                                 lambda data: _fletcher_16(data, 256),
+                                 lambda: _RunningFletcher16(256)),
+}
 
 
 def crc16_ccitt(data):
@@ -33,8 +192,7 @@ def crc16_ccitt(data):
     >>> crc16_ccitt("hello,world")
     'E408'
     """
-    crc16 = crcmod.predefined.mkCrcFun('crc-ccitt-false')
-    return hex(crc16(data))[2:].upper().zfill(4)
+    return algorithms["crc16-ccitt"].hexdigest(data)
 
 
 def xor(data):
@@ -47,8 +205,7 @@ def xor(data):
     >>> xor("hello,world")
     '2C'
     """
-    numbers = map(ord, data)
-    return hex(reduce(op_xor, numbers))[2:].upper().zfill(2)
+    return algorithms["xor"].hexdigest(data)
 
 
 def fletcher_16(data, modulus=255):
@@ -63,11 +220,44 @@ def fletcher_16(data, modulus=255):
     >>> fletcher_16("hello,world", 256)
     '6848'
     """
-    numbers = map(ord, data)
-    a = b = 0
-    for number in numbers:
-        a += number
-        b += a
-    a %= modulus
-    b %= modulus
-    return hex((a << 8) | b)[2:].upper().zfill(4)
+    return "{0:04X}".format(_fletcher_16(_as_bytes(data), modulus))
+
+
+def fletcher_16_256(data):
+    """
+    Calculate the Fletcher-16 checksum of *data* with modulus 256, as
+    :func:`fletcher_16` does.
+
+    >>> fletcher_16_256("hello,world")
+    '6848'
+    """
+    return algorithms["fletcher-16-256"].hexdigest(data)
+
+
+def verify(data, checksum, algorithm):
+    """
+    Whether *checksum* (a hex string, or None if there wasn't one) is the
+    checksum of *data* with the algorithm named *algorithm*. Every checksum
+    is valid for ``none``.
+
+    >>> verify("hello,world", "e408", "crc16-ccitt")
+    True
+    """
+    if algorithm == "none":
+        return True
+    return algorithms[algorithm].verify(data, checksum)
+
+
+def verify_many(bodies, checksums, algorithm):
+    """
+    Check many checksums with the same algorithm, returning a list of
+    booleans, as :func:`verify` would return for each pair of *bodies* and
+    *checksums*.
+
+    >>> verify_many(["hello,world", "hello"], ["E408", "E408"], "crc16-ccitt")
+    [True, False]
+    """
+    if algorithm == "none":
+        return [True] * len(bodies)
+    check = algorithms[algorithm].verify
+    return [check(data, checksum) for data, checksum in zip(bodies, checksums)]
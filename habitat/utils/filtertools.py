@@ -84,23 +84,15 @@ class UKHASChecksumFixer(object):
 
     @classmethod
     def _sum(cls, protocol, data):
-        if protocol == "crc16-ccitt":
-            return checksums.crc16_ccitt(data)
-        elif protocol == "xor":
-            return checksums.xor(data)
-        elif protocol == "fletcher-16":
-            return checksums.fletcher_16(data)
-        elif protocol == "fletcher-16-256":
-            return checksums.fletcher_16_256(data)
+        if protocol in checksums.algorithms:
+            return checksums.algorithms[protocol].hexdigest(data)
         else:
             return ""
 
     @classmethod
     def _sum_length(cls, protocol):
-        if protocol == "xor":
-            return 2
-        elif protocol in ["crc16-ccitt", "fletcher-16", "fletcher-16-256"]:
-            return 4
+        if protocol in checksums.algorithms:
+            return checksums.algorithms[protocol].digits
         else:
             return 0
 
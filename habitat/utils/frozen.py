@@ -0,0 +1,106 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read-only snapshots of JSON-like documents.
+
+The parser hands configuration documents to parser modules, sensors and
+filters. Rather than deep copying a document every time to stop one of them
+modifying it for everybody else, the document is frozen once with
+:func:`freeze`. The frozen containers are subclasses of :class:`dict` and
+:class:`list`, so compare equal to and may be used in place of the originals,
+but any attempt to modify them raises :exc:`TypeError`.
+
+>>> config = freeze({"fields": [{"name": "altitude"}]})
+>>> config["fields"][0]["name"]
+'altitude'
+>>> config["fields"].append({})
+Traceback (most recent call last):
+    ...
+TypeError: FrozenList is read-only
+
+:func:`copy.deepcopy` of a frozen container gives an ordinary, mutable copy.
+"""
+
+import copy
+
+__all__ = ["FrozenDict", "FrozenList", "freeze", "thaw"]
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(type(self).__name__ + " is read-only")
+
+
+class FrozenDict(dict):
+    """A :class:`dict` that may not be modified"""
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self), ))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    """A :class:`list` that may not be modified"""
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (FrozenList, (list(self), ))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(thing):
+    """
+    Return a read-only copy of *thing*, converting all dicts and lists
+    within it to :class:`FrozenDict` and :class:`FrozenList`.
+
+    Things that are already frozen are returned as they are, so freezing
+    is cheap to repeat.
+    """
+    if isinstance(thing, (FrozenDict, FrozenList)):
+        return thing
+    elif isinstance(thing, dict):
+        return FrozenDict((k, freeze(v)) for k, v in thing.iteritems())
+    elif isinstance(thing, list):
+        return FrozenList(freeze(v) for v in thing)
+    else:
+        return thing
+
+
+def thaw(thing):
+    """Return an ordinary, mutable deep copy of a frozen *thing*."""
+    if isinstance(thing, dict):
+        return dict((k, thaw(v)) for k, v in thing.iteritems())
+    elif isinstance(thing, list):
+        return [thaw(v) for v in thing]
+    else:
+        return copy.deepcopy(thing)
@@ -0,0 +1,703 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An in-memory stand-in for a CouchDB database.
+
+:class:`Database` implements the parts of :class:`couchdbkit.Database` that
+habitat uses, so that the :class:`Parser <habitat.parser.Parser>`,
+:class:`ParserDaemon <habitat.parser_daemon.ParserDaemon>` and
+:class:`Uploader <habitat.uploader.Uploader>` (which all accept a *db*
+argument) can be load tested, or have their CPU cost measured, without a
+CouchDB server or the network in the way::
+
+    db = memory_couch.Database()
+    db.save_doc(payload_configuration)
+    daemon = ParserDaemon(config, db=db)
+
+Views, filters and update handlers are the functions in :mod:`habitat.views`
+(the view ``flight/end_start_including_payloads`` is
+``habitat.views.flight.end_start_including_payloads_map``, and so on), as run
+by the couch-named-python view server. Views are indexed incrementally, so
+querying them is cheap. Validation functions are not run.
+
+The ``_changes`` feed, ``_bulk_docs`` and ``_update`` handlers are reached
+through :attr:`Database.res`, as couchdbkit reaches them, so
+:class:`couchdbkit.Consumer` (and hence
+:class:`habitat.utils.immortal_changes.Consumer`) works unmodified.
+"""
+
+import copy
+import json
+import uuid
+import bisect
+import threading
+
+import couchdbkit.exceptions
+import restkit.errors
+from couch_named_python import ForbiddenError, UnauthorizedError
+
+from . import dynamicloader
+
+__all__ = ["Server", "Database", "ViewResults", "collation_key"]
+
+
+def collation_key(value):
+    """
+    Returns a key that sorts *value* in the same order as CouchDB's view
+    collation: null, false, true, numbers, strings, arrays then objects.
+
+    Strings are compared by code point, rather than with the Unicode
+    Collation Algorithm.
+    """
+    if value is None:
+        return (0, )
+    elif value is False:
+        return (1, 0)
+    elif value is True:
+        return (1, 1)
+    elif isinstance(value, (int, long, float)):
+        return (2, value)
+    elif isinstance(value, basestring):
+        return (3, value)
+    elif isinstance(value, (list, tuple)):
+        return (4, tuple(collation_key(v) for v in value))
+    elif isinstance(value, dict):
+        return (5, tuple((k, collation_key(v))
+                         for k, v in sorted(value.iteritems())))
+    else:
+        raise TypeError("Can't collate {0!r}".format(value))
+
+
+def _to_json(value):
+    """Convert the tuples that view functions emit into lists."""
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((k, _to_json(v)) for k, v in value.iteritems())
+    else:
+        return value
+
+
+def _is_true(value):
+    """Query parameters may be given as booleans or as JSON strings."""
+    return value is True or value == "true"
+
+
+class ViewResults(object):
+    """The rows of a view, which may be iterated over as dicts."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def all(self):
+        """Returns a list of the rows."""
+        return list(self.rows)
+
+    def count(self):
+        """Returns the number of rows."""
+        return len(self.rows)
+
+    def first(self):
+        """Returns the first row, or None if there are none."""
+        return self.rows[0] if self.rows else None
+
+
+class _ViewIndex(object):
+    """The rows emitted by one map function, kept up to date."""
+
+    def __init__(self, map_function):
+        self.map_function = map_function
+        self.by_doc = {}
+        self._keys = None
+        self._rows = None
+
+    def update(self, doc_id, doc):
+        """Re-map the document *doc_id*, which is now *doc* (or deleted)."""
+        old = self.by_doc.pop(doc_id, None)
+        new = None
+        if doc is not None:
+            try:
+                new = [(collation_key(key), _to_json(key), _to_json(value))
+                       for key, value in self.map_function(doc)]
+            except Exception:
+                # CouchDB ignores documents that a view function fails on.
+                new = None
+        if new:
+            self.by_doc[doc_id] = new
+        if old or new:
+            self._keys = self._rows = None
+
+    def _sorted(self):
+        if self._rows is None:
+            rows = sorted((sort_key, doc_id, key, value)
+                          for doc_id, emitted in self.by_doc.iteritems()
+                          for sort_key, key, value in emitted)
+            self._rows = rows
+            self._keys = [r[0] for r in rows]
+        return self._keys, self._rows
+
+    def query(self, startkey=None, endkey=None, descending=False,
+              inclusive_end=True):
+        """Returns (doc_id, key, value) for rows in the requested range."""
+        keys, rows = self._sorted()
+        return _key_range(keys, rows, startkey, endkey, descending,
+                          inclusive_end)
+
+
+def _key_range(keys, rows, startkey, endkey, descending, inclusive_end):
+    """
+    Select rows from *rows*, sorted by the collation keys *keys*, between
+    *startkey* and *endkey*.
+    """
+    first, last = 0, len(rows)
+    if descending:
+        startkey, endkey = endkey, startkey
+        if endkey is not None:
+            last = bisect.bisect_right(keys, collation_key(endkey))
+        if startkey is not None:
+            start = collation_key(startkey)
+            if inclusive_end:
+                first = bisect.bisect_left(keys, start)
+            else:
+                first = bisect.bisect_right(keys, start)
+        selected = rows[first:last]
+        selected.reverse()
+    else:
+        if startkey is not None:
+            first = bisect.bisect_left(keys, collation_key(startkey))
+        if endkey is not None:
+            end = collation_key(endkey)
+            if inclusive_end:
+                last = bisect.bisect_right(keys, end)
+            else:
+                last = bisect.bisect_left(keys, end)
+        selected = rows[first:last]
+    return [row[1:] for row in selected]
+
+
+def _from_docid(rows, startkey, docid, descending):
+    """
+    Drop the (doc_id, key, value) *rows* that have the key *startkey* but
+    come before the document *docid*.
+    """
+    start = collation_key(startkey)
+    i = 0
+    while i < len(rows) and collation_key(rows[i][1]) == start and \
+            (rows[i][0] > docid if descending else rows[i][0] < docid):
+        i += 1
+    return rows[i:]
+
+
+class _Response(object):
+    """Enough of a :class:`couchdbkit.resource.CouchDBResponse`."""
+
+    def __init__(self, json_body=None, stream=None):
+        self.json_body = json_body
+        self._stream = stream
+
+    def body_string(self):
+        return json.dumps(self.json_body)
+
+    def skip_body(self):
+        pass
+
+    def body_stream(self):
+        return self._stream
+
+
+class _ChangesStream(object):
+    """
+    The body of a continuous ``_changes`` feed: :meth:`readline` waits for
+    the next change, returning a blank line every *heartbeat* milliseconds
+    while there are none, or the end of the feed after *timeout*
+    milliseconds without a heartbeat.
+    """
+
+    def __init__(self, db, since, params):
+        self.db = db
+        self.since = since
+        self.params = params
+        self.heartbeat = params.get("heartbeat")
+        self.timeout = params.get("timeout", 60000)
+        self.pending = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+
+    def readline(self):
+        if self.closed:
+            return ""
+
+        with self.db._changed:
+            if not self.pending:
+                self.pending = self.db._changes_since(self.since, self.params)
+            if not self.pending:
+                if self.heartbeat is not None:
+                    self.db._changed.wait(int(self.heartbeat) / 1000.0)
+                else:
+                    self.db._changed.wait(int(self.timeout) / 1000.0)
+                self.pending = self.db._changes_since(self.since, self.params)
+                if not self.pending:
+                    if self.heartbeat is not None:
+                        return "\n"
+                    self.closed = True
+                    return ""
+
+            change = self.pending.pop(0)
+            self.since = change["seq"]
+            return json.dumps(change) + "\n"
+
+
+class _Resource(object):
+    """
+    Routes the HTTP requests that habitat makes directly to
+    :attr:`Database.res` to the :class:`Database`.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, path, **params):
+        path = path.strip("/")
+        if path == "_changes":
+            return self.db._changes_response(params)
+        return _Response(self.db.get(path))
+
+    def put(self, path, payload=None, **params):
+        path = path.strip("/")
+        if path.startswith("_design/"):
+            parts = path.split("/")
+            if len(parts) >= 4 and parts[2] == "_update":
+                doc_id = "/".join(parts[4:]) or None
+                body = self.db.update(parts[1] + "/" + parts[3], doc_id,
+                                      payload, **params)
+                return _Response(body)
+        doc = dict(payload, _id=path)
+        return _Response(self.db.save_doc(doc))
+
+    def post(self, path, payload=None, **params):
+        path = path.strip("/")
+        if path == "_bulk_docs":
+            return _Response(self.db._bulk_docs(payload["docs"]))
+        return self.put(path, payload, **params)
+
+
+class Database(object):
+    """
+    A database held in memory, with the interface of a
+    :class:`couchdbkit.Database`.
+
+    Documents are copied on the way in and the way out, so changing a
+    document returned by the database doesn't change the stored copy.
+    """
+
+    def __init__(self, dbname="habitat"):
+        self.dbname = dbname
+        self.res = _Resource(self)
+
+        self._changed = threading.Condition(threading.RLock())
+        self._docs = {}
+        self._views = {}
+        self._functions = {}
+
+        self._update_seq = 0
+        # (seq, doc id) for every write, in order.
+        self._log_seqs = []
+        self._log_ids = []
+        # The seq of the latest write to each document.
+        self._doc_seqs = {}
+
+    def info(self):
+        """Returns a dict of ``db_name``, ``doc_count`` and ``update_seq``."""
+        with self._changed:
+            return {
+                "db_name": self.dbname,
+                "doc_count": sum(1 for doc in self._docs.itervalues()
+                                 if not doc.get("_deleted")),
+                "update_seq": self._update_seq
+            }
+
+    def _function(self, name, suffix):
+        """Find the view, filter or update function *name* (design/name)."""
+        full_name = name + "_" + suffix
+        try:
+            return self._functions[full_name]
+        except KeyError:
+            pass
+
+        design, function = name.split("/")
+        try:
+            f = dynamicloader.load("habitat.views.{0}.{1}_{2}"
+                                   .format(design, function, suffix))
+        except (ImportError, AttributeError):
+            raise couchdbkit.exceptions.ResourceNotFound(
+                "missing_named_{0}".format(suffix), http_code=404)
+        self._functions[full_name] = f
+        return f
+
+    def get(self, docid, **params):
+        """
+        Returns a copy of the document *docid*, raising
+        :exc:`couchdbkit.exceptions.ResourceNotFound` if it doesn't exist.
+        """
+        with self._changed:
+            doc = self._docs.get(docid)
+            if doc is None or doc.get("_deleted"):
+                raise couchdbkit.exceptions.ResourceNotFound(
+                    "missing", http_code=404)
+            return copy.deepcopy(doc)
+
+    open_doc = get
+    __getitem__ = get
+
+    def doc_exist(self, docid):
+        """Returns True if the document *docid* exists."""
+        with self._changed:
+            doc = self._docs.get(docid)
+            return doc is not None and not doc.get("_deleted")
+
+    __contains__ = doc_exist
+
+    def _write(self, doc):
+        """
+        Store a copy of *doc*, returning a bulk docs style result. Must be
+        called with the lock held.
+        """
+        doc_id = doc.get("_id")
+        if doc_id is None:
+            doc_id = uuid.uuid4().hex
+
+        current = self._docs.get(doc_id)
+        if current is None or (current.get("_deleted") and
+                               "_rev" not in doc):
+            # New (or recreating a deleted) document.
+            if "_rev" in doc and current is None:
+                return {"id": doc_id, "error": "conflict",
+                        "reason": "Document update conflict."}
+            generation = int(current["_rev"].split("-")[0]) if current else 0
+        elif doc.get("_rev") != current["_rev"]:
+            return {"id": doc_id, "error": "conflict",
+                    "reason": "Document update conflict."}
+        else:
+            generation = int(current["_rev"].split("-")[0])
+
+        rev = "{0}-{1}".format(generation + 1, uuid.uuid4().hex)
+        stored = copy.deepcopy(doc)
+        stored["_id"] = doc_id
+        stored["_rev"] = rev
+        self._docs[doc_id] = stored
+
+        self._update_seq += 1
+        self._log_seqs.append(self._update_seq)
+        self._log_ids.append(doc_id)
+        self._doc_seqs[doc_id] = self._update_seq
+
+        visible = None if stored.get("_deleted") else stored
+        for index in self._views.itervalues():
+            index.update(doc_id, visible)
+
+        self._changed.notify_all()
+        return {"id": doc_id, "rev": rev}
+
+    def save_doc(self, doc, **params):
+        """
+        Save *doc*, setting its ``_id`` (if it has none) and ``_rev``.
+
+        Raises :exc:`couchdbkit.exceptions.ResourceConflict` if *doc* is
+        not the latest revision.
+        """
+        with self._changed:
+            result = self._write(doc)
+        if "error" in result:
+            raise couchdbkit.exceptions.ResourceConflict(
+                result["reason"], http_code=409)
+        doc["_id"] = result["id"]
+        doc["_rev"] = result["rev"]
+        result["ok"] = True
+        return result
+
+    def _bulk_docs(self, docs):
+        """Save each of *docs*, returning a list of results."""
+        with self._changed:
+            return [self._write(doc) for doc in docs]
+
+    def save_docs(self, docs, **params):
+        """
+        Save a list of *docs*, returning a list of ``{"id", "rev"}`` results
+        and setting ``_id`` and ``_rev`` on each saved doc. If any could
+        not be saved, :exc:`couchdbkit.exceptions.BulkSaveError` is raised,
+        with the results as its ``results`` attribute.
+        """
+        results = self._bulk_docs(docs)
+        errors = []
+        for doc, result in zip(docs, results):
+            if "error" in result:
+                errors.append(result)
+            else:
+                doc["_id"] = result["id"]
+                doc["_rev"] = result["rev"]
+        if errors:
+            raise couchdbkit.exceptions.BulkSaveError(errors, results)
+        return results
+
+    bulk_save = save_docs
+
+    def delete_doc(self, doc, **params):
+        """Delete *doc*, which must be the latest revision."""
+        if isinstance(doc, basestring):
+            doc = {"_id": doc, "_rev": self[doc]["_rev"]}
+        stub = {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+        return self.save_doc(stub)
+
+    def update(self, name, docid=None, body=None, **params):
+        """
+        Run the update handler *name* (design/name) against the document
+        *docid*, saving the document it returns and returning its response.
+        """
+        handler = self._function(name, "update")
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        req = {"id": docid, "body": body, "query": params}
+
+        with self._changed:
+            doc = None
+            if docid is not None and self.doc_exist(docid):
+                doc = copy.deepcopy(self._docs[docid])
+
+            try:
+                doc, response = handler(doc, req)
+            except ForbiddenError as e:
+                raise restkit.errors.RequestFailed(str(e), http_code=403)
+            except UnauthorizedError as e:
+                raise restkit.errors.Unauthorized(str(e), http_code=401)
+
+            if doc is not None:
+                result = self._write(doc)
+                if "error" in result:
+                    raise couchdbkit.exceptions.ResourceConflict(
+                        result["reason"], http_code=409)
+            return response
+
+    def view(self, view_name, **params):
+        """
+        Query the view *view_name* (design/name), returning
+        :class:`ViewResults`.
+
+        Supports the ``key``, ``startkey``, ``startkey_docid``, ``endkey``,
+        ``inclusive_end``, ``descending``, ``skip``, ``limit`` and
+        ``include_docs`` parameters. Rows whose value is an object with an
+        ``_id`` are linked documents, as in CouchDB.
+        """
+        with self._changed:
+            index = self._views.get(view_name)
+            if index is None:
+                index = _ViewIndex(self._function(view_name, "map"))
+                for doc_id, doc in self._docs.iteritems():
+                    if not doc.get("_deleted"):
+                        index.update(doc_id, doc)
+                self._views[view_name] = index
+
+            if "key" in params:
+                params["startkey"] = params["endkey"] = params["key"]
+            rows = index.query(params.get("startkey"), params.get("endkey"),
+                               _is_true(params.get("descending")),
+                               params.get("inclusive_end", True) not in
+                               (False, "false"))
+            if "startkey" in params and "startkey_docid" in params:
+                rows = _from_docid(rows, params["startkey"],
+                                   params["startkey_docid"],
+                                   _is_true(params.get("descending")))
+            rows = self._page(rows, params)
+
+            include_docs = _is_true(params.get("include_docs"))
+            results = []
+            for doc_id, key, value in rows:
+                row = {"id": doc_id, "key": copy.deepcopy(key),
+                       "value": copy.deepcopy(value)}
+                if include_docs:
+                    if isinstance(value, dict) and "_id" in value:
+                        linked = value["_id"]
+                    else:
+                        linked = doc_id
+                    row["doc"] = self._copy_or_none(linked)
+                results.append(row)
+            return ViewResults(results)
+
+    def all_docs(self, by_seq=False, **params):
+        """
+        Query ``_all_docs``: either the documents listed in ``keys``, or a
+        range of documents sorted by ID.
+        """
+        with self._changed:
+            include_docs = _is_true(params.get("include_docs"))
+            if "keys" in params:
+                rows = []
+                for key in params["keys"]:
+                    doc = self._docs.get(key)
+                    if doc is None:
+                        rows.append({"key": key, "error": "not_found"})
+                        continue
+                    value = {"rev": doc["_rev"]}
+                    if doc.get("_deleted"):
+                        value["deleted"] = True
+                    row = {"id": key, "key": key, "value": value}
+                    if include_docs:
+                        row["doc"] = self._copy_or_none(key)
+                    rows.append(row)
+                return ViewResults(rows)
+
+            doc_ids = sorted(doc_id for doc_id, doc in self._docs.iteritems()
+                             if not doc.get("_deleted"))
+            keys = [collation_key(doc_id) for doc_id in doc_ids]
+            selected = _key_range(keys, [(k, i) for k, i in
+                                         zip(keys, doc_ids)],
+                                  params.get("startkey"),
+                                  params.get("endkey"),
+                                  _is_true(params.get("descending")),
+                                  params.get("inclusive_end", True) not in
+                                  (False, "false"))
+            rows = []
+            for (doc_id, ) in self._page(selected, params):
+                row = {"id": doc_id, "key": doc_id,
+                       "value": {"rev": self._docs[doc_id]["_rev"]}}
+                if include_docs:
+                    row["doc"] = self._copy_or_none(doc_id)
+                rows.append(row)
+            return ViewResults(rows)
+
+    def _page(self, rows, params):
+        skip = int(params.get("skip", 0))
+        limit = params.get("limit")
+        if limit is not None:
+            return rows[skip:skip + int(limit)]
+        return rows[skip:]
+
+    def _copy_or_none(self, doc_id):
+        doc = self._docs.get(doc_id)
+        if doc is None or doc.get("_deleted"):
+            return None
+        return copy.deepcopy(doc)
+
+    def _changes_since(self, since, params):
+        """
+        Returns the rows of the changes feed after *since*, for the latest
+        revision of each document. Must be called with the lock held.
+        """
+        since = int(since or 0)
+        filter_function = None
+        if params.get("filter"):
+            filter_function = self._function(params["filter"], "filter")
+        req = {"query": params}
+        include_docs = _is_true(params.get("include_docs"))
+
+        results = []
+        start = bisect.bisect_right(self._log_seqs, since)
+        for seq, doc_id in zip(self._log_seqs[start:],
+                               self._log_ids[start:]):
+            if self._doc_seqs[doc_id] != seq:
+                # Superseded by a later write.
+                continue
+            doc = self._docs[doc_id]
+            if filter_function is not None:
+                try:
+                    if not filter_function(doc, req):
+                        continue
+                except Exception:
+                    continue
+            row = {"seq": seq, "id": doc_id,
+                   "changes": [{"rev": doc["_rev"]}]}
+            if doc.get("_deleted"):
+                row["deleted"] = True
+            if include_docs:
+                row["doc"] = copy.deepcopy(doc)
+            results.append(row)
+            if "limit" in params and len(results) >= int(params["limit"]):
+                break
+        return results
+
+    def changes(self, since=0, **params):
+        """
+        Returns the ``_changes`` feed after *since* as
+        ``{"results": [...], "last_seq": seq}``. ``filter`` and
+        ``include_docs`` are supported.
+        """
+        with self._changed:
+            results = self._changes_since(since, params)
+            last_seq = results[-1]["seq"] if results else self._update_seq
+            return {"results": results, "last_seq": last_seq}
+
+    def _changes_response(self, params):
+        """Respond to a ``_changes`` request, for any kind of feed."""
+        params = dict(params)
+        since = params.pop("since", 0)
+        feed = params.pop("feed", "normal")
+        if feed == "continuous":
+            return _Response(stream=_ChangesStream(self, since, params))
+
+        with self._changed:
+            if feed == "longpoll" and not self._changes_since(since, params):
+                self._changed.wait(int(params.get("timeout", 60000)) / 1000.0)
+            return _Response(self.changes(since, **params))
+
+
+class Server(object):
+    """
+    A collection of in-memory :class:`Database` objects, created as they
+    are asked for, with the interface of a :class:`couchdbkit.Server`.
+    """
+
+    def __init__(self, uri=None):
+        self._lock = threading.Lock()
+        self._databases = {}
+
+    def __getitem__(self, dbname):
+        return self.get_or_create_db(dbname)
+
+    def __contains__(self, dbname):
+        with self._lock:
+            return dbname in self._databases
+
+    def all_dbs(self):
+        """Returns the names of the databases."""
+        with self._lock:
+            return sorted(self._databases)
+
+    def get_or_create_db(self, dbname):
+        """Returns the :class:`Database` *dbname*, creating it if need be."""
+        with self._lock:
+            db = self._databases.get(dbname)
+            if db is None:
+                db = self._databases[dbname] = Database(dbname)
+            return db
+
+    create_db = get_or_create_db
+
+    def delete_db(self, dbname):
+        """Forget the database *dbname*."""
+        with self._lock:
+            del self._databases[dbname]
@@ -0,0 +1,238 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process aggregation of counters and timers.
+
+Sending a statsd packet for every event costs a system call each time, and
+parsing a single string can generate a dozen events. Instead, habitat counts
+events in memory with :func:`increment` and :func:`timing` (which cost a
+lock and a dictionary update) and a background thread sends the totals to a
+*sink* every few seconds. Bucket names are those that were previously sent
+straight to statsd.
+
+Timers keep at most :attr:`TimerSamples.size` samples per flush interval,
+chosen at random from all those recorded (a reservoir sample), along with
+the number recorded. The kept samples are sent with a statsd sample rate,
+so statsd's counts and rates still account for every sample and its
+percentiles are estimated from a fair sample, while memory use and the
+number of packets sent stay bounded.
+
+By default, totals are sent every 10 seconds to statsd with the bucket
+prefix ``habitat``. Use :func:`configure` to change that; any object with a
+``send(counters, timings)`` method may be used as the sink.
+
+The background thread is started when the first event is recorded (and
+restarted in a process forked after that).
+"""
+
+import os
+import time
+import random
+import atexit
+import logging
+import functools
+import threading
+
+import statsd
+
+logger = logging.getLogger("habitat.utils.metrics")
+
+__all__ = ["TimerSamples", "Aggregator", "StatsdSink", "configure",
+           "increment", "timing", "timed", "flush"]
+
+
+class TimerSamples(object):
+    """
+    Up to :attr:`size` samples chosen uniformly at random from the
+    :attr:`count` samples recorded in a timer bucket during one flush
+    interval.
+    """
+
+    __slots__ = ["count", "samples"]
+
+    size = 100
+
+    def __init__(self):
+        self.count = 0
+        self.samples = []
+
+    def add(self, ms):
+        """Record a sample of *ms* milliseconds."""
+        self.count += 1
+        if len(self.samples) < self.size:
+            self.samples.append(ms)
+        else:
+            i = random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = ms
+
+    @property
+    def sample_rate(self):
+        """The fraction of the recorded samples that were kept."""
+        return float(len(self.samples)) / self.count
+
+    def __repr__(self):
+        return "<TimerSamples count={0} kept={1}>" \
+                .format(self.count, len(self.samples))
+
+
+class StatsdSink(object):
+    """
+    Sends aggregated metrics to statsd, with one packet per counter and per
+    kept timing sample.
+    """
+
+    def __init__(self, prefix="habitat", host=None, port=None):
+        self.client = statsd.StatsdClient(host=host, port=port,
+                                          prefix=prefix)
+
+    def send(self, counters, timings):
+        """
+        Send *counters* (bucket: count) and *timings*
+        (bucket: :class:`TimerSamples`)
+        """
+        for bucket, count in counters.iteritems():
+            self.client.incr(bucket, count)
+        for bucket, timer in timings.iteritems():
+            rate = timer.sample_rate
+            for ms in timer.samples:
+                if rate >= 1:
+                    self.client.timing(bucket, ms)
+                else:
+                    # The client's own sample_rate randomly drops packets;
+                    # these have already been sampled, so just need the rate.
+                    self.client._send(bucket,
+                                      "{0}|ms|@{1!r}".format(ms, rate))
+
+
+class Aggregator(object):
+    """
+    Accumulates counters and samples timings, giving the totals to *sink*
+    every *interval* seconds.
+    """
+
+    def __init__(self, sink, interval=10):
+        self.sink = sink
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+        self._thread = None
+        self._pid = None
+
+    def increment(self, bucket, delta=1):
+        """Add *delta* to the counter *bucket*."""
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        with self._lock:
+            self._counters[bucket] = self._counters.get(bucket, 0) + delta
+
+    def timing(self, bucket, ms):
+        """Record a timing sample of *ms* milliseconds in *bucket*."""
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        with self._lock:
+            timer = self._timings.get(bucket)
+            if timer is None:
+                timer = self._timings[bucket] = TimerSamples()
+            timer.add(ms)
+
+    def flush(self):
+        """Give everything recorded since the last flush to the sink."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            timings, self._timings = self._timings, {}
+
+        if counters or timings:
+            try:
+                self.sink.send(counters, timings)
+            except:
+                logger.exception("Exception while sending metrics")
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            if self._pid is not None and self._pid != os.getpid():
+                # We've been forked: what's been recorded so far is our
+                # parent's to send.
+                self._counters = {}
+                self._timings = {}
+
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name="habitat metrics")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+_aggregator = Aggregator(StatsdSink())
+
+
+def configure(sink=None, interval=None):
+    """
+    Change the sink that metrics are sent to and/or the flush interval.
+    Anything already recorded is flushed to the old sink first.
+    """
+    _aggregator.flush()
+    if sink is not None:
+        _aggregator.sink = sink
+    if interval is not None:
+        _aggregator.interval = interval
+
+
+def increment(bucket, delta=1):
+    """Add *delta* to the counter *bucket*."""
+    _aggregator.increment(bucket, delta)
+
+
+def timing(bucket, ms):
+    """Record a timing sample of *ms* milliseconds in *bucket*."""
+    _aggregator.timing(bucket, ms)
+
+
+def timed(bucket):
+    """
+    Decorator that records the time taken by each call to the decorated
+    function in *bucket*.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _aggregator.timing(bucket, int((time.time() - start) * 1000))
+        return wrapper
+    return decorator
+
+
+def flush():
+    """Send everything recorded so far now."""
+    _aggregator.flush()
+
+
+atexit.register(flush)
@@ -22,19 +22,23 @@ import logging
 import logging.handlers
 import yaml
 
+from . import dynamicloader, metrics
+
 logger = logging.getLogger("habitat.utils.startup")
 
 
-def load_config():
+def load_config(filename=None):
     """
     Loads the habitat config.
 
-    The path to the configuration YAML file can be specified as the single
-    command line argument (read from ``sys.argv[1]``) or will default to
-    ``./habitat.yml``.
+    The path to the configuration YAML file can be given as *filename*,
+    specified as the single command line argument (read from
+    ``sys.argv[1]``) or will default to ``./habitat.yml``.
     """
 
-    if len(sys.argv) == 2:
+    if filename is not None:
+        pass
+    elif len(sys.argv) == 2:
         filename = sys.argv[1]
     elif len(sys.argv) <= 1:
         filename = "./habitat.yml"
@@ -138,6 +142,26 @@ def setup_logging(config, daemon_name):
     logger.info("Log initialised")
 
 
+def setup_metrics(config):
+    """
+    Configure :mod:`habitat.utils.metrics` from the optional ``metrics``
+    section of *config*.
+
+    ``interval`` sets the number of seconds between flushes, and ``sink``
+    may give the Python path of a class to send metrics to instead of
+    statsd, which is created with the keyword arguments in
+    ``sink_options``.
+    """
+    metrics_config = config.get("metrics") or {}
+
+    sink = None
+    if "sink" in metrics_config:
+        sink_class = dynamicloader.load(metrics_config["sink"])
+        sink = sink_class(**metrics_config.get("sink_options", {}))
+
+    metrics.configure(sink=sink, interval=metrics_config.get("interval"))
+
+
 def main(main_class):
     """
     Main function for habitat daemons. Loads config, sets up logging, and runs.
@@ -152,4 +176,5 @@ def main(main_class):
     config = load_config()
     daemon_name = main_class.__name__.lower()
     setup_logging(config, daemon_name)
+    setup_metrics(config)
     main_class(config, daemon_name).run()
@@ -0,0 +1,243 @@
+# Copyright 2012 (C) Daniel Richman, Adam Greig
+#
+# This file is part of habitat.
+#
+# habitat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# habitat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with habitat.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-stage latency histograms.
+
+The parser times each stage of its pipeline (filters, callsign extraction,
+configuration lookup, parsing and saving) with :func:`stage`::
+
+    with tracing.stage("pre_parse", callsign):
+        ...
+
+Durations are counted into :class:`Histogram` objects, one per stage and one
+per (stage, callsign) pair, which take a fixed amount of memory however many
+samples they hold, and are accurate to within about 5%. :func:`stats` returns
+the 50th, 95th and 99th percentiles of each, and :func:`start_logging` logs a
+summary periodically.
+
+To bound memory, at most :attr:`StageTracer.max_callsigns` callsigns are
+tracked separately; stages are always timed overall.
+"""
+
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger("habitat.utils.tracing")
+
+__all__ = ["Histogram", "StageTracer", "stage", "stats", "reset",
+           "start_logging"]
+
+
+class Histogram(object):
+    """
+    Counts durations (in seconds) into logarithmically sized buckets from
+    *minimum* to *maximum* seconds, each *ratio* times wider than the last.
+    """
+
+    def __init__(self, minimum=1e-6, maximum=100.0, ratio=2 ** 0.125):
+        self.minimum = minimum
+        self._scale = 1 / math.log(ratio)
+        self.ratio = ratio
+        self.counts = [0] * (int(math.log(maximum / minimum) * self._scale)
+                             + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Count a duration of *seconds*."""
+        if seconds <= self.minimum:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.minimum) * self._scale)
+                        + 1, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        Returns an estimate of the *p*-th percentile, or None if nothing has
+        been recorded.
+        """
+        if not self.count:
+            return None
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                break
+
+        if index == 0:
+            return self.minimum
+        elif index == len(self.counts) - 1:
+            # Durations longer than maximum all end up in the last bucket.
+            return self.max
+        # The geometric middle of the bucket, but no more than the largest
+        # duration actually seen.
+        middle = self.minimum * self.ratio ** (index - 0.5)
+        return min(middle, self.max)
+
+    def summary(self):
+        """A dict of count, mean, p50, p95, p99 and max (in seconds)."""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None
+        }
+
+
+class _Timer(object):
+    """Context manager returned by :meth:`StageTracer.stage`"""
+
+    __slots__ = ["tracer", "name", "callsign", "start"]
+
+    def __init__(self, tracer, name, callsign):
+        self.tracer = tracer
+        self.name = name
+        self.callsign = callsign
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, time.time() - self.start,
+                           self.callsign)
+
+
+class StageTracer(object):
+    """Keeps a :class:`Histogram` for every stage, and stage and callsign."""
+
+    max_callsigns = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._callsigns = {}
+        self._thread = None
+
+    def stage(self, name, callsign=None):
+        """
+        Returns a context manager that times the stage *name*, recording it
+        against *callsign* too if it's given.
+        """
+        return _Timer(self, name, callsign)
+
+    def record(self, name, seconds, callsign=None):
+        """Record that stage *name* took *seconds*."""
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = Histogram()
+            histogram.record(seconds)
+
+            if callsign is None:
+                return
+
+            stages = self._callsigns.get(callsign)
+            if stages is None:
+                if len(self._callsigns) >= self.max_callsigns:
+                    return
+                stages = self._callsigns[callsign] = {}
+            histogram = stages.get(name)
+            if histogram is None:
+                histogram = stages[name] = Histogram()
+            histogram.record(seconds)
+
+    def stats(self):
+        """
+        Returns ``{"stages": {stage: summary}, "callsigns": {callsign:
+        {stage: summary}}}``, where each summary is that given by
+        :meth:`Histogram.summary`.
+        """
+        with self._lock:
+            return {
+                "stages": dict((name, h.summary())
+                               for name, h in self._stages.iteritems()),
+                "callsigns": dict(
+                    (callsign, dict((name, h.summary())
+                                    for name, h in stages.iteritems()))
+                    for callsign, stages in self._callsigns.iteritems())
+            }
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._stages = {}
+            self._callsigns = {}
+
+    def log_summary(self):
+        """Log the percentiles of each stage at INFO level."""
+        stages = self.stats()["stages"]
+        for name in sorted(stages):
+            s = stages[name]
+            logger.info("Stage {name}: {count} calls, p50 {p50:.2f}ms "
+                        "p95 {p95:.2f}ms p99 {p99:.2f}ms max {max:.2f}ms"
+                        .format(name=name, count=s["count"],
+                                p50=s["p50"] * 1000, p95=s["p95"] * 1000,
+                                p99=s["p99"] * 1000, max=s["max"] * 1000))
+
+    def start_logging(self, interval):
+        """Call :meth:`log_summary` every *interval* seconds, in a thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.log_summary()
+                except:
+                    logger.exception("Exception while logging stage times")
+
+        self._thread = threading.Thread(target=run, name="habitat tracing")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+_tracer = StageTracer()
+
+
+def stage(name, callsign=None):
+    """Time a stage with the default :class:`StageTracer`."""
+    return _tracer.stage(name, callsign)
+
+
+def stats():
+    """Get the statistics of the default :class:`StageTracer`."""
+    return _tracer.stats()
+
+
+def reset():
+    """Reset the default :class:`StageTracer`."""
+    _tracer.reset()
+
+
+def start_logging(interval):
+    """Periodically log a summary of the default :class:`StageTracer`."""
+    _tracer.start_logging(interval)
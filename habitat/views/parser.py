@@ -17,7 +17,8 @@
 """
 Functions for the parser design document.
 
-Contains a filter to select unparsed payload_telemetry.
+Contains filters to select unparsed payload_telemetry and configuration
+documents.
 """
 
 from couch_named_python import version
@@ -33,3 +34,20 @@ def unparsed_filter(doc, req):
         if 'data' in doc and '_parsed' not in doc['data']:
             return True
     return False
+
+@version(1)
+def config_filter(doc, req):
+    """
+    Filter: ``parser/config``
+
+    Only select flight and payload_configuration documents, and deletions
+    (which no longer have a type) so that they may be forgotten.
+
+    Used by :class:`habitat.config_index.ConfigIndex` to keep its index
+    of configuration documents up to date.
+    """
+    if '_deleted' in doc and doc['_deleted']:
+        return True
+    if 'type' in doc and doc['type'] in ("flight", "payload_configuration"):
+        return True
+    return False